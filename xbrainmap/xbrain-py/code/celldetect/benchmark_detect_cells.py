@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Benchmark for the cell detection modes on synthetic probability maps.
+
+Spheres from create_synth_dict() are placed at random, known positions in a noisy volume. The 
+greedy search (detect_cells_incremental(), which returns the same cells as detect_cells()) and
+detect_cells_sparse() are run on it, and their run time and the agreement between their centroids 
+are printed. Run it from this directory, e.g. "python benchmark_detect_cells.py --shape 100 100 100".
+
+With --suite, every detection mode is run on volumes of several sizes and cell densities and the 
+throughput, memory and accuracy against the true sphere centers are written to a JSON file, e.g.
+"python benchmark_detect_cells.py --suite --output benchmark.json". Comparing the files of two 
+versions of the code shows regressions of the cell detection hot path.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import platform
+import time
+import numpy as np
+from scipy import ndimage as ndi
+from scipy.spatial import cKDTree
+from create_synth_dict import create_synth_dict
+from compute3dvec import stamp_template
+from detect_cells import detect_cells, detect_cells_incremental, detect_cells_sparse
+from memory_usage import peak_rss_mb, traced_peak_mb
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['make_synthetic_volume',
+           'match_centroids',
+           'compare_detect_modes',
+           'detect_modes',
+           'benchmark_detect',
+           'run_benchmark_suite']
+
+# Cell detection functions benchmarked by run_benchmark_suite(), by name.
+detect_modes = {'greedy': detect_cells,
+                'incremental': detect_cells_incremental,
+                'incremental_single': lambda *args: detect_cells_incremental(*args, single_precision=True),
+                'sparse': detect_cells_sparse,
+                'sparse_single': lambda *args: detect_cells_sparse(*args, single_precision=True)}
+
+
+def make_synthetic_volume(shape, no_of_cells, cell_size, noise=0.2, seed=0):
+    """
+    Creates a synthetic cell probability map with spherical cells at random positions.
+    
+    Parameters
+    ----------
+    shape : tuple
+        Nr x Nc x Nz shape of the volume
+    no_of_cells : int
+        number of spheres to place (spheres may overlap)
+    cell_size : int
+        size of the spheres, same meaning as initial_template_size of detect_cells()
+    noise : float
+        maximum of the uniform background noise
+    seed : int
+        seed of the random generator
+    
+    Returns
+    -------
+    ndarray
+        Nr x Nc x Nz float32 probability map
+    ndarray
+        no_of_cells x 3 matrix with the center of each sphere
+    """
+    
+    rng = np.random.RandomState(seed)
+    volume = (noise * rng.rand(*shape)).astype('float32')
+    box_radius = np.ceil(cell_size/2) + 1
+    dict = create_synth_dict(np.atleast_1d(cell_size), box_radius)
+    box_length = int(round(np.shape(dict)[0] ** (1/3)))
+    
+    centers = np.zeros((no_of_cells, 3))
+    for cell in range(no_of_cells):
+        which_loc = rng.randint(np.prod(shape))
+        cell_idx = stamp_template(volume, dict[:, 0], which_loc, box_length, 1)
+        centers[cell] = [np.mean(idx) for idx in cell_idx]
+    # Soften the sphere edges the way a classifier output would.
+    volume = ndi.gaussian_filter(volume, 1)
+    return volume, np.round(centers)
+
+
+def match_centroids(centroids, reference, max_distance):
+    """
+    Counts the reference centroids which have a centroid within "max_distance" voxels.
+    
+    Parameters
+    ----------
+    centroids : ndarray
+        D x 3 (or more columns) matrix of detected centroids
+    reference : ndarray
+        R x 3 (or more columns) matrix of reference centroids
+    max_distance : float
+        largest distance for a centroid to match a reference centroid
+    
+    Returns
+    -------
+    int
+        number of matched pairs, each reference centroid is matched at most once.
+    """
+    
+    if len(centroids) == 0 or len(reference) == 0:
+        return 0
+    distances, nearest = cKDTree(reference[:, :3]).query(centroids[:, :3], distance_upper_bound=max_distance)
+    # Count each reference centroid once, by its closest centroid.
+    return len(np.unique(nearest[np.isfinite(distances)]))
+
+
+def compare_detect_modes(shape, no_of_cells, cell_size, probability_threshold=0.2, 
+                         stopping_criterion=0.47, dilation_size=8, seed=0):
+    """
+    Runs the greedy and sparse cell detection on the same synthetic volume and returns their run times
+    and the agreement of their centroids.
+    
+    Returns
+    -------
+    dict
+        run time of each mode, number of detected cells of each mode and number of sparse centroids 
+        which match a greedy centroid within cell_size / 2 voxels.
+    """
+    
+    volume, centers = make_synthetic_volume(shape, no_of_cells, cell_size, seed=seed)
+    results = {}
+    start_time = time.time()
+    greedy_centroids, greedy_map = detect_cells_incremental(volume, probability_threshold, stopping_criterion, 
+                                                            cell_size, dilation_size, no_of_cells * 2)
+    results['greedy_sec'] = time.time() - start_time
+    start_time = time.time()
+    sparse_centroids, sparse_map = detect_cells_sparse(volume, probability_threshold, stopping_criterion, 
+                                                       cell_size, dilation_size, no_of_cells * 2)
+    results['sparse_sec'] = time.time() - start_time
+    results['greedy_cells'] = len(greedy_centroids)
+    results['sparse_cells'] = len(sparse_centroids)
+    results['matched_cells'] = match_centroids(sparse_centroids, greedy_centroids, cell_size / 2)
+    return results
+
+
+def benchmark_detect(detect, volume, centers, cell_size, probability_threshold=0.2, stopping_criterion=0.47,
+                     dilation_size=8, max_no_cells=None, trace_memory=False):
+    """
+    Runs one cell detection function on a synthetic volume and measures it.
+    
+    Parameters
+    ----------
+    detect : function
+        detect_cells() or a function with the same arguments and outputs
+    volume : ndarray
+        probability map from make_synthetic_volume()
+    centers : ndarray
+        true sphere centers from make_synthetic_volume()
+    cell_size : int
+        size of the spheres, used as initial_template_size
+    max_no_cells : int, optional
+        default is twice the number of spheres, so the stopping criterion ends the search.
+    trace_memory : bool, optional
+        run the detection a second time with tracemalloc to measure the memory it allocates. The 
+        timed run is never traced.
+    
+    Returns
+    -------
+    dict
+        sec, voxels_per_sec, sec_per_cell, detected_cells, recall (fraction of true centers with a 
+        detected centroid within cell_size / 2 voxels), precision (fraction of detected centroids 
+        within cell_size / 2 voxels of a true center), peak_rss_mb and, with trace_memory, 
+        traced_peak_mb.
+    """
+    
+    if max_no_cells is None:
+        max_no_cells = 2 * len(centers)
+    args = (volume, probability_threshold, stopping_criterion, cell_size, dilation_size, max_no_cells)
+    start_time = time.time()
+    centroids, new_map = detect(*args)
+    sec = time.time() - start_time
+    
+    results = {}
+    results['sec'] = sec
+    results['voxels_per_sec'] = volume.size / sec
+    results['detected_cells'] = len(centroids)
+    results['sec_per_cell'] = sec / len(centroids) if len(centroids) else None
+    results['recall'] = match_centroids(centroids, centers, cell_size / 2) / len(centers) if len(centers) else None
+    results['precision'] = (match_centroids(centers, centroids, cell_size / 2) / len(centroids) 
+                            if len(centroids) else None)
+    results['peak_rss_mb'] = peak_rss_mb()
+    if trace_memory:
+        _, results['traced_peak_mb'] = traced_peak_mb(detect, *args)
+    return results
+
+
+def run_benchmark_suite(shapes, densities, modes, cell_size=18, output=None, trace_memory=False, seed=0):
+    """
+    Benchmarks the cell detection modes on synthetic volumes of every shape and cell density.
+    
+    Parameters
+    ----------
+    shapes : list of tuple
+        Nr x Nc x Nz shapes of the synthetic volumes
+    densities : list of float
+        number of spheres per million voxels
+    modes : list of str
+        names of the detection functions in detect_modes
+    cell_size : int
+        size of the spheres
+    output : str, optional
+        name of the JSON file the results are written to
+    trace_memory : bool, optional
+        also measure the memory allocated by each detection, see benchmark_detect().
+    seed : int
+        seed of the random generator
+    
+    Returns
+    -------
+    list of dict
+        one result of benchmark_detect() for each shape, density and mode, with the shape, density, 
+        number of spheres and mode added.
+    """
+    
+    # Load the FFT and filter code of each mode before the timed runs.
+    volume, centers = make_synthetic_volume((32, 32, 32), 1, cell_size, seed=seed)
+    for mode in modes:
+        detect_modes[mode](volume, 0.2, 0.47, cell_size, 8, 1)
+    
+    results = []
+    for shape in shapes:
+        for density in densities:
+            no_of_cells = max(int(round(density * np.prod(shape) / 1e6)), 1)
+            volume, centers = make_synthetic_volume(shape, no_of_cells, cell_size, seed=seed)
+            for mode in modes:
+                result = benchmark_detect(detect_modes[mode], volume, centers, cell_size, 
+                                          trace_memory=trace_memory)
+                result.update({'mode': mode, 'shape': list(shape), 'density': density, 
+                               'true_cells': no_of_cells, 'cell_size': cell_size})
+                print("%s %s %d cells: %.2f Sec, %.3g voxels/Sec, recall %.2f, precision %s" % 
+                      (mode, 'x'.join(str(n) for n in shape), no_of_cells, result['sec'], 
+                       result['voxels_per_sec'], result['recall'], result['precision']))
+                results.append(result)
+    
+    if output is not None:
+        with open(output, 'w') as json_file:
+            json.dump({'host': platform.node(), 'python': platform.python_version(), 
+                       'numpy': np.__version__, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'seed': seed, 'results': results}, json_file, indent=2)
+        print("Benchmark results written to %s" % output)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare greedy and sparse cell detection.")
+    parser.add_argument('--shape', type=int, nargs=3, default=[100, 100, 100])
+    parser.add_argument('--cells', type=int, default=50)
+    parser.add_argument('--cell-size', type=int, default=18)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--suite', action='store_true', 
+                        help="run every mode on cubes of each --sizes and --densities")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 100, 128], 
+                        help="edge lengths of the suite volumes")
+    parser.add_argument('--densities', type=float, nargs='+', default=[10, 40], 
+                        help="suite cells per million voxels")
+    parser.add_argument('--modes', nargs='+', default=['greedy', 'incremental', 'sparse'], 
+                        choices=sorted(detect_modes))
+    parser.add_argument('--trace-memory', action='store_true')
+    parser.add_argument('--output', default='benchmark_detect_cells.json')
+    args = parser.parse_args()
+    if args.suite:
+        run_benchmark_suite([(n, n, n) for n in args.sizes], args.densities, args.modes, args.cell_size, 
+                            args.output, args.trace_memory, args.seed)
+        raise SystemExit
+    results = compare_detect_modes(tuple(args.shape), args.cells, args.cell_size, seed=args.seed)
+    print("Greedy: %d cells in %.2f Sec, Sparse: %d cells in %.2f Sec, speedup %.1f" % 
+          (results['greedy_cells'], results['greedy_sec'], results['sparse_cells'], results['sparse_sec'],
+           results['greedy_sec'] / results['sparse_sec']))
+    print("%d sparse cells match a greedy cell" % results['matched_cells'])
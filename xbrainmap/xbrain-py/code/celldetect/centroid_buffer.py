@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Module for accumulating detected cell centroids without copying all of them for every new cell.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['centroid_dtype',
+           'CentroidBuffer',
+           'duplicate_centroids']
+
+# One record per detected cell. score is the correlation between the template and the probability
+# map, radius is the size of the matched template and subvolume is the index of the sub-volume the
+# cell was detected in (-1 if unknown).
+centroid_dtype = np.dtype([(str('x'), 'int32'), (str('y'), 'int32'), (str('z'), 'int32'),
+                           (str('score'), 'float32'), (str('radius'), 'float32'),
+                           (str('subvolume'), 'int32')])
+
+
+class CentroidBuffer(object):
+    """
+    Growable array of centroid_dtype records. The storage doubles when it is full, so appending D 
+    cells costs O(D) copies instead of the O(D**2) of np.vstack.
+    
+    Parameters
+    ----------
+    capacity : int
+        initial number of records to allocate.
+    """
+    
+    def __init__(self, capacity=64):
+        self._records = np.zeros(max(int(capacity), 1), dtype=centroid_dtype)
+        self._count = 0
+    
+    def __len__(self):
+        return self._count
+    
+    def _reserve(self, count):
+        if count > len(self._records):
+            records = np.zeros(max(count, 2 * len(self._records)), dtype=centroid_dtype)
+            records[:self._count] = self._records[:self._count]
+            self._records = records
+    
+    def append(self, x, y, z, score, radius, subvolume=-1):
+        """
+        Adds one centroid.
+        """
+        
+        self._reserve(self._count + 1)
+        self._records[self._count] = (x, y, z, score, radius, subvolume)
+        self._count += 1
+    
+    def extend(self, records):
+        """
+        Adds an array of centroid_dtype records.
+        """
+        
+        self._reserve(self._count + len(records))
+        self._records[self._count : self._count + len(records)] = records
+        self._count += len(records)
+    
+    @property
+    def records(self):
+        """
+        The centroid_dtype records added so far. This is a view, it changes with the buffer.
+        """
+        
+        return self._records[:self._count]
+    
+    def as_matrix(self):
+        """
+        Returns the centroids as the D x 4 matrix returned by detect_cells(): (x, y, z) coordinate in
+        columns 1-3 and the correlation in column 4.
+        """
+        
+        records = self.records
+        return np.column_stack((records['x'], records['y'], records['z'], 
+                                records['score'])).astype('float64').reshape(-1, 4)
+    
+    def flush_to_dataset(self, dataset, offset=None):
+        """
+        Writes the centroids into an HDF5 dataset of centroid_dtype records. The dataset must be 
+        resizable along its first axis if it is too short.
+        
+        Parameters
+        ----------
+        dataset : data set object
+            one dimensional dataset created with dtype=centroid_dtype
+        offset : int, optional
+            first row to write, by default the centroids are appended after the last row.
+        
+        Returns
+        -------
+        int
+            the row after the last written centroid
+        """
+        
+        if offset is None:
+            offset = dataset.shape[0]
+        end = offset + self._count
+        if end > dataset.shape[0]:
+            dataset.resize((end,))
+        if self._count > 0:
+            dataset[offset:end] = self.records
+        return end
+
+
+def duplicate_centroids(records, min_distance):
+    """
+    Finds cells detected twice, in two different sub-volumes, e.g. when the sub-volumes overlap.
+    
+    Parameters
+    ----------
+    records : ndarray
+        centroid_dtype records
+    min_distance : float
+        two centroids of different sub-volumes closer than this are the same cell.
+    
+    Returns
+    -------
+    ndarray
+        boolean array, True for the records to remove. Of two centroids of the same cell the one with 
+        the lower score is removed (the one of the higher sub-volume index if the scores are equal).
+    """
+    
+    duplicate = np.zeros(len(records), dtype=bool)
+    if len(records) < 2:
+        return duplicate
+    positions = np.column_stack((records['x'], records['y'], records['z']))
+    pairs = sorted(cKDTree(positions).query_pairs(min_distance))
+    for first, second in pairs:
+        if records['subvolume'][first] == records['subvolume'][second]:
+            continue
+        if (records['score'][first], -records['subvolume'][first]) >= \
+           (records['score'][second], -records['subvolume'][second]):
+            duplicate[second] = True
+        else:
+            duplicate[first] = True
+    return duplicate
@@ -60,16 +60,18 @@ __credits__ = "Mehdi Tondravi"
 
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['placeatom',
-           'compute3dvec']
+__all__ = ['compute3dvec',
+           'template_window',
+           'stamp_template']
 
 
-def placeatom(vector, box_length, which_loc, stacksz):
+def compute3dvec(vector, which_loc, box_length, stacksz):
     
     """
     Copies the data from vector into a cube with the width of "box_length" and places the cube
     into a 3-D array with the shape/size defined by the "stacksz" parameter. The center of cube is 
-    given by the "which_loc" parameter.
+    given by the "which_loc" parameter (see template_window()). Parts of the cube outside of the
+    array are clipped.
     
     Parameters
     ----------
@@ -78,7 +80,7 @@ def placeatom(vector, box_length, which_loc, stacksz):
     box_length : int
         Lenght
     which_loc : int
-        location to place atom in the flattened array
+        location to place atom
     stacksz : ndarry
         shape of the array (3D)
     
@@ -88,59 +90,81 @@ def placeatom(vector, box_length, which_loc, stacksz):
     """
     
     output_array = np.zeros((stacksz), dtype='float32')
+    stamp_template(output_array, vector, which_loc, box_length)
+    return output_array
+
+
+def template_window(which_loc, box_length, stacksz):
     
-    #Convert flat index to indices 
-    r, c, z = np.unravel_index(which_loc, (stacksz)) 
-    output_array[r, c, z] = 1
-    
-    # Increase every dimension by box_length at the top and at the bottom and fill them with zeroes.
-    output_array = np.lib.pad(output_array, ((box_length, box_length), (box_length, box_length), 
-                           (box_length, box_length)), 'constant', constant_values=(0, 0))
+    """
+    Returns the part of a 3-D array with the shape/size given by "stacksz" which is covered by a cube
+    with the width of "box_length" centered at "which_loc", and the matching part of the cube. The 
+    element round(box_length/2) - 1 of the cube along every axis is placed at "which_loc". Parts of 
+    the cube outside of the array are clipped.
     
-    # get the indices of the center of cube into increased dimensions output_array.
-    r, c, z = np.nonzero(output_array)
+    Parameters
+    ----------
+    which_loc : int
+        location to place atom in the flattened array
+    box_length : int
+        Lenght
+    stacksz : ndarry
+        shape of the array (3D)
     
-    #save the output of round() function to avoid multiple calls to it.
-    half_length = round(box_length/2)
+    Returns
+    -------
+    tuple
+        slices into the 3-D array
+    tuple
+        slices into the cube
+    """
     
-    #Save the data from the cube into output_array.
-    output_array[(r - half_length +1) : (r + box_length - half_length +1), \
-            (c - half_length +1) : (c + box_length - half_length +1), \
-            (z - half_length +1) : (z + box_length - half_length +1)] = \
-            np.reshape(vector, (box_length, box_length, box_length))
-    return(output_array)
+    center = np.unravel_index(np.asarray(which_loc).item(), stacksz)
+    half_length = int(round(box_length/2))
+    array_slices = []
+    cube_slices = []
+    for axis in range(3):
+        start = center[axis] - half_length + 1
+        lower = max(start, 0)
+        upper = min(start + box_length, stacksz[axis])
+        array_slices.append(slice(lower, upper))
+        cube_slices.append(slice(lower - start, upper - start))
+    return tuple(array_slices), tuple(cube_slices)
 
 
-def compute3dvec(vector, which_loc, box_length, stacksz):
+def stamp_template(target, vector, which_loc, box_length, value=None):
     
     """
-    Resizes the array dimension returned by placeatom() to the shape/size given by "stacksz" parameter.
+    Places the template in vector into "target" in place, at the same position as compute3dvec() 
+    does. Only the voxels of "target" under a non-zero template voxel are changed and nothing as big
+    as "target" is allocated.
     
     Parameters
     ----------
+    target : ndarray
+        3D array to be written in place
     vector : ndarray
         Nx1 array
+    which_loc : int
+        location to place atom in the flattened array
     box_length : int
         Lenght
-    which_loc : int
-        location to place atom
-    stacksz : ndarry
-        shape of the array (3D)
+    value : scalar, optional
+        value to write under the template (e.g. a cell label or zero). If None, the template values
+        are written.
     
     Returns
     -------
-    ndarray
+    tuple
+        indices of the changed voxels of "target", in the same format and order as np.nonzero().
     """
     
-    output_array = placeatom(vector, box_length, which_loc, stacksz)
-    
-    #delete the top "box_length" arrays for all dimensions.
-    x, y, z = np.shape(output_array)
-    output_array = output_array[box_length:x, box_length:y, box_length:z]
-
-    #delete the bottom "box_length" arrays for all dimensions.
-    x, y, z = np.shape(output_array)
-    output_array = output_array[0 : (x - box_length), 0 : (y - box_length), 0 : (z - box_length)]
-    
-    return output_array
-
+    array_slices, cube_slices = template_window(which_loc, box_length, np.shape(target))
+    cube = np.reshape(vector, (box_length, box_length, box_length))[cube_slices]
+    local_idx = np.nonzero(cube)
+    window = target[array_slices]
+    if value is None:
+        window[local_idx] = cube[local_idx]
+    else:
+        window[local_idx] = value
+    return tuple(idx + array_slices[axis].start for axis, idx in enumerate(local_idx))
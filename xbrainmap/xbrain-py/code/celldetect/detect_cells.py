@@ -56,8 +56,13 @@ from __future__ import (absolute_import, division, print_function,
 
 # following imports to be updated when directory structure are finalized 
 from create_synth_dict import create_synth_dict
-from compute3dvec import compute3dvec
+from compute3dvec import stamp_template
+from match_templates import threshold_probability, batched_fftconvolve
+from template_cache import get_synth_dict, get_templates, get_template_spectra
+from centroid_buffer import CentroidBuffer, centroid_dtype
 from scipy import signal
+from scipy import ndimage as ndi
+from scipy.spatial import cKDTree
 import numpy as np
 import pdb
 import logging
@@ -69,7 +74,9 @@ __credits__ = "Mehdi Tondravi"
 
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['detect_cells']
+__all__ = ['detect_cells',
+           'detect_cells_incremental',
+           'detect_cells_sparse']
 
 def detect_cells(cell_probability, probability_threshold, stopping_criterion, 
                 initial_template_size, dilation_size, max_no_cells):
@@ -111,7 +118,7 @@ def detect_cells(cell_probability, probability_threshold, stopping_criterion,
     """
     
     # threshold probability map. 
-    newtest = (cell_probability * (cell_probability > probability_threshold)).astype('float32')
+    newtest = threshold_probability(cell_probability, probability_threshold)
     #initial_template_size is an int now but could a vector later on - convert it to an array 
     initial_template_size = np.atleast_1d(initial_template_size)  
     
@@ -122,17 +129,22 @@ def detect_cells(cell_probability, probability_threshold, stopping_criterion,
     box_length = int(round(np.shape(dict)[0] ** (1/3)))
     new_map = np.zeros((np.shape(cell_probability)), dtype='uint8')
     newid = 1
-    centroids = np.empty((0, 4))
+    centroids = CentroidBuffer()
     
     # run greedy search step for at most max_no_cells steps (# cells <= max_no_cells)
     for ktot in range(max_no_cells):
         val = np.zeros((np.shape(dict)[1], 1), dtype='float32')
         id = np.zeros((np.shape(dict)[1], 1), dtype='uint32')
         
+        # The correlation is computed in double precision and rounded to the float32 precision of val,
+        # so that equal correlations are ties resolved by taking the first one rather than by the 
+        # round off of the FFT.
+        newtest_double = newtest.astype('float64')
+        
         # loop to convolve the probability cube with each template in dict
         for j in range(np.shape(dict)[1]):
-            convout = signal.fftconvolve(newtest, np.reshape(dict[:,j], (box_length, box_length, 
-                                                                         box_length)), mode='same')
+            template = np.reshape(dict[:,j], (box_length, box_length, box_length)).astype('float64')
+            convout = signal.fftconvolve(newtest_double, template, mode='same').astype('float32')
             # get the max value of the flattened convout array and its index
             val[j],id[j] = np.real(np.amax(convout)), np.argmax(convout)
         
@@ -140,33 +152,304 @@ def detect_cells(cell_probability, probability_threshold, stopping_criterion,
         which_atom = np.argmax(val)
         which_loc = id[which_atom]
         
-        # Save dict into a cube array with its center given by which_loc and place it into a 3-D array.
-        x2 = compute3dvec(dict[:, which_atom], which_loc, box_length, np.shape(newtest))
-        xid = np.nonzero(x2)
-        
-        # Save dilate_dict into a cube array with its center given by which_loc and place it into a 3-D array. 
-        x3 = compute3dvec(dilate_dict[:, which_atom], which_loc, box_length, np.shape(newtest))
-        
-        newtest = newtest * (x3 == 0)
-        ptest = val/np.sum(dict, axis=0)
+        ptest = val[which_atom]/np.sum(dict[:, which_atom])
         
         if ptest < stopping_criterion:
             print("Cell Detection is done")
-            return(centroids, new_map)
+            return(centroids.as_matrix(), new_map)
+        
+        # Label the voxels of the template placed with its center given by which_loc.
+        stamp_template(new_map, dict[:, which_atom], which_loc, box_length, newid)
+        
+        # Zero out the voxels of the dilated template placed with its center given by which_loc.
+        stamp_template(newtest, dilate_dict[:, which_atom], which_loc, box_length, 0)
         
-        # Label detected cell
-        new_map[xid] = newid
         newid = newid + 1
         
         #Convert flat index to indices 
-        rr, cc, zz = np.unravel_index(which_loc, np.shape(newtest))
-        new_centroid = rr, cc, zz  #Check - why cc is first?
+        rr, cc, zz = np.unravel_index(np.asarray(which_loc).item(), np.shape(newtest))
         
         # insert a row into centroids
-        centroids = np.vstack((centroids, np.append(new_centroid, ptest)))
+        centroids.append(rr, cc, zz, np.ravel(ptest)[0], initial_template_size[which_atom])
         # for later: convert to logging and print with much less frequency 
         if(ktot % 50 == 0):
             print('Iteration remaining = ', (max_no_cells - ktot - 1), 'Correlation = ', ptest )
         
     print("Cell Detection is done")
-    return(centroids, new_map)
+    return(centroids.as_matrix(), new_map)
+
+
+def _affected_box(nonzero, half_width, stacksz):
+    """
+    Returns the bounding box of the voxels with indices "nonzero" (as returned by np.nonzero()) grown
+    by "half_width" voxels on every side and clipped to "stacksz". Returns None if there is no voxel.
+    """
+    
+    if len(nonzero[0]) == 0:
+        return None
+    lower = [max(int(np.min(idx)) - half_width, 0) for idx in nonzero]
+    upper = [min(int(np.max(idx)) + 1 + half_width, stacksz[axis]) for axis, idx in enumerate(nonzero)]
+    return lower, upper
+
+
+def _update_correlation(newtest, radii, box_radius, convouts, line_maxs, out_lower, out_upper,
+                        single_precision=False):
+    """
+    Recomputes the correlation between "newtest" and the templates for "radii" inside the box given
+    by "out_lower" and "out_upper" and refreshes the maximum of every z-line of "convouts" crossing
+    that box.
+    """
+    
+    templates = get_templates(radii, box_radius)
+    half_width = templates.shape[1] // 2
+    in_lower = [max(lo - half_width, 0) for lo in out_lower]
+    in_upper = [min(hi + half_width, newtest.shape[axis]) for axis, hi in enumerate(out_upper)]
+    window = newtest[in_lower[0] : in_upper[0], in_lower[1] : in_upper[1], in_lower[2] : in_upper[2]]
+    # Away from the volume faces all boxes have the same shape, so their template spectra are cached.
+    local = batched_fftconvolve(window, templates, 
+                                get_template_spectra(radii, box_radius, window.shape, single_precision),
+                                single_precision=single_precision)
+    convouts[:, out_lower[0] : out_upper[0], out_lower[1] : out_upper[1], out_lower[2] : out_upper[2]] = \
+        local[:, out_lower[0] - in_lower[0] : out_upper[0] - in_lower[0],
+              out_lower[1] - in_lower[1] : out_upper[1] - in_lower[1],
+              out_lower[2] - in_lower[2] : out_upper[2] - in_lower[2]]
+    line_maxs[:, out_lower[0] : out_upper[0], out_lower[1] : out_upper[1]] = \
+        np.amax(convouts[:, out_lower[0] : out_upper[0], out_lower[1] : out_upper[1], :], axis=3)
+
+
+def _map_argmax(convout, line_max):
+    """
+    Returns the max value of "convout" and the index of its first occurrence in the flattened array,
+    i.e. the same result as np.amax(convout) and np.argmax(convout), by only scanning the z-line 
+    holding the maximum.
+    """
+    
+    row, col = np.unravel_index(np.argmax(line_max), line_max.shape)
+    depth = np.argmax(convout[row, col, :])
+    return convout[row, col, depth], np.ravel_multi_index((row, col, depth), convout.shape)
+
+
+def detect_cells_incremental(cell_probability, probability_threshold, stopping_criterion, 
+                             initial_template_size, dilation_size, max_no_cells, return_buffer=False,
+                             n_workers=1, single_precision=False, verbose=False):
+    
+    """
+    Incremental version of detect_cells(). Returns the same centroids and labeled cell map as 
+    detect_cells() for the same input. Both compute the correlation in double precision and round it
+    to float32, so the FFT round off of the smaller boxes convolved here, far below the float32 
+    resolution, does not change the result and equal correlations are ties resolved the same way.
+    
+    The probability map is convolved with all templates in a single FFT pass. After a cell is detected only 
+    the voxels within a dilated template are zeroed, so the correlation is recomputed only inside the
+    box where it could have changed. The maximum of every z-line of the correlation map is kept so 
+    that the next cell is found by scanning Nr x Nc line maxima and a single z-line instead of the 
+    whole volume.
+    
+    Parameters 
+    ----------
+    cell_probability : ndarray
+        Nr x Nc x Nz matrix which contains the probability of each voxel being a cell body. 
+    probability_threshold : float
+        threshold between (0,1) to apply to probability map.
+    stopping_criterion : float
+        minimum normalized correlation between template and probability map (Example = 0.47)
+    initial_template_size : int
+        initial size of spherical template (to use in sweep)
+    dilation_size : int
+        size to increase mask around each detected cell
+    max_no_cells : int
+        maximum number of cells (alternative stopping criterion)
+    return_buffer : bool, optional
+        return the centroids as a CentroidBuffer, with the size of the matched template, instead of
+        a D x 4 matrix.
+    n_workers : int, optional
+        number of threads used to correlate the probability map with the templates.
+    single_precision : bool, optional
+        memory lean mode, the correlation is computed with single precision FFTs (see 
+        batched_fftconvolve()). Correlations differ from the double precision ones by about 1e-6, 
+        which can only change the result for nearly tied cells.
+    verbose : bool, optional
+        print the number of remaining iterations and the correlation every 50 detected cells, as 
+        detect_cells() does.
+        
+    Returns
+    -------
+    ndarray
+        centroids = D x 4 matrix, where D = number of detected cells (see detect_cells()).
+    ndarray
+        new_map = Nr x Nc x Nz matrix containing labeled detected cells (1,...,D)
+    """
+    
+    # threshold probability map. 
+    newtest = threshold_probability(cell_probability, probability_threshold)
+    initial_template_size = np.atleast_1d(initial_template_size)  
+    
+    # create dictionary of spherical templates
+    box_radius = np.ceil(np.max(initial_template_size)/2) + 1
+    dict = get_synth_dict(initial_template_size, box_radius)
+    dilate_dict = get_synth_dict(initial_template_size + dilation_size, box_radius)
+    box_length = int(round(np.shape(dict)[0] ** (1/3)))
+    new_map = np.zeros((np.shape(cell_probability)), dtype='uint8')
+    newid = 1
+    centroids = CentroidBuffer()
+    
+    # Convolve the probability cube with all templates in one FFT pass and save the max of each z-line.
+    # The templates and their spectra are cached and shared by all sub-volumes of the same shape.
+    convouts = batched_fftconvolve(newtest, get_templates(initial_template_size, box_radius),
+                                   get_template_spectra(initial_template_size, box_radius, newtest.shape,
+                                                        single_precision),
+                                   n_workers, single_precision)
+    line_maxs = np.amax(convouts, axis=3)
+    
+    # run greedy search step for at most max_no_cells steps (# cells <= max_no_cells)
+    for ktot in range(max_no_cells):
+        val = np.zeros((np.shape(dict)[1], 1), dtype='float32')
+        id = np.zeros((np.shape(dict)[1], 1), dtype='uint32')
+        for j in range(np.shape(dict)[1]):
+            val[j], id[j] = _map_argmax(convouts[j], line_maxs[j])
+        
+        # find position in image with max correlation
+        which_atom = np.argmax(val)
+        which_loc = id[which_atom]
+        ptest = val[which_atom, 0]/np.sum(dict[:, which_atom])
+        
+        if ptest < stopping_criterion:
+            break
+        
+        # Label the voxels of the template placed with its center given by which_loc.
+        stamp_template(new_map, dict[:, which_atom], which_loc, box_length, newid)
+        
+        # Zero out the voxels of the dilated template placed with its center given by which_loc.
+        zeroed = stamp_template(newtest, dilate_dict[:, which_atom], which_loc, box_length, 0)
+        
+        # Only the correlation within half a template of the zeroed voxels has changed.
+        affected = _affected_box(zeroed, box_length // 2, np.shape(newtest))
+        if affected is not None:
+            _update_correlation(newtest, initial_template_size, box_radius, convouts, line_maxs, 
+                                affected[0], affected[1], single_precision)
+        
+        newid = newid + 1
+        
+        #Convert flat index to indices 
+        rr, cc, zz = np.unravel_index(np.asarray(which_loc).item(), np.shape(newtest))
+        centroids.append(rr, cc, zz, ptest, initial_template_size[which_atom])
+        if verbose and (ktot % 50 == 0):
+            print('Iteration remaining = ', (max_no_cells - ktot - 1), 'Correlation = ', ptest )
+        
+    print("Cell Detection is done")
+    if return_buffer:
+        return(centroids, new_map)
+    return(centroids.as_matrix(), new_map)
+
+
+def detect_cells_sparse(cell_probability, probability_threshold, stopping_criterion, 
+                        initial_template_size, dilation_size, max_no_cells, return_buffer=False,
+                        n_workers=1, single_precision=False):
+    
+    """
+    One pass alternative to the greedy search of detect_cells(), intended for dense tissue. 
+    
+    The probability map is correlated with the templates once. All local maxima of the normalized
+    correlation which are not below stopping_criterion are candidate cells. Candidates are then 
+    accepted in order of decreasing correlation and every candidate closer to an accepted cell than 
+    the radius of its dilated template, (initial_template_size + dilation_size) / 2, is suppressed. 
+    Unlike detect_cells() the correlation is not recomputed after a cell is found, so the detected
+    cells can differ from the greedy search where cells touch. 
+    
+    Parameters 
+    ----------
+    cell_probability : ndarray
+        Nr x Nc x Nz matrix which contains the probability of each voxel being a cell body. 
+    probability_threshold : float
+        threshold between (0,1) to apply to probability map.
+    stopping_criterion : float
+        minimum normalized correlation between template and probability map (Example = 0.47)
+    initial_template_size : int
+        initial size of spherical template (to use in sweep)
+    dilation_size : int
+        size to increase mask around each detected cell
+    max_no_cells : int
+        maximum number of cells
+    return_buffer : bool, optional
+        return the centroids as a CentroidBuffer, with the size of the matched template, instead of
+        a D x 4 matrix.
+    n_workers : int, optional
+        number of threads used to correlate the probability map with the templates.
+    single_precision : bool, optional
+        memory lean mode, the correlation is computed with single precision FFTs (see 
+        batched_fftconvolve()). Correlations differ from the double precision ones by about 1e-6, 
+        which can only change the result for nearly tied cells.
+        
+    Returns
+    -------
+    ndarray
+        centroids = D x 4 matrix, where D = number of detected cells (see detect_cells()).
+    ndarray
+        new_map = Nr x Nc x Nz matrix containing labeled detected cells (1,...,D)
+    """
+    
+    # threshold probability map. 
+    newtest = threshold_probability(cell_probability, probability_threshold)
+    initial_template_size = np.atleast_1d(initial_template_size)  
+    
+    box_radius = np.ceil(np.max(initial_template_size)/2) + 1
+    dict = get_synth_dict(initial_template_size, box_radius)
+    box_length = int(round(np.shape(dict)[0] ** (1/3)))
+    new_map = np.zeros((np.shape(cell_probability)), dtype='uint8')
+    centroids = CentroidBuffer()
+    
+    # Normalized correlation of the best template at each voxel.
+    convouts = batched_fftconvolve(newtest, get_templates(initial_template_size, box_radius),
+                                   get_template_spectra(initial_template_size, box_radius, newtest.shape,
+                                                        single_precision),
+                                   n_workers, single_precision)
+    convouts /= np.sum(dict, axis=0)[:, np.newaxis, np.newaxis, np.newaxis]
+    ptest = np.amax(convouts, axis=0)
+    
+    # Candidates are the local maxima which are not below the stopping criterion.
+    peaks = (ptest == ndi.maximum_filter(ptest, size=3, mode='constant')) & (ptest >= stopping_criterion)
+    candidates = np.flatnonzero(peaks)
+    del peaks
+    # The best template is only needed at the candidates.
+    best_atom = np.argmax(np.reshape(convouts, (len(convouts), -1))[:, candidates], axis=0)
+    del convouts
+    print("Number of candidate cells is %d" % len(candidates))
+    if len(candidates) == 0:
+        print("Cell Detection is done")
+        if return_buffer:
+            return(centroids, new_map)
+        return(centroids.as_matrix(), new_map)
+    
+    # Visit candidates by decreasing correlation, ties in flattened index order like np.argmax().
+    scores = ptest.ravel()[candidates]
+    order = np.lexsort((candidates, -scores))
+    candidates = candidates[order]
+    scores = scores[order]
+    atoms = best_atom[order]
+    positions = np.column_stack(np.unravel_index(candidates, np.shape(newtest)))
+    suppress_radius = (initial_template_size + dilation_size) / 2
+    
+    tree = cKDTree(positions)
+    suppressed = np.zeros(len(candidates), dtype=bool)
+    accepted = []
+    for idx in range(len(candidates)):
+        if suppressed[idx]:
+            continue
+        accepted.append(idx)
+        if len(accepted) == max_no_cells:
+            break
+        suppressed[tree.query_ball_point(positions[idx], suppress_radius[atoms[idx]])] = True
+    
+    # Label detected cells the same way as detect_cells().
+    for newid, idx in enumerate(accepted, 1):
+        stamp_template(new_map, dict[:, atoms[idx]], candidates[idx], box_length, newid)
+    records = np.zeros(len(accepted), dtype=centroid_dtype)
+    records['x'], records['y'], records['z'] = positions[accepted].T
+    records['score'] = scores[accepted]
+    records['radius'] = initial_template_size[atoms[accepted]]
+    records['subvolume'] = -1
+    centroids.extend(records)
+    print("Cell Detection is done")
+    if return_buffer:
+        return(centroids, new_map)
+    return(centroids.as_matrix(), new_map)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Tests that detect_cells_incremental() finds the cells of detect_cells(). Run with 
+"python -m pytest --import-mode=importlib" from this directory (the default import mode would import
+this directory as the package code.celldetect, which clashes with the standard library module code).
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+from benchmark_detect_cells import make_synthetic_volume
+from detect_cells import detect_cells, detect_cells_incremental
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+
+def assert_same_cells(volume, initial_template_size, max_no_cells, stopping_criterion=0.47):
+    centroids, new_map = detect_cells(volume, 0.2, stopping_criterion, initial_template_size, 1, max_no_cells)
+    inc_centroids, inc_map = detect_cells_incremental(volume, 0.2, stopping_criterion, initial_template_size,
+                                                      1, max_no_cells)
+    np.testing.assert_array_equal(inc_centroids, centroids)
+    np.testing.assert_array_equal(inc_map, new_map)
+    return centroids
+
+
+@pytest.mark.parametrize('shape, no_of_cells, seed', [((40, 40, 30), 12, 0),
+                                                      ((33, 29, 41), 15, 1),
+                                                      ((25, 31, 22), 6, 3)])
+def test_incremental_matches_detect_cells(shape, no_of_cells, seed):
+    volume, _ = make_synthetic_volume(shape, no_of_cells, 6, seed=seed)
+    assert_same_cells(volume, 6, 60)
+
+
+# Without noise identical spheres have exactly tied correlations.
+@pytest.mark.parametrize('seed', [3, 5, 7, 8])
+def test_incremental_matches_detect_cells_on_ties(seed):
+    volume, _ = make_synthetic_volume((30, 34, 28), 10, 6, noise=0, seed=seed)
+    assert_same_cells(volume, 6, 60)
+
+
+@pytest.mark.parametrize('initial_template_size, noise, seed', [([4, 6], 0, 0),
+                                                                ([4, 6], 0, 8),
+                                                                ([4, 6], 0.2, 1)])
+def test_incremental_matches_detect_cells_with_radii(initial_template_size, noise, seed):
+    volume, _ = make_synthetic_volume((30, 34, 28), 10, 6, noise=noise, seed=seed)
+    centroids = assert_same_cells(volume, initial_template_size, 40)
+    assert len(centroids) > 0
+
+
+def test_incremental_stops_at_criterion():
+    volume, _ = make_synthetic_volume((24, 24, 24), 4, 6, noise=0, seed=2)
+    volume = np.pad(volume, 6, mode='constant')
+    centroids = assert_same_cells(volume, 6, 50, stopping_criterion=0.5)
+    assert 0 < len(centroids) < 50
+
+
+def test_incremental_verbose(capsys):
+    volume, _ = make_synthetic_volume((30, 34, 28), 10, 6, seed=0)
+    detect_cells_incremental(volume, 0.2, 0.47, 6, 1, 60)
+    assert 'Iteration remaining' not in capsys.readouterr().out
+    # Printed every 50 cells, like detect_cells().
+    detect_cells_incremental(volume, 0.2, 0.47, 6, 1, 60, verbose=True)
+    assert capsys.readouterr().out.count('Iteration remaining') == 2
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Tests that detect_cells_threaded() merges the cells of its tiles. Run with 
+"python -m pytest --import-mode=importlib" from this directory (see test_detect_cells.py).
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from benchmark_detect_cells import make_synthetic_volume
+from detect_cells import detect_cells_sparse
+from parallel_detect import tile_slices, detect_cells_threaded
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+
+def test_tile_slices():
+    tiles = tile_slices((5, 4, 3), (2, 4, 3))
+    assert tiles == [(slice(0, 2), slice(0, 4), slice(0, 3)),
+                     (slice(2, 4), slice(0, 4), slice(0, 3)),
+                     (slice(4, 5), slice(0, 4), slice(0, 3))]
+
+
+def test_labels_of_more_than_255_cells():
+    # The tile maps are uint8, the labels of the merged map follow the labels of the previous tiles.
+    volume, _ = make_synthetic_volume((60, 60, 30), 120, 4, seed=0)
+    centroids, new_map = detect_cells_threaded(volume, 0.05, 0, 4, 0, 40, n_workers=2, 
+                                               tile_shape=(20, 20, 30), detect=detect_cells_sparse)
+    assert len(centroids) > 255
+    assert new_map.max() == len(centroids)
+    
+    label_offset = 0
+    for tile in tile_slices(volume.shape, (20, 20, 30)):
+        tile_centroids, tile_map = detect_cells_sparse(volume[tile], 0.05, 0, 4, 0, 40)
+        assert tile_map.dtype == np.uint8
+        expected = np.where(tile_map > 0, tile_map.astype('int64') + label_offset, 0)
+        np.testing.assert_array_equal(new_map[tile], expected)
+        np.testing.assert_array_equal(centroids[label_offset : label_offset + len(tile_centroids), 3], 
+                                      tile_centroids[:, 3])
+        label_offset += len(tile_centroids)
+    assert label_offset == len(centroids)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Benchmark of the ball_morphology.py backends on a synthetic vessel-like binary volume.
+
+Every backend dilates and erodes the same volume with balls of several radii. The run time of each 
+backend and whether its output is identical to the "ndimage" backend are printed, and written to a
+JSON file with --output. The backends are also compared on all background and all foreground volumes. Run it from this directory, e.g. 
+"python benchmark_ball_morphology.py --shape 200 200 200 --radii 1 2 3".
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import time
+import numpy as np
+from scipy import ndimage as ndi
+from ball_morphology import ball_dilation, ball_erosion
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['make_synthetic_mask',
+           'compare_backends',
+           'compare_edge_cases']
+
+
+def make_synthetic_mask(shape, fill=0.1, seed=0):
+    """
+    Returns a bool volume where about "fill" of the voxels are foreground, in smooth tube-like 
+    blobs (thresholded smoothed noise).
+    """
+    
+    rng = np.random.RandomState(seed)
+    smooth = ndi.gaussian_filter(rng.rand(*shape).astype('float32'), 2)
+    return smooth > np.percentile(smooth, 100 * (1 - fill))
+
+
+def compare_backends(image, radii, backends=('ndimage', 'boxes', 'edt')):
+    """
+    Dilates and erodes "image" with every backend and radius.
+    
+    Returns
+    -------
+    list of dict
+        radius, operation, backend, sec, speedup (over the first backend) and identical (output 
+        equal to the output of the first backend).
+    """
+    
+    results = []
+    for radius in radii:
+        for operation, function in (('dilation', ball_dilation), ('erosion', ball_erosion)):
+            reference = None
+            for backend in backends:
+                start_time = time.time()
+                out = function(image, radius, backend)
+                sec = time.time() - start_time
+                if reference is None:
+                    reference, reference_sec = out, sec
+                results.append({'radius': radius, 'operation': operation, 'backend': backend, 'sec': sec,
+                                'speedup': reference_sec / sec if sec else None,
+                                'identical': bool(np.array_equal(out, reference))})
+                print("radius %g %s %s: %.3f Sec, speedup %.1f, identical %s" % 
+                      (radius, operation, backend, sec, results[-1]['speedup'] or 0, results[-1]['identical']))
+    return results
+
+
+def compare_edge_cases(radii, shape=(10, 10, 10)):
+    """
+    Runs compare_backends() on an all background and an all foreground volume, where the distance 
+    transform of the "edt" backend is not defined.
+    
+    Returns
+    -------
+    list of dict
+        results of compare_backends() with the image name ("zeros" or "ones") added.
+    """
+    
+    results = []
+    for image_name, image in (('zeros', np.zeros(shape, dtype=bool)), ('ones', np.ones(shape, dtype=bool))):
+        print("%s volume:" % image_name)
+        for result in compare_backends(image, radii):
+            result['image'] = image_name
+            results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare ball dilation and erosion backends.")
+    parser.add_argument('--shape', type=int, nargs=3, default=[200, 200, 200])
+    parser.add_argument('--fill', type=float, default=0.1, help="fraction of foreground voxels")
+    parser.add_argument('--radii', type=float, nargs='+', default=[1, 2, 3, 5])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file for the results")
+    args = parser.parse_args()
+    results = compare_backends(make_synthetic_mask(tuple(args.shape), args.fill, args.seed), args.radii)
+    edge_cases = compare_edge_cases(args.radii)
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump({'shape': args.shape, 'fill': args.fill, 'numpy': np.__version__, 
+                       'results': results, 'edge_cases': edge_cases}, json_file, indent=2)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Module for finding connected components of volumes too big for memory, one slab at a time.
+
+Each slab of x slices is labeled on its own. Components touching across the face between two
+consecutive slabs are merged with a union-find over the slab labels, so the size of every component
+is its size in the whole volume. With an MPI communicator the slabs are divided into consecutive blocks
+of slabs, one per python process, and the union-find is run on rank 0.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from scipy import ndimage as ndi
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['slab_ranges',
+           'slab_blocks',
+           'face_pairs',
+           'find_roots',
+           'union_pairs',
+           'offset_labels',
+           'global_components']
+
+
+def slab_ranges(length, slab_size):
+    """
+    Returns the (start, end) indices of consecutive slabs of at most slab_size slices covering
+    "length" slices.
+    """
+    
+    slab_size = max(int(slab_size), 1)
+    return [(start, min(start + slab_size, length)) for start in range(0, length, slab_size)]
+
+
+def slab_blocks(no_of_slabs, size):
+    """
+    Returns the (first, last + 1) slab index of the consecutive slabs of each of "size" python 
+    processes. The first processes get one more slab when the slabs do not divide evenly.
+    """
+    
+    per_process, extra = divmod(no_of_slabs, size)
+    starts = [rank * per_process + min(rank, extra) for rank in range(size + 1)]
+    return [(starts[rank], starts[rank + 1]) for rank in range(size)]
+
+
+def face_pairs(previous_face, first_face):
+    """
+    Returns the unique (label, label) pairs of the voxels labeled on both sides of the face between
+    two consecutive slabs, given the labels of the last slice of the first slab and of the first 
+    slice of the second slab.
+    """
+    
+    both = (previous_face > 0) & (first_face > 0)
+    return np.unique(np.stack((previous_face[both], first_face[both]), axis=1), axis=0)
+
+
+def find_roots(parent):
+    """
+    Returns the root of every label of the union-find forest "parent" (parent[label] is the parent
+    label, roots are their own parent). All labels are resolved at once by pointer jumping.
+    """
+    
+    roots = parent.copy()
+    while True:
+        next_roots = roots[roots]
+        if np.array_equal(next_roots, roots):
+            return roots
+        roots = next_roots
+
+
+def union_pairs(parent, pairs):
+    """
+    Merges the components of each (label, label) row of "pairs" in the union-find forest "parent".
+    The smaller root becomes the parent, so a root is the smallest label of its component.
+    """
+    
+    for first, second in pairs:
+        while parent[first] != first:
+            parent[first] = parent[parent[first]]
+            first = parent[first]
+        while parent[second] != second:
+            parent[second] = parent[parent[second]]
+            second = parent[second]
+        if first < second:
+            parent[second] = first
+        elif second < first:
+            parent[first] = second
+
+
+def offset_labels(mask, offset):
+    """
+    Labels the face connected components of a slab mask (the connectivity of remove_small_objects()
+    and ndi.label()) and adds "offset" to all labels except the background.
+    """
+    
+    labels, count = ndi.label(mask)
+    labels = labels.astype('int64')
+    labels[labels > 0] += offset
+    return labels
+
+
+def global_components(masks, min_size, comm=None):
+    """
+    Finds the connected components of a volume given as consecutive slabs and which of them have at 
+    least min_size voxels in the whole volume. Only one slab and the last slice of the previous 
+    slab are in memory at a time.
+    
+    Parameters
+    ----------
+    masks : iterable
+        binary masks of consecutive slabs of x slices of the volume. With comm, the slabs of this 
+        python process, which follow the slabs of the lower ranks (see slab_blocks()).
+    min_size : int
+        smallest size of the components to keep.
+    comm : MPI communicator, optional
+        must be given by all its python processes, which may have no slab.
+    
+    Returns
+    -------
+    list
+        label offset of each slab of the volume. offset_labels(mask, offset) of a slab gives the 
+        global label of its voxels.
+    ndarray
+        bool array indexed by global label, True for the labels of components with at least 
+        min_size voxels (False for the background label 0).
+    """
+    
+    counts = []
+    sizes = []
+    pairs = [np.zeros((0, 2), dtype='int64')]
+    total = 0
+    first_face = None
+    previous_face = None
+    for mask in masks:
+        labels, count = ndi.label(mask)
+        sizes.append(np.bincount(labels.ravel(), minlength=count + 1)[1:])
+        # Voxels on both sides of the face between this slab and the previous one are connected.
+        face = np.where(labels[0] > 0, labels[0].astype('int64') + total, 0)
+        if previous_face is None:
+            first_face = face
+        else:
+            pairs.append(face_pairs(previous_face, face))
+        previous_face = np.where(labels[-1] > 0, labels[-1].astype('int64') + total, 0)
+        counts.append(count)
+        total += count
+    
+    rank_counts = [counts] if comm is None else comm.allgather(counts)
+    rank = 0 if comm is None else comm.Get_rank()
+    slab_counts = [n for process_counts in rank_counts for n in process_counts]
+    offsets = [int(offset) for offset in np.cumsum([0] + slab_counts[:-1])]
+    total = int(sum(slab_counts))
+    rank_offset = int(sum(sum(process_counts) for process_counts in rank_counts[:rank]))
+    pairs = np.concatenate(pairs) + rank_offset
+    
+    if comm is not None:
+        # The faces between the slabs of two processes. A process sends the first face of its slabs to
+        # the previous process with slabs, which finds the pairs with the last face of its slabs.
+        busy = [other for other, process_counts in enumerate(rank_counts) if len(process_counts)]
+        request = None
+        if len(counts):
+            position = busy.index(rank)
+            if position > 0:
+                request = comm.isend(np.where(first_face > 0, first_face + rank_offset, 0), 
+                                     dest=busy[position - 1], tag=11)
+            if position + 1 < len(busy):
+                last_face = np.where(previous_face > 0, previous_face + rank_offset, 0)
+                next_face = comm.recv(source=busy[position + 1], tag=11)
+                pairs = np.concatenate((pairs, face_pairs(last_face, next_face)))
+        if request is not None:
+            request.wait()
+        pairs = comm.gather(pairs, root=0)
+        sizes = comm.gather(sizes, root=0)
+        if rank != 0:
+            return offsets, comm.bcast(None, root=0)
+        pairs = np.concatenate(pairs)
+        sizes = [slab_sizes for process_sizes in sizes for slab_sizes in process_sizes]
+    
+    parent = np.arange(total + 1, dtype='int64')
+    union_pairs(parent, pairs)
+    roots = find_roots(parent)
+    root_sizes = np.bincount(roots, weights=np.concatenate([np.zeros(1, dtype='int64')] + sizes), 
+                             minlength=total + 1)
+    keep = root_sizes[roots] >= min_size
+    keep[0] = False
+    if comm is not None:
+        comm.bcast(keep, root=0)
+    return offsets, keep
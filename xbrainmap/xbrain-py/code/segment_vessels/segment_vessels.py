@@ -57,16 +57,21 @@ import numpy as np
 import scipy.io as sio
 from scipy import ndimage as ndi
 from skimage import morphology
+from chunked_components import slab_ranges, slab_blocks, offset_labels, global_components
+from ball_morphology import ball_dilation
 
 __author__ = "Eva Dyer"
 __credits__ = "Mehdi Tondravi"
 
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['segment_vessels']
+__all__ = ['segment_vessels',
+           'segment_vessels_chunked',
+           'segment_vessels_sweep']
 
 
-def segment_vessels(vessel_probability, probability_threshold, dilation_size, minimum_size):
+def segment_vessels(vessel_probability, probability_threshold, dilation_size, minimum_size, 
+                    morphology_backend='auto'):
     
     """
     This function produces a binary image with segmented vessels from a probability map (from
@@ -87,6 +92,9 @@ def segment_vessels(vessel_probability, probability_threshold, dilation_size, mi
     minimum_size : int
         components smaller than this are removed from image.
     
+    morphology_backend : str, optional
+        ball_dilation() backend, all backends give the same image.
+    
     Returns
     -------
     ndarry
@@ -98,7 +106,176 @@ def segment_vessels(vessel_probability, probability_threshold, dilation_size, mi
     im_removed_small_objects = morphology.remove_small_objects(unfiltered_im, 
                                                                min_size = smallsize, in_place = True)
     
-    dilated_im = ndi.binary_dilation(im_removed_small_objects, morphology.ball((dilation_size-1)/2))
+    dilated_im = ball_dilation(im_removed_small_objects, (dilation_size-1)/2, morphology_backend)
     image_out = morphology.remove_small_objects(dilated_im, min_size = minimum_size, 
                                                 in_place = True)
     return(image_out)
+
+
+def segment_vessels_chunked(vessel_probability, image_out, probability_threshold, dilation_size, minimum_size,
+                            slab_size=64, morphology_backend='auto', comm=None):
+    
+    """
+    Out of core version of segment_vessels(). The probability map is read and the binary image is 
+    written one slab of x slices at a time, so both can be HDF5 data sets bigger than memory. The 
+    output is the same as segment_vessels() on the whole volume.
+    
+    Small objects are removed by their size in the whole volume: components of each slab are merged 
+    across slab faces with a union-find (see chunked_components.py). Each slab is dilated with a halo
+    of the neighbor slabs, so dilation is not cut at slab faces. The probability map is read three 
+    times and the binary image is written twice.
+    
+    With an MPI communicator each python process segments a block of consecutive slabs (see 
+    slab_blocks()) and the components are merged across the blocks, so the output is the same for any
+    number of processes. The slabs next to a block are read once more to dilate its first and last slab.
+    
+    Parameters
+    ----------
+    vessel_probability : ndarray or HDF5 data set
+        Nr x Nc x Nz matrix which contains the probability of each voxel being a vessel.
+    image_out : ndarray or HDF5 data set
+        Nr x Nc x Nz bool or integer matrix the binary image is written to.
+    probability_threshold : float
+        threshold between (0,1) to apply to probability map.
+    dilation_size : int
+        Sphere Structural Element diameter size.
+    minimum_size : int
+        components smaller than this are removed from image.
+    slab_size : int, optional
+        number of x slices read at a time (at least the dilation radius).
+    morphology_backend : str, optional
+        ball_dilation() backend, all backends give the same image.
+    comm : MPI communicator, optional
+        must be given by all its python processes.
+    
+    Returns
+    -------
+    ndarray or HDF5 data set
+        image_out
+    """
+    smallsize = 100 # components smaller than this size are removed.
+    halo = int(np.ceil((dilation_size-1)/2))
+    slabs = slab_ranges(vessel_probability.shape[0], max(slab_size, halo))
+    # Slabs segmented by this python process.
+    if comm is None:
+        my_slabs = range(len(slabs))
+    else:
+        my_slabs = range(*slab_blocks(len(slabs), comm.Get_size())[comm.Get_rank()])
+    
+    def unfiltered_im(k):
+        return vessel_probability[slabs[k][0] : slabs[k][1]] >= probability_threshold
+    
+    # First pass: global size of the thresholded components.
+    small_offsets, small_keep = global_components((unfiltered_im(k) for k in my_slabs), smallsize, comm)
+    
+    # Slabs without small objects, each is computed once and kept until it is not a halo any more.
+    removed_small = {}
+    def im_removed_small_objects(k):
+        if k not in removed_small:
+            removed_small[k] = small_keep[offset_labels(unfiltered_im(k), small_offsets[k])]
+            removed_small.pop(k - 2, None)
+        return removed_small[k]
+    
+    # Second pass: dilate and write each slab, and find the global size of the dilated components.
+    def dilated_ims():
+        for k in my_slabs:
+            start, end = slabs[k]
+            parts = [im_removed_small_objects(k)]
+            before = 0
+            if halo and k > 0:
+                parts.insert(0, im_removed_small_objects(k - 1)[-halo:])
+                before = len(parts[0])
+            if halo and k + 1 < len(slabs):
+                parts.append(im_removed_small_objects(k + 1)[:halo])
+            dilated_im = ball_dilation(np.concatenate(parts), (dilation_size-1)/2, 
+                                       morphology_backend)[before : before + end - start]
+            image_out[start : end] = dilated_im
+            yield dilated_im
+    
+    dilated_offsets, dilated_keep = global_components(dilated_ims(), minimum_size, comm)
+    
+    # Third pass: remove the dilated components smaller than minimum_size.
+    for k in my_slabs:
+        start, end = slabs[k]
+        dilated_im = image_out[start : end] > 0
+        image_out[start : end] = dilated_keep[offset_labels(dilated_im, dilated_offsets[k])]
+    return(image_out)
+
+
+def segment_vessels_sweep(vessel_probability, probability_thresholds, dilation_sizes, minimum_sizes,
+                          morphology_backend='auto', return_masks=False):
+    
+    """
+    Runs segment_vessels() for every combination of probability threshold, dilation size and minimum
+    size in one pass over the probability map.
+    
+    Intermediate results are shared between settings: the small objects of each threshold are removed
+    once, the distance transform of the result gives the dilation for all odd dilation sizes (ball of 
+    radius r is the set of voxels at distance <= r), and the component sizes of each dilated image give
+    the output of all minimum sizes. Even dilation sizes use ball_dilation().
+    
+    Parameters
+    ----------
+    vessel_probability : ndarray
+        Nr x Nc x Nz matrix which contains the probability of each voxel being a vessel.
+    probability_thresholds : sequence of float
+        thresholds to apply to the probability map.
+    dilation_sizes : sequence of int
+        Sphere Structural Element diameter sizes.
+    minimum_sizes : sequence of int
+        components smaller than these are removed from image.
+    morphology_backend : str, optional
+        ball_dilation() backend for even dilation sizes.
+    return_masks : bool, optional
+        also return the binary image of every setting.
+    
+    Returns
+    -------
+    list
+        (probability_threshold, dilation_size, minimum_size) of each setting.
+    ndarray
+        number of vessel voxels of each setting.
+    ndarray
+        number of vessel components of each setting.
+    list or None
+        binary image of each setting if return_masks is True.
+    """
+    smallsize = 100 # components smaller than this size are removed.
+    minimum_sizes = np.asarray(minimum_sizes, dtype='int64')
+    settings, voxels, objects, masks = [], [], [], []
+    for probability_threshold in probability_thresholds:
+        unfiltered_im = (vessel_probability >= probability_threshold)
+        labels, count = ndi.label(unfiltered_im)
+        keep = np.bincount(labels.ravel(), minlength=count + 1) >= smallsize
+        keep[0] = False
+        im_removed_small_objects = keep[labels]
+        del labels, unfiltered_im
+        # Squared distance of every voxel to the vessels, only needed for odd dilation sizes.
+        distance = None
+        if any(int(d) % 2 == 1 for d in dilation_sizes) and np.any(im_removed_small_objects):
+            distance = ndi.distance_transform_edt(~im_removed_small_objects) ** 2
+        for dilation_size in dilation_sizes:
+            radius = (dilation_size-1)/2
+            if not np.any(im_removed_small_objects):
+                dilated_im = im_removed_small_objects
+            elif int(dilation_size) % 2 == 1:
+                dilated_im = distance < radius * radius + 0.5
+            else:
+                dilated_im = ball_dilation(im_removed_small_objects, radius, morphology_backend)
+            labels, count = ndi.label(dilated_im)
+            sizes = np.bincount(labels.ravel(), minlength=count + 1)
+            sizes[0] = 0
+            sorted_sizes = np.sort(sizes[1:])
+            # Voxels and components of sizes >= each minimum size.
+            first_kept = np.searchsorted(sorted_sizes, minimum_sizes, side='left')
+            kept_voxels = np.concatenate((np.cumsum(sorted_sizes[::-1])[::-1], [0]))[first_kept]
+            for minimum_size, kept, first in zip(minimum_sizes, kept_voxels, first_kept):
+                settings.append((probability_threshold, dilation_size, int(minimum_size)))
+                voxels.append(kept)
+                objects.append(count - first)
+                if return_masks:
+                    keep = sizes >= minimum_size
+                    keep[0] = False
+                    masks.append(keep[labels])
+            del labels
+    return settings, np.array(voxels, dtype='int64'), np.array(objects, dtype='int64'), (masks if return_masks else None)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Tests that the slab-wise components of chunked_components.py are the connected components of the
+whole volume. Run with "python -m pytest" from this directory.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+from benchmark_ball_morphology import make_synthetic_mask
+from chunked_components import slab_ranges, slab_blocks, offset_labels, global_components
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+MASK = make_synthetic_mask((30, 16, 14), 0.3, seed=2)
+
+
+class ThreadComm(object):
+    """
+    The point to point and collective calls of an MPI communicator used by global_components(), 
+    between threads standing for the python processes.
+    """
+    
+    def __init__(self, rank, queues):
+        self.rank = rank
+        self.queues = queues
+    
+    def Get_rank(self):
+        return self.rank
+    
+    def Get_size(self):
+        return len(self.queues)
+    
+    def isend(self, obj, dest, tag=0):
+        self.queues[dest].put((self.rank, tag, obj))
+        return self
+    
+    def wait(self):
+        pass
+    
+    def recv(self, source, tag=0):
+        # Messages of other sources or tags are put back in the queue.
+        while True:
+            message = self.queues[self.rank].get()
+            if message[:2] == (source, tag):
+                return message[2]
+            self.queues[self.rank].put(message)
+    
+    def gather(self, obj, root=0):
+        self.isend(obj, root, tag=1)
+        if self.rank == root:
+            return [self.recv(other, tag=1) for other in range(self.Get_size())]
+    
+    def bcast(self, obj, root=0):
+        if self.rank == root:
+            for other in range(self.Get_size()):
+                self.isend(obj, other, tag=2)
+        return self.recv(root, tag=2)
+    
+    def allgather(self, obj):
+        return self.bcast(self.gather(obj))
+
+
+def chunked_labels(mask, slab_size, min_size):
+    """
+    Returns the global labels of every voxel of "mask" labeled one slab at a time, and the mask of the
+    voxels of components with at least min_size voxels.
+    """
+    
+    slabs = slab_ranges(mask.shape[0], slab_size)
+    offsets, keep = global_components((mask[start : end] for start, end in slabs), min_size)
+    labels = np.concatenate([offset_labels(mask[start : end], offset) 
+                             for (start, end), offset in zip(slabs, offsets)])
+    return labels, keep[labels]
+
+
+def distributed_components(mask, slab_size, min_size, size):
+    """
+    Returns the results of global_components() on each of "size" threads given the blocks of slabs
+    of slab_blocks().
+    """
+    
+    slabs = slab_ranges(mask.shape[0], slab_size)
+    blocks = slab_blocks(len(slabs), size)
+    queues = [queue.Queue() for rank in range(size)]
+    results = [None] * size
+    
+    def run(rank):
+        masks = (mask[start : end] for start, end in slabs[blocks[rank][0] : blocks[rank][1]])
+        results[rank] = global_components(masks, min_size, ThreadComm(rank, queues))
+    
+    threads = [threading.Thread(target=run, args=(rank,)) for rank in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_slab_ranges():
+    assert slab_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert slab_ranges(8, 4) == [(0, 4), (4, 8)]
+    assert slab_ranges(3, 0) == [(0, 1), (1, 2), (2, 3)]
+
+
+# Slab sizes which divide the 30 slices, which do not, a single slice and the whole volume.
+@pytest.mark.parametrize('slab_size', [1, 4, 7, 10, 30])
+@pytest.mark.parametrize('min_size', [0, 1, 20, 200])
+def test_global_components_match_whole_volume(slab_size, min_size):
+    whole, count = ndi.label(MASK)
+    sizes = np.bincount(whole.ravel(), minlength=count + 1)
+    expected = (sizes >= min_size)[whole] & MASK
+    
+    labels, kept = chunked_labels(MASK, slab_size, min_size)
+    np.testing.assert_array_equal(kept, expected)
+    # Slabs split the components of the volume into parts with distinct labels.
+    pairs = np.unique(np.stack((whole.ravel(), labels.ravel()), axis=1), axis=0)
+    assert len(np.unique(pairs[:, 1])) == len(pairs)
+    np.testing.assert_array_equal(labels > 0, MASK)
+
+
+def test_components_merged_across_slabs():
+    # A tube along x crossing every slab face is one component of the size of the whole tube.
+    mask = np.zeros((25, 5, 5), dtype=bool)
+    mask[:, 2, 2] = True
+    mask[3, 0, 0] = True
+    labels, kept = chunked_labels(mask, 4, 25)
+    np.testing.assert_array_equal(kept, mask & ~(labels == labels[3, 0, 0]))
+    labels, kept = chunked_labels(mask, 4, 26)
+    assert not np.any(kept)
+
+
+def test_slab_blocks():
+    assert slab_blocks(10, 3) == [(0, 4), (4, 7), (7, 10)]
+    assert slab_blocks(2, 4) == [(0, 1), (1, 2), (2, 2), (2, 2)]
+
+
+# More processes than slabs leaves some of them without a slab.
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 9])
+@pytest.mark.parametrize('min_size', [1, 200])
+def test_distributed_components_match_one_process(size, min_size):
+    expected = global_components((MASK[start : end] for start, end in slab_ranges(30, 4)), min_size)
+    for offsets, keep in distributed_components(MASK, 4, min_size, size):
+        assert offsets == expected[0]
+        np.testing.assert_array_equal(keep, expected[1])
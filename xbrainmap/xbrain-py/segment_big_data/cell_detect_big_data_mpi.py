@@ -57,47 +57,30 @@ import h5py
 from mpi4py import MPI
 import os.path
 from glob import glob
+from functools import partial
 from segmentation_param import *
-from detect_cells import detect_cells
+from detect_cells import detect_cells_incremental, detect_cells_sparse
+from parallel_detect import detect_cells_threaded
+from template_cache import set_template_cache_size
+from centroid_buffer import CentroidBuffer, centroid_dtype, duplicate_centroids
+from memory_usage import peak_rss_mb
+from tiling import load_tile_table, rank_tiles, core_slices, halo_slices, core_in_halo
 
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['compute_sub_volumes',
+__all__ = ['detection_halo',
            'cell_detect_big_data_mpi']
 
-def compute_sub_volumes(cell_prob_dataset):
+def detection_halo():
     """
-    This function divides a given volume into sub-volumes and returns three lists. Each list has the start
-    and end indices for a sub-volume. The sub-volume size is specified in the segmentation_param.py file. 
-    
-    Parameters
-    ----------
-    cell_prob_dataset : data set object
-    
-    Returns
-    ------
-    x,y,z list of indices 
-    
+    Returns the number of voxels read around a sub-volume in halo mode: half the template box, so cells 
+    centered in the sub-volume are fully correlated, plus the radius of the dilated template, so cells 
+    of the neighbor sub-volume zero out the same voxels as they would without sub-volumes.
     """
-    x_sub_volumes_idx = []
-    y_sub_volumes_idx = []
-    z_sub_volumes_idx = []
-    for x_idx in range(int(cell_prob_dataset.shape[0]/sub_vol_x)):
-        for y_idx in range(int(cell_prob_dataset.shape[1]/sub_vol_y)):
-            for z_idx in range(int(cell_prob_dataset.shape[2]/sub_vol_z)):
-                x_next_idx = []
-                x_next_idx.append(((sub_vol_x * x_idx), (sub_vol_x + sub_vol_x * x_idx)))
-                x_sub_volumes_idx.append(x_next_idx)
-                
-                y_next_idx = []
-                y_next_idx.append(((sub_vol_y * y_idx), (sub_vol_y + sub_vol_y * y_idx)))
-                y_sub_volumes_idx.append(y_next_idx)
-                
-                z_next_idx = []
-                z_next_idx.append(((sub_vol_z * z_idx), (sub_vol_z + sub_vol_z * z_idx)))
-                z_sub_volumes_idx.append(z_next_idx)
-    return x_sub_volumes_idx, y_sub_volumes_idx, z_sub_volumes_idx
+    box_radius = int(np.ceil(np.max(initial_template_size) / 2)) + 1
+    dilation_radius = int(np.ceil((np.max(initial_template_size) + dilation_size) / 2))
+    return box_radius + dilation_radius
 
 def cell_detect_big_data_mpi():
     """
@@ -137,54 +120,113 @@ def cell_detect_big_data_mpi():
     if hdf_file.get('Volume Centroids', getclass=True):
         hdf_file.__delitem__('Volume Centroids')
     
-    # Divide the volume into sub-volumes. Compute start and end indices for each sub-volume
-    x_sub_volumes_idx, y_sub_volumes_idx, z_sub_volumes_idx = compute_sub_volumes(cell_prob_dataset)
+    vol_shape = cell_prob_dataset.shape
+    if detect_with_halo:
+        halo = detection_halo()
+    else:
+        halo = 0
+    # Divide the volume into sub-volumes. The start and end indices of each sub-volume, with and without 
+    # the halo, are saved in the "Cell Tiles" data set so a restart uses the same sub-volumes.
+    sub_volumes = load_tile_table(hdf_file, vol_shape, (sub_vol_x, sub_vol_y, sub_vol_z), halo, size=size,
+                                  name='Cell Tiles', write=(rank == 0))
     print("Done with computing sub-volumes - This is rank %d of %d running on %s" % (rank, size, name))
-    iterations = int(len(x_sub_volumes_idx) / size)
-    partial_iterations = int(len(x_sub_volumes_idx) % size)
     
     # Create Data Set for the whole volume cell map
     vol_cell_map = hdf_file.create_dataset("Volume Cell Map", np.shape(cell_prob_dataset), dtype='uint32')
-    vol_centroids_sz = iterations * size * max_no_cells
-    # Create Data Set for Centroids detected in the volume
-    vol_centroids_ds = hdf_file.create_dataset("Volume Centroids", (vol_centroids_sz, 4), dtype='float32')
-    print("Volume Centroids size is %d" % vol_centroids_sz)
-    centroids_zeros = np.zeros((max_no_cells), dtype='float32')
+    # Centroids detected by this rank, written to the file once all sub-volumes are done.
+    rank_centroids = CentroidBuffer()
+    # Templates and their spectra are built once by each rank and reused for all its sub-volumes.
+    set_template_cache_size(template_cache_mb * 1024**2)
+    if cell_detect_mode == 'sparse':
+        detect = partial(detect_cells_sparse, single_precision=detect_single_precision)
+    else:
+        detect = partial(detect_cells_incremental, single_precision=detect_single_precision)
     
-    for idx in range(iterations):
-        x_idx = x_sub_volumes_idx[rank + (size * idx)]
-        y_idx = y_sub_volumes_idx[rank + (size * idx)]
-        z_idx = z_sub_volumes_idx[rank + (size * idx)]
-        
-        cell_prob_map = cell_prob_dataset[x_idx[0][0] : x_idx[0][1], y_idx[0][0] : y_idx[0][1], 
-                                          z_idx[0][0] : z_idx[0][1]]
+    # Rows of rank_centroids within "halo" voxels of a sub-volume face, the only ones which can be 
+    # duplicates of cells detected in the neighbor sub-volume.
+    boundary_rows = []
+    # In halo mode, the sub-volumes of this rank with the row + 1 in rank_centroids of each label of their 
+    # cell map (0 for cells of a neighbor sub-volume).
+    written_maps = []
+    for idx, sub_volume in enumerate(rank_tiles(sub_volumes, rank)):
+        # In halo mode read "halo" extra voxels on each side of the sub-volume (clipped to the volume).
+        core_first, core_last = sub_volume['core_start'], sub_volume['core_stop']
+        x_start, y_start, z_start = [int(f) for f in sub_volume['halo_start']]
+        cell_prob_map = cell_prob_dataset[halo_slices(sub_volume)]
         print("***Cell Sub-volume*** to be processed by rank %d x, y, z  %d:%d, %d:%d, %d:%d" % 
-              (rank, x_idx[0][0], x_idx[0][1], y_idx[0][0], y_idx[0][1], z_idx[0][0], z_idx[0][1]))
+              (rank, core_first[0], core_last[0], core_first[1], core_last[1], core_first[2], core_last[2]))
+        
+        centroids, cell_map = detect_cells_threaded(cell_prob_map, cell_probability_threshold,
+                                                    stopping_criterion, initial_template_size,
+                                                    dilation_size, max_no_cells, n_workers=detect_threads,
+                                                    tile_shape=detect_tile_shape, detect=detect, 
+                                                    return_buffer=True)
+        # The sub-volume indices need to be set to the whole volume indices.
+        records = centroids.records
+        records['x'] += x_start
+        records['y'] += y_start
+        records['z'] += z_start
+        records['subvolume'] = sub_volume['index']
+        # Keep the cells centered in the sub-volume, the others belong to a neighbor sub-volume.
+        inside = ((records['x'] >= core_first[0]) & (records['x'] < core_last[0]) &
+                  (records['y'] >= core_first[1]) & (records['y'] < core_last[1]) &
+                  (records['z'] >= core_first[2]) & (records['z'] < core_last[2]))
+        if detect_with_halo:
+            label_rows = np.zeros(len(records) + 1, dtype='int64')
+            label_rows[1:][inside] = len(rank_centroids) + np.arange(1, np.count_nonzero(inside) + 1)
+            written_maps.append((sub_volume, label_rows))
+        records = records[inside]
         
-        centroids, cell_map = detect_cells(cell_prob_map, cell_probability_threshold,
-                                           stopping_criterion, initial_template_size,
-                                           dilation_size, max_no_cells)
+        # Only the sub-volume itself (without the halo) is written, without the labels (record index + 1) 
+        # of the cells which belong to a neighbor sub-volume.
+        core_map = cell_map[core_in_halo(sub_volume)]
+        if not np.all(inside):
+            core_map[np.isin(core_map, np.flatnonzero(~inside) + 1)] = 0
         # The below line needs more work - if cell_map > 2GB it will not work.
-        vol_cell_map[x_idx[0][0] : x_idx[0][1], y_idx[0][0] : y_idx[0][1],
-                     z_idx[0][0] : z_idx[0][1]] = cell_map
+        vol_cell_map[core_slices(sub_volume)] = core_map
         
-        # The sub-volume indices need to be set to the whole volume indices.
-        centroids[:, 0] = centroids[:, 0] + x_idx[0][0]
-        centroids[:, 1] = centroids[:, 1] + y_idx[0][0]
-        centroids[:, 2] = centroids[:, 2] + z_idx[0][0]
-        # Below code may need more work - if the assumption of a pre-defined number cells to be detected 
-        # in a sub-volume is not good.
-        # Pad centroids with zeroes if found less than max_no_cells.
-        if len(centroids) < max_no_cells:
-            centroids = np.pad(centroids, pad_width=((0, (max_no_cells - len(centroids))), (0,0)), 
-                               mode='constant', constant_values=0)
-        # Save centriods into the data set slot
-        cent_idx = rank + size * idx
-        vol_centroids_ds[cent_idx * max_no_cells : (cent_idx + 1) * max_no_cells,:] = centroids
+        near_face = ((records['x'] < core_first[0] + halo) | (records['x'] >= core_last[0] - halo) |
+                     (records['y'] < core_first[1] + halo) | (records['y'] >= core_last[1] - halo) |
+                     (records['z'] < core_first[2] + halo) | (records['z'] >= core_last[2] - halo))
+        boundary_rows.extend(len(rank_centroids) + np.flatnonzero(near_face))
+        rank_centroids.extend(records)
+        print("Rank %d peak memory after %d sub-volumes is %.1f MB" % (rank, idx + 1, peak_rss_mb()))
+    
+    if detect_with_halo:
+        # A cell on a sub-volume face may be found by both sub-volumes, at slightly different voxels. 
+        # Gather the cells near faces from all ranks and drop the duplicate with the lower score.
+        boundary_rows = np.array(boundary_rows, dtype='int64')
+        boundary_records = comm.allgather(rank_centroids.records[boundary_rows])
+        duplicate = duplicate_centroids(np.concatenate(boundary_records),
+                                        (np.max(initial_template_size) + dilation_size) / 2)
+        rank_offset = sum(len(records) for records in boundary_records[:rank])
+        keep = np.ones(len(rank_centroids), dtype=bool)
+        keep[boundary_rows[duplicate[rank_offset : rank_offset + len(boundary_rows)]]] = False
+        print("Rank %d removed %d duplicate cells" % (rank, np.count_nonzero(~keep)))
+        kept_centroids = CentroidBuffer(np.count_nonzero(keep))
+        kept_centroids.extend(rank_centroids.records[keep])
+        rank_centroids = kept_centroids
+    
+    # Create Data Set for Centroids detected in the volume, sized to the number of detected cells. Each 
+    # rank writes its centroids after the centroids of the lower ranks.
+    centroid_counts = comm.allgather(len(rank_centroids))
+    vol_centroids_sz = sum(centroid_counts)
+    vol_centroids_ds = hdf_file.create_dataset("Volume Centroids", (vol_centroids_sz,), dtype=centroid_dtype,
+                                               maxshape=(None,), chunks=(centroid_chunk_rows,))
+    if rank == 0:
+        print("Volume Centroids size is %d" % vol_centroids_sz)
+    rank_centroids.flush_to_dataset(vol_centroids_ds, sum(centroid_counts[:rank]))
+    
+    if detect_with_halo:
+        # Relabel the sub-volumes of this rank so the label of a cell is its row in "Volume Centroids" 
+        # plus 1, and the removed duplicates are not in the cell map.
+        kept_rows = np.concatenate(([0], np.where(keep, sum(centroid_counts[:rank]) + np.cumsum(keep), 0)))
+        for sub_volume, label_rows in written_maps:
+            volume_labels = kept_rows[label_rows].astype('uint32')
+            vol_cell_map[core_slices(sub_volume)] = volume_labels[vol_cell_map[core_slices(sub_volume)]]
     
     hdf_file.close()
-    # Ignore the partial iteration for now - i.e. assumes the number of sub-volumes is multiple of size.
-    print("Done with Cell Detection and Number of sub-volumes ignored is %d" % partial_iterations)
+    print("Done with Cell Detection - This is rank %d of %d" % (rank, size))
 
 if __name__ == '__main__':
     cell_detect_big_data_mpi()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Module for matching a probability map against several spherical templates in a single FFT pass.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from template_cache import (fft_shape, rfftn, irfftn, template_spectra, get_synth_dict, get_templates,
+                            get_template_spectra)
+
+__author__ = "Eva Dyer"
+__credits__ = "Mehdi Tondravi"
+
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['threshold_probability',
+           'batched_fftconvolve',
+           'match_templates']
+
+
+def threshold_probability(cell_probability, probability_threshold):
+    """
+    Returns a float32 copy of the probability map with the voxels not above "probability_threshold" 
+    set to zero. Same as (cell_probability * (cell_probability > probability_threshold)).astype('float32')
+    but the map is copied once and thresholded in place instead of going through full size temporaries.
+    """
+    
+    newtest = np.array(cell_probability, dtype='float32')
+    np.copyto(newtest, 0, where=(cell_probability <= probability_threshold))
+    return newtest
+
+
+def batched_fftconvolve(volume, templates, spectra=None, n_workers=1, single_precision=False, out=None):
+    """
+    Convolves a 3D volume with a stack of equally sized 3D templates. The volume is transformed only
+    once, multiplied by the spectra of all templates and inverse transformed as one batch. 
+    
+    Parameters
+    ----------
+    volume : ndarray
+        Nr x Nc x Nz array
+    templates : ndarray
+        N x box_length x box_length x box_length array with box_length odd
+    spectra : ndarray, optional
+        template_spectra(templates, volume.shape, single_precision), computed here if not given.
+    n_workers : int, optional
+        number of threads. If more than one, the inverse transforms of the templates are run in a
+        thread pool instead of as one batch (the FFTs release the GIL).
+    single_precision : bool, optional
+        memory lean mode. The transforms are computed in single precision one template at a time,
+        reusing a single spectrum work buffer, instead of as one double precision batch.
+    out : ndarray, optional
+        N x Nr x Nc x Nz float32 array the result is written to.
+    
+    Returns
+    -------
+    ndarray
+        N x Nr x Nc x Nz float32 array. Entry j is the same as 
+        signal.fftconvolve(volume, templates[j], mode='same').
+    """
+    
+    box_length = templates.shape[1]
+    padded_shape = fft_shape(volume.shape, box_length)
+    if spectra is None:
+        spectra = template_spectra(templates, volume.shape, single_precision)
+    volume_spectrum = rfftn(volume, padded_shape, single_precision=single_precision, workers=n_workers)
+    if out is None:
+        out = np.empty((len(templates),) + tuple(volume.shape), dtype='float32')
+    
+    # Keep the center part of the full convolution which has the same size as the volume.
+    start = (box_length - 1) // 2
+    same = (slice(start, start + volume.shape[0]), slice(start, start + volume.shape[1]), 
+            slice(start, start + volume.shape[2]))
+    if single_precision:
+        work = np.empty_like(volume_spectrum)
+        for j in range(len(templates)):
+            np.multiply(spectra[j], volume_spectrum, out=work)
+            out[j] = irfftn(work, padded_shape, workers=n_workers, overwrite_x=True)[same]
+        return out
+    
+    if n_workers <= 1 or len(templates) == 1:
+        convout = np.fft.irfftn(spectra * volume_spectrum, padded_shape, axes=(1, 2, 3))
+        out[...] = convout[(slice(None),) + same]
+        return out
+    
+    def convolve(j):
+        out[j] = np.fft.irfftn(spectra[j] * volume_spectrum, padded_shape, axes=(0, 1, 2))[same]
+    pool = ThreadPool(min(n_workers, len(templates)))
+    try:
+        pool.map(convolve, range(len(templates)))
+    finally:
+        pool.close()
+    return out
+
+
+def match_templates(cell_probability, probability_threshold, initial_template_size):
+    """
+    Matches the thresholded probability map against a spherical template for each radius in 
+    initial_template_size and returns, for each voxel, the radius of the best matching template and 
+    its normalized correlation. 
+    
+    Parameters
+    ----------
+    cell_probability : ndarray
+        Nr x Nc x Nz matrix which contains the probability of each voxel being a cell body.
+    probability_threshold : float
+        threshold between (0,1) to apply to probability map.
+    initial_template_size : int or 1xN vector
+        sizes of the spherical templates
+    
+    Returns
+    -------
+    ndarray
+        best_radius = Nr x Nc x Nz matrix with the template size with the highest correlation.
+    ndarray
+        best_score = Nr x Nc x Nz float32 matrix with the normalized correlation (same scale as the 
+        fourth column of the centroids returned by detect_cells()) of the best template.
+    """
+    
+    newtest = threshold_probability(cell_probability, probability_threshold)
+    initial_template_size = np.atleast_1d(initial_template_size)
+    
+    box_radius = np.ceil(np.max(initial_template_size)/2) + 1
+    dict = get_synth_dict(initial_template_size, box_radius)
+    templates = get_templates(initial_template_size, box_radius)
+    
+    convout = batched_fftconvolve(newtest, templates, 
+                                  get_template_spectra(initial_template_size, box_radius, newtest.shape))
+    # Normalize the correlation of each template the same way detect_cells() does.
+    convout /= np.sum(dict, axis=0)[:, np.newaxis, np.newaxis, np.newaxis]
+    best_atom = np.argmax(convout, axis=0)
+    best_score = np.amax(convout, axis=0)
+    best_radius = initial_template_size[best_atom]
+    return best_radius, best_score
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Module for running cell detection with several threads within one process.
+
+NumPy FFTs and SciPy image filters release the GIL, so one process per node can use all cores on one
+shared copy of the probability map instead of running one MPI rank per core.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from centroid_buffer import CentroidBuffer
+from detect_cells import detect_cells_incremental
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['tile_slices',
+           'detect_cells_threaded']
+
+
+def tile_slices(shape, tile_shape):
+    """
+    Divides a volume into non-overlapping tiles. The last tile along an axis is smaller if the 
+    volume size is not a multiple of the tile size.
+    
+    Parameters
+    ----------
+    shape : tuple
+        shape of the volume (3D)
+    tile_shape : tuple
+        shape of a tile (3D)
+    
+    Returns
+    -------
+    list
+        a tuple of three slices for each tile
+    """
+    
+    tiles = []
+    for x_start in range(0, shape[0], tile_shape[0]):
+        for y_start in range(0, shape[1], tile_shape[1]):
+            for z_start in range(0, shape[2], tile_shape[2]):
+                tiles.append((slice(x_start, min(x_start + tile_shape[0], shape[0])),
+                              slice(y_start, min(y_start + tile_shape[1], shape[1])),
+                              slice(z_start, min(z_start + tile_shape[2], shape[2]))))
+    return tiles
+
+
+def detect_cells_threaded(cell_probability, probability_threshold, stopping_criterion, 
+                          initial_template_size, dilation_size, max_no_cells, n_workers=None,
+                          tile_shape=None, detect=detect_cells_incremental, return_buffer=False):
+    """
+    Runs a cell detection function with a pool of threads.
+    
+    Without tile_shape the whole volume is one tile and the threads correlate the probability map
+    with the different templates. With tile_shape the volume is divided into non-overlapping tiles
+    which are detected independently by the threads, and the cells of all tiles are merged. As with 
+    the sub-volumes of cell_detect_big_data_mpi, cells crossing a tile face may be missed or found in
+    both tiles.
+    
+    Parameters 
+    ----------
+    cell_probability, probability_threshold, stopping_criterion, initial_template_size, dilation_size :
+        see detect_cells()
+    max_no_cells : int
+        maximum number of cells in each tile
+    n_workers : int, optional
+        number of threads, by default the number of cores.
+    tile_shape : tuple, optional
+        shape of the tiles (3D)
+    detect : function, optional
+        detect_cells_incremental (default) or detect_cells_sparse
+    return_buffer : bool, optional
+        return the centroids as a CentroidBuffer instead of a D x 4 matrix.
+    
+    Returns
+    -------
+    ndarray or CentroidBuffer
+        centroids of the detected cells in the volume coordinates (see detect_cells()).
+    ndarray
+        new_map = Nr x Nc x Nz matrix containing labeled detected cells (1,...,D)
+    """
+    
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if tile_shape is None:
+        tiles = tile_slices(np.shape(cell_probability), np.shape(cell_probability))
+    else:
+        tiles = tile_slices(np.shape(cell_probability), tile_shape)
+    if len(tiles) == 1:
+        return detect(cell_probability, probability_threshold, stopping_criterion, initial_template_size,
+                      dilation_size, max_no_cells, return_buffer=return_buffer, n_workers=n_workers)
+    
+    def detect_tile(tile):
+        return detect(cell_probability[tile], probability_threshold, stopping_criterion, 
+                      initial_template_size, dilation_size, max_no_cells, return_buffer=True)
+    
+    pool = ThreadPool(min(n_workers, len(tiles)))
+    try:
+        results = pool.map(detect_tile, tiles)
+    finally:
+        pool.close()
+    
+    # Give the cells of each tile labels following the labels of the previous tiles.
+    no_of_cells = sum(len(tile_centroids) for tile_centroids, tile_map in results)
+    map_dtype = np.promote_types(results[0][1].dtype, np.min_scalar_type(no_of_cells))
+    new_map = np.zeros(np.shape(cell_probability), dtype=map_dtype)
+    centroids = CentroidBuffer(no_of_cells)
+    label_offset = 0
+    for tile, (tile_centroids, tile_map) in zip(tiles, results):
+        labeled = tile_map > 0
+        new_map[tile][labeled] = tile_map[labeled].astype(map_dtype) + label_offset
+        records = tile_centroids.records.copy()
+        records['x'] += tile[0].start
+        records['y'] += tile[1].start
+        records['z'] += tile[2].start
+        centroids.extend(records)
+        label_offset += len(tile_centroids)
+    
+    if return_buffer:
+        return(centroids, new_map)
+    return(centroids.as_matrix(), new_map)
@@ -111,8 +111,45 @@ stopping_criterion = 0.47
 initial_template_size = 18
 dilation_size = 8
 max_no_cells = 2
+# Cell detection mode: 'greedy' finds one cell per iteration, 'sparse' finds all cells in one pass 
+# (faster for dense tissue, may differ from 'greedy' where cells touch).
+cell_detect_mode = 'greedy'
+# Read a margin (one template radius plus the dilated template radius) around each sub-volume so cells 
+# crossing sub-volume faces are detected once, in the sub-volume of their centroid, and duplicates found 
+# by two sub-volumes are removed. The cell map then labels each cell with its row in "Volume Centroids" 
+# plus 1, but a cell crossing a face is only labeled on the side of its centroid.
+detect_with_halo = False
+# Memory lean cell detection: single precision FFTs, about half the memory of the correlation, so larger 
+# sub-volumes fit per core. Correlations differ by about 1e-6 from double precision.
+detect_single_precision = False
+# Number of threads used by each rank for cell detection. With more than one thread, one rank per node
+# can be run instead of one rank per core.
+detect_threads = 1
+# Shape of the tiles detected in parallel by the threads of a rank, or None to only run the templates 
+# of a sub-volume in parallel. Example: (70, 91, 253) gives 4 tiles per sub-volume.
+detect_tile_shape = None
+# Number of centroids per chunk of the "Volume Centroids" data set.
+centroid_chunk_rows = 4096
+# Memory (MB) used by each rank to cache the cell templates and their FFT spectra between sub-volumes.
+template_cache_mb = 2000
 
 # Vessel segmentation parameters                                                                    
 vessel_probability_threshold = .68
 vessel_dilation_size = 3
 minimum_size = 4000
+# Backend of the ball dilation: 'auto', 'boxes', 'edt' or 'ndimage'. All give the same output, see 
+# ball_morphology.py.
+morphology_backend = 'auto'
+# Vessel segmentation mode: 'tiles' segments each sub-volume on its own (small objects are removed by their
+# size within the sub-volume), 'chunked' segments the whole volume slab by slab out of core, each rank a
+# block of slabs, and removes small objects by their size in the whole volume, 'sweep' segments the 
+# sub-volumes of 'tiles' mode with every combination of the sweep parameters below and saves the number 
+# of vessel voxels of each.
+vessel_detect_mode = 'tiles'
+# Number of x slices per slab in 'chunked' mode.
+vessel_slab_size = 64
+# Parameter values of 'sweep' mode, and whether to also save the vessel map of every combination.
+sweep_probability_thresholds = [.6, .64, .68, .72, .76]
+sweep_dilation_sizes = [1, 3, 5]
+sweep_minimum_sizes = [1000, 2000, 4000, 8000]
+sweep_save_maps = False
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+Module for caching the spherical templates used for cell detection and their FFT spectra.
+
+Almost all sub-volumes processed by a rank have the same shape, so the templates and their padded
+spectra are built once and then reused for every sub-volume and every greedy iteration. The cache
+is shared by the whole process and the least recently used entries are evicted when the cache
+holds more than a given number of bytes.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.fftpack import next_fast_len
+from create_synth_dict import create_synth_dict
+
+# scipy.fft (scipy >= 1.4) transforms float32 input in single precision. numpy.fft always computes in 
+# double precision, so without it single precision spectra are only rounded after the transform.
+try:
+    from scipy import fft as _scipy_fft
+except ImportError:
+    _scipy_fft = None
+if not hasattr(_scipy_fft, 'rfftn'):
+    _scipy_fft = None
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['fft_shape',
+           'rfftn',
+           'irfftn',
+           'template_spectra',
+           'get_synth_dict',
+           'get_templates',
+           'get_template_spectra',
+           'set_template_cache_size',
+           'clear_template_cache']
+
+# Default cache size is 1GB per process.
+_max_cache_bytes = 1024**3
+_cache_bytes = 0
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def fft_shape(volume_shape, box_length):
+    """
+    Returns the padded shape used to convolve a volume of shape "volume_shape" with templates of width
+    "box_length". It is large enough to hold the full linear convolution and only has small prime 
+    factors so the FFTs are fast.
+    """
+    
+    return tuple(next_fast_len(int(n + box_length - 1)) for n in volume_shape)
+
+
+def rfftn(x, shape, axes=None, single_precision=False, workers=1):
+    """
+    Real input FFT of "x" zero padded to "shape". If "single_precision" is True the transform of 
+    a float32 copy of "x" is returned as a complex64 array, otherwise a complex128 array is returned. 
+    "workers" threads are used when scipy.fft is available. By default the last len(shape) axes are
+    transformed.
+    """
+    
+    if axes is None:
+        axes = tuple(range(-len(shape), 0))
+    if not single_precision:
+        # numpy >= 2.0 transforms float32 input in single precision.
+        return np.fft.rfftn(np.asarray(x, dtype='float64'), shape, axes=axes)
+    x = np.asarray(x, dtype='float32')
+    if _scipy_fft is None:
+        return np.fft.rfftn(x, shape, axes=axes).astype('complex64')
+    return _scipy_fft.rfftn(x, shape, axes=axes, workers=workers)
+
+
+def irfftn(x, shape, axes=None, workers=1, overwrite_x=False):
+    """
+    Inverse of rfftn(). A complex64 input gives a float32 output when scipy.fft is available. With 
+    "overwrite_x" the input may be used as work space.
+    """
+    
+    if axes is None:
+        axes = tuple(range(-len(shape), 0))
+    if _scipy_fft is None or x.dtype != np.complex64:
+        return np.fft.irfftn(x, shape, axes=axes)
+    return _scipy_fft.irfftn(x, shape, axes=axes, workers=workers, overwrite_x=overwrite_x)
+
+
+def template_spectra(templates, volume_shape, single_precision=False):
+    """
+    Computes the FFT of a stack of templates padded for convolution with a volume of shape 
+    "volume_shape".
+    
+    Parameters
+    ----------
+    templates : ndarray
+        N x box_length x box_length x box_length array with box_length odd
+    volume_shape : tuple
+        shape of the volume the templates will be convolved with.
+    single_precision : bool, optional
+        compute a complex64 instead of a complex128 array, half the memory.
+    
+    Returns
+    -------
+    ndarray
+        N x rfftn shape complex array
+    """
+    
+    return rfftn(templates, fft_shape(volume_shape, templates.shape[1]), axes=(1, 2, 3), 
+                 single_precision=single_precision)
+
+
+def _cache_key(name, radii, box_radius, shape=()):
+    return (name, tuple(float(r) for r in np.atleast_1d(radii)), float(box_radius), tuple(int(n) for n in shape))
+
+
+def _cached(key, build):
+    """
+    Returns the cached array for "key". If it is not cached, calls build() and caches its output 
+    if it fits into the cache, evicting the least recently used arrays as needed.
+    """
+    
+    global _cache_bytes
+    with _cache_lock:
+        if key in _cache:
+            value = _cache.pop(key)
+            _cache[key] = value
+            return value
+    
+    value = build()
+    value.flags.writeable = False
+    with _cache_lock:
+        if key not in _cache and value.nbytes <= _max_cache_bytes:
+            _cache[key] = value
+            _cache_bytes += value.nbytes
+            while _cache_bytes > _max_cache_bytes:
+                old_key, old_value = _cache.popitem(last=False)
+                _cache_bytes -= old_value.nbytes
+    return value
+
+
+def get_synth_dict(radii, box_radius):
+    """
+    Cached version of create_synth_dict(). The returned array is read only.
+    """
+    
+    return _cached(_cache_key('dict', radii, box_radius), 
+                   lambda: create_synth_dict(np.atleast_1d(radii), box_radius))
+
+
+def get_templates(radii, box_radius):
+    """
+    Returns the templates of get_synth_dict() reshaped into a 
+    N x box_length x box_length x box_length array. The returned array is read only.
+    """
+    
+    def build():
+        dict = get_synth_dict(radii, box_radius)
+        box_length = int(round(np.shape(dict)[0] ** (1/3)))
+        return np.reshape(dict.T, (np.shape(dict)[1], box_length, box_length, box_length)).copy()
+    
+    return _cached(_cache_key('templates', radii, box_radius), build)
+
+
+def get_template_spectra(radii, box_radius, volume_shape, single_precision=False):
+    """
+    Returns template_spectra() of the templates for "radii" and "box_radius" padded for a volume of 
+    shape "volume_shape". The returned array is read only.
+    """
+    
+    name = 'spectra32' if single_precision else 'spectra'
+    return _cached(_cache_key(name, radii, box_radius, volume_shape),
+                   lambda: template_spectra(get_templates(radii, box_radius), volume_shape, single_precision))
+
+
+def set_template_cache_size(max_bytes):
+    """
+    Sets the maximum number of bytes held by the template cache and evicts the least recently used
+    entries which no longer fit.
+    """
+    
+    global _max_cache_bytes, _cache_bytes
+    with _cache_lock:
+        _max_cache_bytes = int(max_bytes)
+        while _cache and _cache_bytes > _max_cache_bytes:
+            old_key, old_value = _cache.popitem(last=False)
+            _cache_bytes -= old_value.nbytes
+
+
+def clear_template_cache():
+    """
+    Removes all templates and spectra from the cache.
+    """
+    
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
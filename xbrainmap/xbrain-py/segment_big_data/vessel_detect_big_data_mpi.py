@@ -58,46 +58,14 @@ from mpi4py import MPI
 import os.path
 from glob import glob
 from segmentation_param import *
-from segment_vessels import segment_vessels
+from segment_vessels import segment_vessels, segment_vessels_chunked, segment_vessels_sweep
+from tiling import load_tile_table, rank_tiles, core_slices, tile_orig_indices
 
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['compute_sub_volumes',
-           'vessel_detect_big_data_mpi']
-
-def compute_sub_volumes(cell_prob_dataset):
-    """
-    This function divides a given volume into sub-volumes and returns three lists. Each list has the start
-    and end indices for a sub-volume. The sub-volume size is specified in the segmentation_param.py file. 
-    
-    Parameters
-    ----------
-    cell_prob_dataset : data set object 
-    
-    Returns
-    -------
-    x,y,z list of indices
-    
-    """
-    x_sub_volumes_idx = []
-    y_sub_volumes_idx = []
-    z_sub_volumes_idx = []
-    for x_idx in range(int(cell_prob_dataset.shape[0]/v_sub_vol_x)):
-        for y_idx in range(int(cell_prob_dataset.shape[1]/v_sub_vol_y)):
-            for z_idx in range(int(cell_prob_dataset.shape[2]/v_sub_vol_z)):
-                x_next_idx = []
-                x_next_idx.append(((v_sub_vol_x * x_idx), (v_sub_vol_x + v_sub_vol_x * x_idx)))
-                x_sub_volumes_idx.append(x_next_idx)
-                
-                y_next_idx = []
-                y_next_idx.append(((v_sub_vol_y * y_idx), (v_sub_vol_y + v_sub_vol_y * y_idx)))
-                y_sub_volumes_idx.append(y_next_idx)
-                
-                z_next_idx = []
-                z_next_idx.append(((v_sub_vol_z * z_idx), (v_sub_vol_z + v_sub_vol_z * z_idx)))
-                z_sub_volumes_idx.append(z_next_idx)
-    return x_sub_volumes_idx, y_sub_volumes_idx, z_sub_volumes_idx
+__all__ = ['vessel_detect_big_data_mpi',
+           'vessel_sweep_mpi']
 
 def vessel_detect_big_data_mpi():
     """ 
@@ -139,30 +107,91 @@ def vessel_detect_big_data_mpi():
     # Create Data Set for the whole volume vessel map
     vol_vessel_map = hdf_file.create_dataset("Volume Vessel Map", np.shape(vessel_prob_dataset), dtype='uint8')
     
-    # Divide the volume into sub-volumes. Compute start and end indices for each sub-volume
-    x_sub_volumes_idx, y_sub_volumes_idx, z_sub_volumes_idx = compute_sub_volumes(vessel_prob_dataset)
+    if vessel_detect_mode == 'chunked':
+        # Small objects are removed by their size in the whole volume. Each rank segments a block of 
+        # consecutive slabs and the components are merged across the blocks of all ranks.
+        segment_vessels_chunked(vessel_prob_dataset, vol_vessel_map, vessel_probability_threshold,
+                                vessel_dilation_size, minimum_size, vessel_slab_size, morphology_backend, comm)
+        if rank == 0:
+            print("Done with chunked vessel segmentation, slab size is %d" % vessel_slab_size)
+        hdf_file.close()
+        return
+    
+    # Divide the volume into sub-volumes, the last sub-volume along an axis is smaller if the volume size 
+    # is not a multiple of the sub-volume size. Start and end indices of each sub-volume are saved in the 
+    # "Vessel Tiles" data set so a restart uses the same sub-volumes.
+    sub_volumes = load_tile_table(hdf_file, vessel_prob_dataset.shape, (v_sub_vol_x, v_sub_vol_y, v_sub_vol_z),
+                                  size=size, name='Vessel Tiles', write=(rank == 0))
     print("Done with computing sub-volumes - This is rank %d of %d running on %s" % (rank, size, name))
     
-    iterations = int(len(x_sub_volumes_idx) / size)
-    partial_iterations = int(len(x_sub_volumes_idx) % size)
-    for idx in range(iterations):
-        x_idx = x_sub_volumes_idx[rank + (size * idx)]
-        y_idx = y_sub_volumes_idx[rank + (size * idx)]
-        z_idx = z_sub_volumes_idx[rank + (size * idx)]
-        
-        vessel_prob_map = vessel_prob_dataset[x_idx[0][0] : x_idx[0][1], y_idx[0][0] : y_idx[0][1], 
-                                          z_idx[0][0] : z_idx[0][1]]
-        print("***Cell Sub-volume*** to be processed by rank %d x, y, z  %d:%d, %d:%d, %d:%d" % 
-              (rank, x_idx[0][0], x_idx[0][1], y_idx[0][0], y_idx[0][1], z_idx[0][0], z_idx[0][1]))
+    if vessel_detect_mode == 'sweep':
+        vessel_sweep_mpi(comm, hdf_file, vessel_prob_dataset, sub_volumes)
+        hdf_file.close()
+        return
+    
+    for sub_volume in rank_tiles(sub_volumes, rank):
+        vessel_prob_map = vessel_prob_dataset[core_slices(sub_volume)]
+        print("***Vessel Sub-volume*** to be processed by rank %d x, y, z  %d:%d, %d:%d, %d:%d" % 
+              ((rank,) + tuple(tile_orig_indices(sub_volume))))
         
         vessel_map = segment_vessels(vessel_prob_map, vessel_probability_threshold,
-                                     vessel_dilation_size, minimum_size)
+                                     vessel_dilation_size, minimum_size, morphology_backend)
         # Below line needs more work - it will not work if vessel_map is > 2GB
-        vol_vessel_map[x_idx[0][0] : x_idx[0][1], y_idx[0][0] : y_idx[0][1],
-                     z_idx[0][0] : z_idx[0][1]] = vessel_map
-    # Ignore the partial iteration for now - i.e. assumes the number of sub-volumes is multiple of size (process).
-    print("Number of sub-volumes ignored is %d" % partial_iterations)
+        vol_vessel_map[core_slices(sub_volume)] = vessel_map
     hdf_file.close()
 
+def vessel_sweep_mpi(comm, hdf_file, vessel_prob_dataset, sub_volumes):
+    """
+    Segments every sub-volume with every combination of the sweep parameters in segmentation_param.py, 
+    reading each sub-volume once (see segment_vessels_sweep()). The total number of vessel voxels and 
+    components of each combination is saved in the "Vessel Sweep" data set, one row per combination with
+    columns probability threshold, dilation size, minimum size, voxels and components. With 
+    sweep_save_maps the vessel map of each combination is saved in the "Volume Vessel Map <threshold> 
+    <dilation size> <minimum size>" data set. sub_volumes is the tile table (see tiling.py) of the 
+    sub-volumes.
+    """
+    
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    settings = [(t, d, m) for t in sweep_probability_thresholds for d in sweep_dilation_sizes 
+                for m in sweep_minimum_sizes]
+    # Data sets must be created by all ranks.
+    maps = []
+    if sweep_save_maps:
+        for setting in settings:
+            ds_name = "Volume Vessel Map %g %d %d" % setting
+            if hdf_file.get(ds_name, getclass=True):
+                hdf_file.__delitem__(ds_name)
+            maps.append(hdf_file.create_dataset(ds_name, np.shape(vessel_prob_dataset), dtype='uint8'))
+    voxels = np.zeros(len(settings), dtype='int64')
+    objects = np.zeros(len(settings), dtype='int64')
+    
+    for sub_volume in rank_tiles(sub_volumes, rank):
+        vessel_prob_map = vessel_prob_dataset[core_slices(sub_volume)]
+        print("***Vessel Sub-volume*** to be swept by rank %d x, y, z  %d:%d, %d:%d, %d:%d" % 
+              ((rank,) + tuple(tile_orig_indices(sub_volume))))
+        sub_settings, sub_voxels, sub_objects, vessel_maps = segment_vessels_sweep(
+            vessel_prob_map, sweep_probability_thresholds, sweep_dilation_sizes, sweep_minimum_sizes,
+            morphology_backend, sweep_save_maps)
+        voxels += sub_voxels
+        objects += sub_objects
+        for vol_vessel_map, vessel_map in zip(maps, vessel_maps or []):
+            vol_vessel_map[core_slices(sub_volume)] = vessel_map
+    
+    total_voxels = np.zeros_like(voxels)
+    total_objects = np.zeros_like(objects)
+    comm.Allreduce(voxels, total_voxels, op=MPI.SUM)
+    comm.Allreduce(objects, total_objects, op=MPI.SUM)
+    if hdf_file.get('Vessel Sweep', getclass=True):
+        hdf_file.__delitem__('Vessel Sweep')
+    sweep_ds = hdf_file.create_dataset('Vessel Sweep', (len(settings), 5), dtype='float64')
+    sweep_ds.attrs['columns'] = np.array([b'probability_threshold', b'dilation_size', b'minimum_size', 
+                                          b'voxels', b'components'])
+    if rank == 0:
+        sweep_ds[...] = np.column_stack((np.array(settings, dtype='float64'), total_voxels, total_objects))
+        for setting, setting_voxels, setting_objects in zip(settings, total_voxels, total_objects):
+            print("threshold %g, dilation size %d, minimum size %d: %d vessel voxels in %d components" % 
+                  (setting + (setting_voxels, setting_objects)))
+
 if __name__ == '__main__':
     vessel_detect_big_data_mpi()
@@ -60,6 +60,7 @@ import os.path
 from glob import glob
 import time
 from segmentation_param import *
+from create_subvol_mask import create_subvol_labels
 
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
@@ -112,39 +113,24 @@ def classify_subvolumes():
         exds = infile[ilastik_ds_name]
         start_read = time.time()
         export_indata = exds[...]
-        export_outdata = np.zeros(export_indata.shape, dtype='uint8')
         print("export_indata data shape is", export_indata.shape)
         end_read = time.time()
         print("Read time for all rows of Ilastik Prob map is %d Sec" % (end_read - start_read))
-        print_cycle = 100
         start_loop_time = time.time()
-        for row in range(export_outdata.shape[0]):
-            for colmn in range(export_outdata.shape[1]):
-                outdata = np.zeros((export_outdata.shape[2], export_outdata.shape[3]), 'uint8')
-                if row == 0:
-                    if colmn == 0:
-                        print("outdata shape is", outdata.shape)
-                outdata[np.arange(len(outdata)), np.argmax(export_indata[row, colmn, :, :], axis=-1)] = 1
-                if np.count_nonzero(outdata) != export_outdata.shape[2]:
-                    print("Something is very wrong - check row %d and colmn %d" % (row, colmn))
-                export_outdata[row, colmn, :, :] = outdata.copy()
-            if row % print_cycle == 0:
-                print("time to classify %d rows is %d Sec" % (print_cycle, (time.time() - start_loop_time)))
-                start_loop_time = time.time()
-         # Segment classes and saved them into datasets
+        export_labels = create_subvol_labels(export_indata)
+        no_of_classes = export_indata.shape[3]
+        del export_indata
+        print("time to classify %d rows is %d Sec" % (export_labels.shape[0], (time.time() - start_loop_time)))
+        # Segment classes and saved them into datasets
         start_ds_time = time.time()
-        no_of_classes = export_outdata.shape[3]
-        export_outdata = np.transpose(export_outdata, (3, 0, 1, 2))
-        for idx in range(no_of_classes):
+        for class_idx in range(no_of_classes):
             time_per_ds = time.time()
-            if infile.get(ilastik_classes[idx], getclass=True):
-                print("*** Deleting subvolume object map %s ***" % (ilastik_classes[idx]))
-                infile.__delitem__(ilastik_classes[idx])
-            outdataset = infile.create_dataset(ilastik_classes[idx], 
-                                               (export_outdata.shape[1], export_outdata.shape[2],
-                                                export_outdata.shape[3]), export_outdata.dtype)
-            outdataset[...] = export_outdata[idx, ...]
-            print("Time to save %s dataset is %d Sec" % (ilastik_classes[idx], (time.time() - time_per_ds)))
+            if infile.get(ilastik_classes[class_idx], getclass=True):
+                print("*** Deleting subvolume object map %s ***" % (ilastik_classes[class_idx]))
+                infile.__delitem__(ilastik_classes[class_idx])
+            outdataset = infile.create_dataset(ilastik_classes[class_idx], export_labels.shape, 'uint8')
+            outdataset[...] = (export_labels == class_idx).view('uint8')
+            print("Time to save %s dataset is %d Sec" % (ilastik_classes[class_idx], (time.time() - time_per_ds)))
         # Print time to save datasets
         print("Time to save all object maps is %d Sec" % (time.time() - start_ds_time))
         infile.close()
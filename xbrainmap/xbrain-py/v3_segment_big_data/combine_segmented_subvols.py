@@ -60,6 +60,8 @@ from glob import glob
 from mpi4py import MPI
 import time
 from segmentation_param import *
+from subvolumes import volume_chunks
+from task_scheduler import TaskScheduler, file_costs
 
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
@@ -69,8 +71,9 @@ __all__ = ['combine_segmented_subvols']
 
 def combine_segmented_subvols():
     """
-    Combines many segmented images created for sub-volumes into one big hdf5 for the whole volume with a 
-    dataset for each segmented image class/label.
+    Combines many segmented images created for sub-volumes into one big hdf5 for the whole volume with 
+    the class labels dataset (the class index of each pixel) and, if the output is not binary, the image 
+    intensity dataset. The segmented image of a class is read with read_segmented_class().
     
     Input: The segmented sub-volume image files -  files location is specified in the seg_user_param.py file.
     
@@ -97,7 +100,7 @@ def combine_segmented_subvols():
     volume_ds_shape[0] = volshape[1]
     volume_ds_shape[1] = volshape[3]
     volume_ds_shape[2] = volshape[5]
-    # Get the list of segmented datasets 
+    # Get the list of segmented datasets - the class labels and, if output is not binary, the image intensity.
     seg_ds_list = []
     for ds in f.keys():
         seg_ds_list.append(ds)
@@ -106,6 +109,8 @@ def combine_segmented_subvols():
     seg_ds_list.remove('orig_indices')
     seg_ds_list.remove('right_overlap')
     seg_ds_list.remove('left_overlap')
+    seg_ds_dtypes = [f[ds].dtype for ds in seg_ds_list]
+    seg_ds_attrs = [dict(f[ds].attrs) for ds in seg_ds_list]
     f.close()
     
     # Create an hdf file to contain the whole volume segmented images for all classes.
@@ -134,27 +139,25 @@ def combine_segmented_subvols():
         vol_map_file = h5py.File(seg_volume_file, 'w', driver='mpio', comm=comm)
     if rank == 0:
         print("Created Segmented volume file %s and time to create it is %d Sec" % (seg_volume_file, time.time() - create_time))
-    iterations = int(len(input_files) / size) + (len(input_files) % size > 0)
-    if rank == 0:
-        print("iterations is ", iterations)
+    costs = file_costs(input_files)
     # Combine all datasets in the subvolume into the whole volume file.
     for ds in range(len(seg_ds_list)):
         print("Working on subvolume segmented class %s" % seg_ds_list[ds])
         ds_time = time.time()
-        vol_seg_dataset = vol_map_file.create_dataset(seg_ds_list[ds], volume_ds_shape, dtype='uint8',
-                                                      chunks=(1, il_sub_vol_y, il_sub_vol_z))
+        vol_seg_dataset = vol_map_file.create_dataset(seg_ds_list[ds], volume_ds_shape, dtype=seg_ds_dtypes[ds],
+                                                      chunks=volume_chunks(volume_ds_shape))
+        # Keep the class names of the class labels dataset.
+        for attr_name, attr_value in seg_ds_attrs[ds].items():
+            vol_seg_dataset.attrs[attr_name] = attr_value
         if rank == 0:
             print("Dataset creation time is %d Sec" % (time.time() - ds_time))
             print("Working on subvolume segmented class %s" % seg_ds_list[ds])
-        for idx in range(iterations):
-            if idx == 0:
-                print("start to combine a dataset to whole volume, dataset is %s, rank is %d, time %s" % 
-                      (seg_ds_list[ds], rank, (time.ctime(time.time()))))
-            if (rank + (size * idx)) >= len(input_files):
-                print("\nBREAKING out, my rank is %d, number of files is %d, size is %d and idx is %d" %
-                      (rank, len(input_files), size, idx))
-                break
-            subvol_file = h5py.File(input_files[rank + (size * idx)], 'r')
+        print("start to combine a dataset to whole volume, dataset is %s, rank is %d, time %s" % 
+              (seg_ds_list[ds], rank, (time.ctime(time.time()))))
+        # Sub-volume files are handed out to the ranks on demand, largest first.
+        scheduler = TaskScheduler(comm, costs, task_schedule)
+        for idx in scheduler:
+            subvol_file = h5py.File(input_files[idx], 'r')
             # Retrieve indices into the whole volume.
             orig_idx_ds = subvol_file['orig_indices']
             orig_idx = orig_idx_ds[...]
@@ -173,7 +176,7 @@ def combine_segmented_subvols():
             z_dim = subvoldata.shape[2]
             print("subvol dimension, rightoverlap and leftoverlap are", subvoldata.shape, rightoverlap, leftoverlap)
             print("\n subvolume dataset Read time is %d Sec, rank is %d file is %s" % 
-                  ((time.time() - start_subvol_ds), rank, input_files[rank + (size * idx)]))
+                  ((time.time() - start_subvol_ds), rank, input_files[idx]))
             ds_write = time.time()
             vol_seg_dataset[orig_idx[0]:orig_idx[1], orig_idx[2]:orig_idx[3], orig_idx[4]:orig_idx[5]] = \
                 subvoldata[leftoverlap[0] : x_dim - rightoverlap[0], 
@@ -182,6 +185,7 @@ def combine_segmented_subvols():
             print("Time to write a subvolume ds is  %d Sec and rank is %d" % ((time.time() - ds_write), rank))
             subvol_file.close()
         
+        scheduler.report('combine_segmented_subvols %s' % seg_ds_list[ds])
         comm.Barrier()
         
         print("Time to combine one dataset to whole volume is %d Sec,  dataset is %s, rank is %d, time %s" % 
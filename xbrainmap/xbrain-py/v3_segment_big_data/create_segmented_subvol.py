@@ -59,23 +59,28 @@ import os.path
 from glob import glob
 import time
 from segmentation_param import *
+from create_subvol_mask import create_subvol_labels
 
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['segment_pixels']
+__all__ = ['create_segmented_subvol']
 
-def create_segmented_subvol(subvol_im, pixel_masks, filename, orig_idx_data, rightoverlap_data, leftoverlap_data, seg_output):
+def create_segmented_subvol(subvol_im, prob_maps, filename, orig_idx_data, rightoverlap_data, leftoverlap_data, seg_output):
     """ 
-    Separates pixels in an input sub-volume image array and creates an hdf5 for each input array.
-    Pixel mask for each class defined in the trained data is an input to this script.
-    This script creates segmented image for each sub-volume by element by element multiplication 
-    of the mask and the corresponding composite sub-volume image. Segmented pixels for each class of 
-    the sub-volume is written into a separated dataset of the segmented output hdf5 file/sub-volume.
+    Assigns each pixel of a sub-volume to the class with the highest probability and creates an hdf5 
+    file with the class of each pixel. Instead of a full size dataset per class defined in the trained 
+    data, the file holds one uint8 dataset with the class index of each pixel and, if the output is not
+    binary, the sub-volume image. The segmented image of a class (the image where the class index 
+    matches, zero elsewhere) is created only when read with read_segmented_class().
+    
+    The sub-volume is processed in slabs of x slices of about seg_slab_mb MB: the class index of each
+    pixel of a slab is computed and written together with its image, so only a slab of class indices
+    exists in memory at a time on top of the image and the probability maps.
     
     Inputs: 
     subvol_im -  Composite sub-volumes image array
-    pixel_mask - sub-volume mask array
+    prob_maps - Ilastik sub-volume probability map array, x,y,z by N classes.
     filename - output file name
     orig_idx_data - whole volume array indices
     rightoverlap_data - number of overlapped pixels from the right side of the sub-volume.
@@ -83,7 +88,7 @@ def create_segmented_subvol(subvol_im, pixel_masks, filename, orig_idx_data, rig
     seg_output - whether or not to save segmented output as binary or pixel intensity.
     
     Ouputs:
-    a hdf5 file per sub-volume with a dataset for each defined segmented class.
+    a hdf5 file per sub-volume with the class index dataset and the image intensity dataset.
     """
     
     start_time = time.time()
@@ -100,16 +105,19 @@ def create_segmented_subvol(subvol_im, pixel_masks, filename, orig_idx_data, rig
     subvol_leftoverlap = seg_im_file.create_dataset('left_overlap', (3,), dtype='uint8')
     subvol_leftoverlap[...] = leftoverlap_data
     
-    for label in range(len(ilastik_classes)):
-        seg_im_ds = seg_im_file.create_dataset(ilastik_classes[label], subvol_im.shape, subvol_im.dtype)
-        multiply_time = time.time()
-        if seg_output == True:
-            seg_im_ds[...] = pixel_masks[..., label]
-        else:
-            seg_im_ds[...] = subvol_im * pixel_masks[..., label]
-        print("Multiply time for one dataset is %d Sec" % (time.time() - multiply_time))
+    labels_ds = seg_im_file.create_dataset(class_labels_ds_name, subvol_im.shape, dtype='uint8')
+    labels_ds.attrs['class_names'] = [name.encode() for name in ilastik_classes]
+    if seg_output != True:
+        seg_im_ds = seg_im_file.create_dataset(intensity_ds_name, subvol_im.shape, subvol_im.dtype)
+    
+    # The argmax of a slab needs 8 bytes per pixel for its indices.
+    rows = slab_rows(subvol_im.shape, 8)
+    for row in range(0, subvol_im.shape[0], rows):
+        labels_ds[row : row + rows] = create_subvol_labels(prob_maps[row : row + rows], rows)
+        if seg_output != True:
+            seg_im_ds[row : row + rows] = subvol_im[row : row + rows]
         
     seg_im_file.close()
     end_time = time.time()
-    print("Exec time for create_segmented_subvol is %d Sec" % ((end_time - start_time)))
+    print("Exec time for create_segmented_subvol is %d Sec, slab size is %d slices" % ((end_time - start_time), rows))
     return
@@ -64,7 +64,29 @@ from segmentation_param import *
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['classify_subvolumes']
+__all__ = ['create_subvol_labels',
+           'create_subvol_mask']
+
+def create_subvol_labels(prob_maps, rows_per_slab=None):
+    """
+    Assigns each pixel to the index of the class with the highest probability value determined by 
+    Ilastik classifier. Ties go to the lowest class index.
+    
+    The argmax over the class axis is computed for slabs of rows at once, so its int64 temporary 
+    is bounded to about 64 MB whatever the sub-volume size.
+    
+    Input: Ilastik sub-volume probability map array, x,y,z by N classes.
+    
+    Output: uint8 array x,y,z with the class index of each pixel.
+    """
+    
+    labels = np.empty(prob_maps.shape[:-1], dtype='uint8')
+    if rows_per_slab is None:
+        row_size = int(np.prod(prob_maps.shape[1:-1])) * 8
+        rows_per_slab = max(int(64 * 1024**2 / max(row_size, 1)), 1)
+    for row in range(0, prob_maps.shape[0], rows_per_slab):
+        labels[row : row + rows_per_slab] = np.argmax(prob_maps[row : row + rows_per_slab], axis=-1)
+    return labels
 
 def create_subvol_mask(prob_maps):
     """ 
@@ -80,23 +102,11 @@ def create_subvol_mask(prob_maps):
     Output: array 
     """
     
-    output_array = np.zeros(prob_maps.shape, dtype='uint8')
     print("prob_maps data shape is", prob_maps.shape)
-    print_cycle = 500
-    start_loop_time = time.time()
-    for row in range(output_array.shape[0]):
-        for colmn in range(output_array.shape[1]):
-            outdata = np.zeros((output_array.shape[2], output_array.shape[3]), 'uint8')
-            if row == 0:
-                if colmn == 0:
-                    print("outdata shape is", outdata.shape)
-            outdata[np.arange(len(outdata)), np.argmax(prob_maps[row, colmn, :, :], axis=-1)] = 1
-            if np.count_nonzero(outdata) != output_array.shape[2]:
-                print("Something is very wrong - check row %d and colmn %d" % (row, colmn))
-            output_array[row, colmn, :, :] = outdata.copy()
-        if row != 0 and row % print_cycle == 0:
-            print("time to classify %d rows is %d Sec" % (print_cycle, (time.time() - start_loop_time)))
-            start_loop_time = time.time()
+    start_time = time.time()
+    labels = create_subvol_labels(prob_maps)
+    classes = np.arange(prob_maps.shape[-1], dtype='uint8')
+    output_array = (labels[..., np.newaxis] == classes).view('uint8')
+    print("time to classify %d rows is %d Sec" % (prob_maps.shape[0], (time.time() - start_time)))
     print("prob map output array shape is", output_array.shape)
     return output_array
-
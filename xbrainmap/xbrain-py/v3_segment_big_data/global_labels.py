@@ -0,0 +1,237 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+This module gives the objects of a volume, labeled one sub-volume at a time, unique labels across 
+sub-volumes.
+
+Every sub-volume is labeled on its own and its labels are written into the volume dataset. The labels
+of each sub-volume then get a global offset, the pairs of labels of touching voxels on both sides of
+the sub-volume faces are collected by all python processes and merged with a union-find on rank 0.
+Finally every sub-volume is rewritten with contiguous labels 1..N, so an object split by sub-volumes 
+has one label and no process needs more than a sub-volume in memory. The voxel count of every label 
+can be summed per object as well, to remove the objects which are small in the whole volume rather 
+than in a sub-volume.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from scipy import ndimage as ndi
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['label_tile',
+           'forward_offsets',
+           'touching_pairs',
+           'globalize_labels',
+           'component_map',
+           'relabel_volume']
+
+def label_tile(mask, connectivity=3):
+    """
+    Labels the connected components of a sub-volume mask. The default connectivity is the one of 
+    morphology.label(), voxels touching by a face, an edge or a corner are connected.
+    
+    Returns
+    -------
+    ndarray
+        uint32 labels
+    int
+        number of labels
+    ndarray
+        number of voxels of each label 1..number of labels
+    """
+    
+    structure = ndi.generate_binary_structure(mask.ndim, connectivity)
+    labels = np.zeros(mask.shape, dtype='uint32')
+    count = ndi.label(mask, structure, output=labels)
+    return labels, count, np.bincount(labels.ravel(), minlength=count + 1)[1:]
+
+def forward_offsets(connectivity=3):
+    """
+    Returns the offsets to half of the neighbors of a voxel for the given connectivity. Each pair of
+    neighbor voxels is found once from the first voxel of the pair.
+    """
+    
+    structure = ndi.generate_binary_structure(3, connectivity)
+    offsets = [tuple(int(o) for o in offset) for offset in np.argwhere(structure) - 1]
+    return [offset for offset in offsets if offset > (0, 0, 0)]
+
+def touching_pairs(labels, connectivity=3):
+    """
+    Returns the unique (smaller label, larger label) pairs of neighbor voxels with different non zero
+    labels in a block of global labels.
+    """
+    
+    pairs = [np.zeros((0, 2), dtype='int64')]
+    for offset in forward_offsets(connectivity):
+        first = labels[tuple(slice(max(-o, 0), n - max(o, 0)) for o, n in zip(offset, labels.shape))]
+        second = labels[tuple(slice(max(o, 0), n - max(-o, 0)) for o, n in zip(offset, labels.shape))]
+        touching = (first != second) & (first > 0) & (second > 0)
+        if np.any(touching):
+            pairs.append(np.stack((first[touching], second[touching]), axis=1).astype('int64'))
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs, axis=0)
+
+def globalize_labels(labels, start, tiles):
+    """
+    Adds the label offset of its sub-volume to every non zero voxel of a block of sub-volume labels,
+    in place.
+    
+    Parameters
+    ----------
+    labels : ndarray
+        int64 block of the volume dataset starting at index "start".
+    start : sequence
+        x, y and z index of the first voxel of the block in the volume.
+    tiles : list
+        (first index, last index + 1, label offset) of every sub-volume, with 3 element indices.
+    """
+    
+    for first, last, offset in tiles:
+        first = [max(f - s, 0) for f, s in zip(first, start)]
+        last = [min(l - s, n) for l, s, n in zip(last, start, labels.shape)]
+        if any(f >= l for f, l in zip(first, last)):
+            continue
+        block = labels[first[0]:last[0], first[1]:last[1], first[2]:last[2]]
+        block[block > 0] += offset
+
+def component_map(total, pairs, sizes=None, min_size=0):
+    """
+    Merges the labels 1..total connected by "pairs" and returns the array mapping each label to the 
+    contiguous label of its object, the background label 0 is mapped to 0.
+    
+    If "sizes" (the number of voxels of labels 0..total) is given, objects with less than min_size
+    voxels in total are mapped to 0.
+    """
+    
+    graph = coo_matrix((np.ones(len(pairs), dtype='uint8'), (pairs[:, 0], pairs[:, 1])),
+                       shape=(total + 1, total + 1))
+    count, components = connected_components(graph, directed=False)
+    # Labels are numbered in order of their smallest member, the isolated background gets 0.
+    if sizes is not None and min_size > 0:
+        keep = np.bincount(components, weights=sizes, minlength=count) >= min_size
+        keep[0] = False
+        components = (np.cumsum(keep) * keep)[components]
+    return components.astype('uint32')
+
+def relabel_volume(comm, dataset, tiles, connectivity=3, min_size=0):
+    """
+    Rewrites the sub-volume labels written into "dataset" with unique contiguous labels of the volume.
+    Objects with less than min_size voxels in the volume are removed. Must be called by all python 
+    processes.
+    
+    Parameters
+    ----------
+    comm : MPI communicator
+    dataset : h5py dataset
+        uint32 volume dataset holding the labels of label_tile() of each sub-volume.
+    tiles : list
+        (file index, orig_indices, number of labels, number of voxels of each label) of every 
+        sub-volume written by this process. The voxel counts are only needed with min_size.
+    connectivity : int
+        connectivity used by label_tile().
+    min_size : int
+        smallest number of voxels of the objects to keep, 0 keeps all objects.
+    
+    Returns
+    -------
+    int
+        number of objects in the volume.
+    list
+        for each sub-volume of "tiles", the uint32 array of the volume label of its labels 1..number of
+        labels (0 for removed objects).
+    """
+    
+    rank = comm.Get_rank()
+    all_tiles = sorted((int(t[0]), [int(i) for i in t[1]], int(t[2])) 
+                       for rank_tiles in comm.allgather([t[:3] for t in tiles]) for t in rank_tiles)
+    counts = np.array([t[2] for t in all_tiles], dtype='int64')
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    boxes = [(orig[0::2], orig[1::2], int(offset)) for (file_idx, orig, count), offset in zip(all_tiles, offsets)]
+    my_boxes = [box for box, tile in zip(boxes, all_tiles) if tile[0] in set(int(t[0]) for t in tiles)]
+    total = int(counts.sum())
+    
+    # Labels of neighbor sub-volumes must be on disk before reading the faces.
+    dataset.file.flush()
+    comm.Barrier()
+    pairs = [np.zeros((0, 2), dtype='int64')]
+    for first, last, offset in my_boxes:
+        start = [max(f - 1, 0) for f in first]
+        stop = [min(l + 1, n) for l, n in zip(last, dataset.shape)]
+        block = dataset[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]].astype('int64')
+        globalize_labels(block, start, boxes)
+        pairs.append(touching_pairs(block, connectivity))
+    pairs = comm.gather(np.unique(np.concatenate(pairs), axis=0), root=0)
+    # Only rank 0 needs the voxel counts of the labels, in the order of the label offsets.
+    sizes = comm.gather([(int(t[0]), t[3]) for t in tiles] if min_size > 0 else [], root=0)
+    
+    if rank == 0:
+        if min_size > 0:
+            sizes = [np.zeros(1)] + [tile_sizes for file_idx, tile_sizes in 
+                                     sorted(t for rank_sizes in sizes for t in rank_sizes)]
+            sizes = np.concatenate(sizes)
+        else:
+            sizes = None
+        label_map = component_map(total, np.concatenate(pairs), sizes, min_size)
+    else:
+        label_map = np.empty(total + 1, dtype='uint32')
+    comm.Bcast(label_map, root=0)
+    
+    for first, last, offset in my_boxes:
+        region = (slice(first[0], last[0]), slice(first[1], last[1]), slice(first[2], last[2]))
+        labels = dataset[region].astype('int64')
+        labels[labels > 0] += offset
+        dataset[region] = label_map[labels]
+    tile_offsets = dict((t[0], offset) for t, offset in zip(all_tiles, offsets))
+    tile_labels = [label_map[tile_offsets[int(t[0])] + 1 : tile_offsets[int(t[0])] + int(t[2]) + 1] for t in tiles]
+    return (int(label_map.max()) if total else 0), tile_labels
@@ -60,55 +60,14 @@ import os.path
 from glob import glob
 import time
 from segmentation_param import *
+from subvolumes import load_sub_volumes, tiling_report
+from tiling import tile_overlaps, tile_orig_indices
+from task_scheduler import TaskScheduler
 
 __author__ = "Mehdi Tondravi"
 __copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['compute_sub_volumes',
-           'vessel_detect_big_data_mpi']
-
-def compute_sub_volumes(dataset_shape):
-    """
-    This function divides a given volume image into sub-volumes and returns three lists. Each list has the
-    start and end indices for a sub-volume. The sub-volume size is specified in the seg_user_param.py file. 
-    
-    Parameters
-    ----------
-    dataset_shape : dataset shape
-    
-    Returns
-    -------
-    x,y,z list of indices
-    
-    """
-    x_sub_volumes_idx = []
-    y_sub_volumes_idx = []
-    z_sub_volumes_idx = []
-    # il_sub_vol_x, il_sub_vol_y and il_sub_vol_z are user option and specified in segmentation_param.py file.
-    for x_idx in range(int(dataset_shape[0] / il_sub_vol_x) + (dataset_shape[0] % il_sub_vol_x > 0)):
-        for y_idx in range(int(dataset_shape[1] / il_sub_vol_y) + (dataset_shape[1] % il_sub_vol_y > 0)):
-            for z_idx in range(int(dataset_shape[2] / il_sub_vol_z) + (dataset_shape[2] % il_sub_vol_z > 0)):
-                x_next_idx = []
-                if (il_sub_vol_x + il_sub_vol_x * x_idx) < dataset_shape[0]:
-                    x_next_idx.append(((il_sub_vol_x * x_idx), (il_sub_vol_x + il_sub_vol_x * x_idx)))
-                else:
-                    x_next_idx.append(((il_sub_vol_x * x_idx), (dataset_shape[0])))
-                x_sub_volumes_idx.append(x_next_idx)
-                
-                y_next_idx = []
-                if (il_sub_vol_y + il_sub_vol_y * y_idx) < dataset_shape[1]:
-                    y_next_idx.append(((il_sub_vol_y * y_idx), (il_sub_vol_y + il_sub_vol_y * y_idx)))
-                else:
-                    y_next_idx.append(((il_sub_vol_y * y_idx), (dataset_shape[1])))
-                y_sub_volumes_idx.append(y_next_idx)
-                
-                z_next_idx = []
-                if (il_sub_vol_z + il_sub_vol_z * z_idx) < dataset_shape[2]:
-                    z_next_idx.append(((il_sub_vol_z * z_idx), (il_sub_vol_z + il_sub_vol_z * z_idx)))
-                else:
-                    z_next_idx.append(((il_sub_vol_z * z_idx), (dataset_shape[2])))
-                z_sub_volumes_idx.append(z_next_idx)
-    return x_sub_volumes_idx, y_sub_volumes_idx, z_sub_volumes_idx
+__all__ = ['make_subvolume_mpi']
 
 def make_subvolume_mpi():
     """ 
@@ -153,110 +112,77 @@ def make_subvolume_mpi():
         vol_file = h5py.File(hdf5_vol_file[0], 'r', driver='mpio', comm=comm)
     parent_dir, tiff_dir = os.path.split(tiff_files_location)
     vol_dataset = vol_file[tiff_dir]
-    vol_shape = vol_dataset.shape
     if rank == 0:
         print("Volume Image Shape and data type is", vol_dataset.shape, vol_dataset.dtype)
-    # Compute the sub-volumes indices
-    x_sub_volumes_idx, y_sub_volumes_idx, z_sub_volumes_idx = compute_sub_volumes(vol_dataset.shape)
+        print(tiling_report(vol_dataset.shape, vol_dataset.dtype.itemsize))
+    # Sub-volumes indices and overlaps saved with the volume, one row per sub-volume.
+    sub_volumes = load_sub_volumes(vol_file, vol_dataset.shape, size)
     if rank % 6 == 0:
         print("Done with computing sub-volumes - This is rank %d of %d running on %s" % (rank, size, name))
     
-    # Figure out how many sub-volumes should be handled by each rank/process.
-    iterations = int(len(x_sub_volumes_idx) / size) + (len(x_sub_volumes_idx) % size > 0)
-    partial_iterations = int(len(x_sub_volumes_idx) % size)
     if rank == 0:
-        print("Number of Subvolumes is %d, iterations is %d, partial_iterations is %d" % 
-              (len(x_sub_volumes_idx), iterations, partial_iterations))
-    for idx in range(iterations):
+        print("Number of Subvolumes is %d" % len(sub_volumes))
+    # Sub-volumes are handed out to the ranks/processes on demand, largest first.
+    scheduler = TaskScheduler(comm, np.prod(sub_volumes['halo_stop'] - sub_volumes['halo_start'], axis=1), 
+                              task_schedule)
+    # Megabytes copied by this rank and the time spent copying them.
+    copied_mb = 0.0
+    copy_time = 0.0
+    for idx, subvol_idx in enumerate(scheduler):
+        sub_volume = sub_volumes[subvol_idx]
         if rank % 6 == 0:
             print("*** Time is %d, rank is %d ***" % (time.time(), rank))
-        if (rank + (size * idx)) >= len(x_sub_volumes_idx):
-            print("\nBREAKING out, my rank is %d, number of subvolume is %d, size is %d,  and idx is %d" % 
-                  (rank, len(x_sub_volumes_idx), size, idx))
-            break
-        x_idx = x_sub_volumes_idx[rank + (size * idx)]
-        y_idx = y_sub_volumes_idx[rank + (size * idx)]
-        z_idx = z_sub_volumes_idx[rank + (size * idx)]
-        filenumber = str(rank + size * idx).zfill(5)
+        filenumber = str(sub_volume['index']).zfill(5)
         subvol_filename = hdf_subvol_files_location + '/' + tiff_dir + filenumber + '.hdf5'
         print("rank is %d, idx is %d, size is %d, file name is %s" % (rank, idx, size, subvol_filename))
         subvolfile = h5py.File(subvol_filename, 'w')
         
-        # Determine pixels overlap to the right side of the sub-volume.
-        if (x_idx[0][1] + pixeloverlap) < vol_shape[0]:
-            x_rightoverlap = pixeloverlap
-        else:
-            x_rightoverlap = 0
-        
-        if (y_idx[0][1] + pixeloverlap) < vol_shape[1]:
-            y_rightoverlap = pixeloverlap
-        else:
-            y_rightoverlap = 0
-        
-        if (z_idx[0][1] + pixeloverlap) < vol_shape[2]:
-            z_rightoverlap = pixeloverlap
-        else:
-            z_rightoverlap = 0
-        
-        # Determine pixels overlap to the left side of the sub-volume.
-        if (x_idx[0][0] > pixeloverlap):
-            x_leftoverlap = pixeloverlap
-        else:
-            x_leftoverlap = 0
-        
-        if (y_idx[0][0] > pixeloverlap):
-            y_leftoverlap = pixeloverlap
-        else:
-            y_leftoverlap = 0
-        
-        if (z_idx[0][0] > pixeloverlap):
-            z_leftoverlap = pixeloverlap
-        else:
-            z_leftoverlap = 0
-        
-        x_shape = x_idx[0][1] - x_idx[0][0] + x_rightoverlap + x_leftoverlap
-        y_shape = y_idx[0][1] - y_idx[0][0] + y_rightoverlap + y_leftoverlap
-        z_shape = z_idx[0][1] - z_idx[0][0] + z_rightoverlap + z_leftoverlap
+        # The sub-volume with its overlap to the left and the right side.
+        first = [int(f) for f in sub_volume['halo_start']]
+        last = [int(l) for l in sub_volume['halo_stop']]
+        x_shape, y_shape, z_shape = [l - f for f, l in zip(first, last)]
 
-        subvol_dataset = subvolfile.create_dataset((tiff_dir + filenumber), (x_shape, y_shape, z_shape), vol_dataset.dtype)
+        # Chunks are whole x slices, so every slab written covers whole chunks.
+        subvol_dataset = subvolfile.create_dataset((tiff_dir + filenumber), (x_shape, y_shape, z_shape), vol_dataset.dtype,
+                                                   chunks=(1, y_shape, z_shape))
         
         start_subvol_time = time.time()
-        rows_count = (x_idx[0][1]+x_rightoverlap) - (x_idx[0][0]-x_leftoverlap)
-        for row in range(rows_count):
-            subvol_dataset[row,:,:] = vol_dataset[x_idx[0][0]-x_leftoverlap + row,
-                                                  y_idx[0][0]-y_leftoverlap : y_idx[0][1]+y_rightoverlap, 
-                                                  z_idx[0][0]-z_leftoverlap : z_idx[0][1]+z_rightoverlap] 
+        # Copy the sub-volume and its overlap in a few large hyperslabs of at most subvol_copy_mb MB.
+        if subvol_copy_mode == 'rows':
+            copy_rows = 1
+        else:
+            copy_rows = slab_rows((x_shape, y_shape, z_shape), vol_dataset.dtype.itemsize, subvol_copy_mb)
+        for row in range(0, x_shape, copy_rows):
+            last_row = min(row + copy_rows, x_shape)
+            subvol_dataset[row:last_row,:,:] = vol_dataset[first[0] + row : first[0] + last_row,
+                                                           first[1] : last[1], first[2] : last[2]] 
         end_subvol_time = time.time()
-        # Save original indices and shape in datasets
-        subvol_indx = subvolfile.create_dataset('orig_indices', (6,), dtype='uint64')
-        subvol_indx[0] = x_idx[0][0]
-        subvol_indx[1] = x_idx[0][1]
-        subvol_indx[2] = y_idx[0][0]
-        subvol_indx[3] = y_idx[0][1]
-        subvol_indx[4] = z_idx[0][0]
-        subvol_indx[5] = z_idx[0][1]
-        right_overlapds = subvolfile.create_dataset('right_overlap', (3,), dtype='uint8')
-        
-        # Save overlap value to the right and left
-        right_overlapds[0] = x_rightoverlap
-        right_overlapds[1] = y_rightoverlap
-        right_overlapds[2] = z_rightoverlap
-        left_overlapds = subvolfile.create_dataset('left_overlap', (3,), dtype='uint8')
-        left_overlapds[0] = x_leftoverlap
-        left_overlapds[1] = y_leftoverlap
-        left_overlapds[2] = z_leftoverlap
+        subvol_mb = x_shape * y_shape * z_shape * vol_dataset.dtype.itemsize / 1024**2
+        copied_mb += subvol_mb
+        copy_time += end_subvol_time - start_subvol_time
+        # Save original indices and overlap value to the right and left in datasets
+        leftoverlap, rightoverlap = tile_overlaps(sub_volume)
+        orig_indices = tile_orig_indices(sub_volume)
+        subvolfile.create_dataset('orig_indices', data=orig_indices)
+        subvolfile.create_dataset('right_overlap', data=rightoverlap)
+        subvolfile.create_dataset('left_overlap', data=leftoverlap)
         
         if idx < 100:
             if rank % 1 == 0:
                 print("rank is %d and Sub-volume shape is x, y, z  %d:%d, %d:%d, %d:%d" % 
-                      (rank, x_idx[0][0], x_idx[0][1], y_idx[0][0], y_idx[0][1], z_idx[0][0], z_idx[0][1]))
+                      ((rank,) + tuple(orig_indices)))
                 print("Sub-volume file name is %s, dataset name is %s" % (subvol_filename, subvol_dataset.name))
         
         if idx < 100:
-            print("Exec time for read from disk is %d Sec and rank is %d" % ((end_subvol_time - start_subvol_time), rank))
+            print("Exec time for read from disk is %d Sec, %.1f MB/Sec in slabs of %d rows and rank is %d" % 
+                  ((end_subvol_time - start_subvol_time), subvol_mb / max(end_subvol_time - start_subvol_time, 1e-6),
+                   copy_rows, rank))
         subvolfile.close()
+    scheduler.report('make_subvolume_mpi')
     vol_file.close()
     end_time = time.time()
+    print("Rank %d copied %.1f MB in %.1f Sec, throughput is %.1f MB/Sec (copy mode %s)" % 
+          (rank, copied_mb, copy_time, copied_mb / max(copy_time, 1e-6), subvol_copy_mode))
     if rank % 6 == 0:
         print("Sub-volume Exec time is %d Sec" % (end_time - start_time))
 
@@ -0,0 +1,183 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+This module computes a table of statistics of the labeled objects of a volume while the sub-volumes 
+are post processed, so analyses do not need to read the label volume again.
+
+The statistics of the labels of each sub-volume are computed while the sub-volume is in memory. When 
+the labels of the volume are known (see global_labels.py) the statistics of the parts of an object are
+combined on rank 0 and written as a table with one dataset per column:
+
+label - volume label of the object, 1..number of objects.
+voxel_count - number of voxels.
+centroid - mean x, y and z index of the voxels.
+bbox_min, bbox_max - first index and last index + 1 of the voxels in x, y and z, as in "orig_indices".
+mean_intensity - mean image intensity of the voxels, NaN if the image intensity is not available.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import h5py
+from scipy import ndimage as ndi
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['tile_statistics',
+           'combine_statistics',
+           'reduce_statistics',
+           'write_statistics']
+
+_sum_columns = ('voxel_count', 'coord_sum', 'intensity_sum')
+
+def tile_statistics(labels, count, first, intensity=None):
+    """
+    Computes the statistics of the labels 1..count of a sub-volume.
+    
+    Inputs:
+    labels - labels of the sub-volume.
+    count - number of labels.
+    first - x, y and z index of the first voxel of the sub-volume in the volume.
+    intensity - image intensity of the sub-volume, or None.
+    
+    Output:
+    dict of arrays with one row per label: voxel_count, coord_sum (N x 3), bbox_min (N x 3), 
+    bbox_max (N x 3) and intensity_sum (NaN without intensity).
+    """
+    
+    first = np.asarray(first, dtype='int64')
+    voxels = np.flatnonzero(labels)
+    index = labels.ravel()[voxels]
+    stats = {'voxel_count': np.bincount(index, minlength=count + 1)[1:]}
+    coords = np.unravel_index(voxels, labels.shape)
+    stats['coord_sum'] = np.stack([np.bincount(index, weights=coord, minlength=count + 1)[1:] + 
+                                   stats['voxel_count'] * start for coord, start in zip(coords, first)], axis=1)
+    del coords
+    boxes = ndi.find_objects(labels, count)
+    stats['bbox_min'] = np.array([[s.start for s in box] for box in boxes], dtype='int64').reshape(-1, 3) + first
+    stats['bbox_max'] = np.array([[s.stop for s in box] for box in boxes], dtype='int64').reshape(-1, 3) + first
+    if intensity is None:
+        stats['intensity_sum'] = np.full(count, np.nan)
+    else:
+        stats['intensity_sum'] = np.bincount(index, weights=intensity.ravel()[voxels], minlength=count + 1)[1:]
+    return stats
+
+def combine_statistics(object_labels, stats, num_objects):
+    """
+    Combines the statistics of parts of objects into the table of objects 1..num_objects.
+    
+    Inputs:
+    object_labels - volume label of each row of "stats", rows with label 0 are ignored.
+    stats - statistics of tile_statistics(), with the rows of several sub-volumes concatenated.
+    num_objects - number of objects in the volume.
+    
+    Output:
+    dict of the table columns described in the module documentation.
+    """
+    
+    keep = object_labels > 0
+    rows = object_labels[keep].astype('int64') - 1
+    table = {'label': np.arange(1, num_objects + 1, dtype='uint32')}
+    totals = {}
+    for name in _sum_columns:
+        values = stats[name][keep]
+        totals[name] = np.zeros((num_objects,) + values.shape[1:])
+        np.add.at(totals[name], rows, values)
+    table['voxel_count'] = totals['voxel_count'].astype('int64')
+    # Every object has at least one voxel.
+    table['centroid'] = totals['coord_sum'] / table['voxel_count'][:, None]
+    table['bbox_min'] = np.full((num_objects, 3), np.iinfo('int64').max, dtype='int64')
+    np.minimum.at(table['bbox_min'], rows, stats['bbox_min'][keep])
+    table['bbox_max'] = np.zeros((num_objects, 3), dtype='int64')
+    np.maximum.at(table['bbox_max'], rows, stats['bbox_max'][keep])
+    table['mean_intensity'] = totals['intensity_sum'] / table['voxel_count']
+    return table
+
+def reduce_statistics(comm, tile_stats, tile_labels, num_objects):
+    """
+    Gathers the statistics of the sub-volumes of all python processes on rank 0 and combines them. Must
+    be called by all python processes.
+    
+    Inputs:
+    comm - MPI communicator.
+    tile_stats - tile_statistics() of each sub-volume of this process.
+    tile_labels - volume label of the labels of each sub-volume, as returned by relabel_volume().
+    num_objects - number of objects in the volume.
+    
+    Output:
+    The table of combine_statistics() on rank 0, None on the other ranks.
+    """
+    
+    # Rows of removed objects are not sent.
+    parts = []
+    for stats, object_labels in zip(tile_stats, tile_labels):
+        keep = object_labels > 0
+        parts.append((object_labels[keep], dict((name, column[keep]) for name, column in stats.items())))
+    parts = comm.gather(parts, root=0)
+    if comm.Get_rank() != 0:
+        return None
+    # Empty statistics give the columns their shape when there is no object.
+    parts = [(np.zeros(0, dtype='uint32'), tile_statistics(np.zeros((1, 1, 1), dtype='uint32'), 0, (0, 0, 0)))] + \
+            [part for rank_parts in parts for part in rank_parts]
+    object_labels = np.concatenate([part[0] for part in parts])
+    stats = dict((name, np.concatenate([part[1][name] for part in parts])) for name in parts[0][1])
+    return combine_statistics(object_labels, stats, num_objects)
+
+def write_statistics(filename, table, attrs=None):
+    """
+    Writes the table of combine_statistics() into a new hdf5 file, one dataset per column.
+    """
+    
+    stats_file = h5py.File(filename, 'w')
+    for name, column in table.items():
+        stats_file.create_dataset(name, data=column)
+    for key, value in (attrs or {}).items():
+        stats_file.attrs[key] = value
+    stats_file.close()
@@ -97,7 +97,10 @@ def save_ilastik_prob_map(prob_maps, orig_idx_data, rightoverlap_data, leftoverl
         dataset = ilastik_classes[label_idx]
         map_to_save = prob_maps[..., label_idx]
         mapds = probfile.create_dataset(dataset, map_to_save.shape, map_to_save.dtype)
-        mapds[...] = map_to_save
+        # A class is not contiguous in prob_maps, write it by slabs so only a slab is copied at a time.
+        rows = slab_rows(map_to_save.shape, map_to_save.dtype.itemsize)
+        for row in range(0, map_to_save.shape[0], rows):
+            mapds[row : row + rows] = map_to_save[row : row + rows]
     
     print("dataset write time for one dataset is %d Sec" % (time.time() - write_time))
     probfile.close()
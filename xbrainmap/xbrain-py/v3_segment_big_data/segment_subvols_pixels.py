@@ -60,9 +60,10 @@ from mpi4py import MPI
 import time
 from segmentation_param import *
 from classify_pixel import classify_pixel
-from create_subvol_mask import create_subvol_mask
 from create_segmented_subvol import create_segmented_subvol
 from save_ilastik_prob_map import save_ilastik_prob_map
+from subvolumes import plan_tiling, load_sub_volumes, virtual_sub_volumes, read_sub_volume
+from task_scheduler import TaskScheduler, file_costs
 import pdb
 
 __author__ = "Mehdi Tondravi"
@@ -77,7 +78,8 @@ def segment_subvols_pixels():
     separate the input image into as many as images as are defined labels in the training data.
     
     Inputs: 
-    The *.hdf5 sub-volume files location is specified in seg_user_param.py file.
+    The *.hdf5 sub-volume files location is specified in seg_user_param.py file. With virtual_subvolumes
+    set to 'yes' the sub-volumes are read from the volume file of tiff_to_hdf5_mpi.py instead.
     Ilastik trained data - file location is specified in seg_user_param.py file.
         
     Output: 
@@ -104,19 +106,37 @@ def segment_subvols_pixels():
         ram = int(ram_size * (int(percent_mem_to_use)/100.0))
     
     # if not enough memory stop processing. Required memory is subvolume size times 4 bytes times
-    # number of labeled classed plus two.
-    mem_required = il_sub_vol_x * il_sub_vol_y * il_sub_vol_z * (len(get_ilastik_labels()) + 2) * 4
+    # number of labeled classed (probability maps) plus one (image), and two slabs for segmentation.
+    mem_required = (int(np.prod(plan_tiling()[0])) * (len(get_ilastik_labels()) + 1) * 4 + 
+                    2 * seg_slab_mb * 1024**2)
     if int(mem_required / 1e6) > ram:
         print("AVAILABLE MEMORY IS NOT BIG ENOUGH TO PROCEED. MAKE SUBVOLUME SMALLER AND TRY AGAIN")
         print("Avaiable memory is %d MB and required memory is %d MB" % (ram, int(mem_required/ 1e6)))
         return
     if rank == 0:
         print("*** size is %d, No of thread is %d, ram size is %d" % (size, threads, ram))
-    # assumes sub-volume image file extension is .hdf5
-    input_files = sorted(glob(hdf_subvol_files_location + '/*.hdf5'))
-    if not input_files:
-        print("*** Did not find any file ending with .hdf5 extension  ***")
-        return
+    virtual = virtual_subvolumes.upper() == 'YES'
+    if virtual:
+        # Sub-volumes are read from the volume file, make_subvolume_mpi.py does not have to be run. The
+        # file is only read, so it does not need Parallel HDF.
+        hdf5_vol_file = sorted(glob(hdf_files_location + '/*.hdf5'))
+        if not hdf5_vol_file:
+            print("*** Did not find volume file ending with .hdf5 extension  ***")
+            return
+        parent_dir, tiff_dir = os.path.split(tiff_files_location)
+        vol_file = h5py.File(hdf5_vol_file[0], 'r')
+        vol_dataset = vol_file[tiff_dir]
+        sub_volumes = load_sub_volumes(vol_file, vol_dataset.shape, size)
+        input_files = virtual_sub_volumes(sub_volumes, tiff_dir)
+        # Voxels of each sub-volume with its overlap.
+        costs = np.prod(sub_volumes['halo_stop'] - sub_volumes['halo_start'], axis=1)
+    else:
+        # assumes sub-volume image file extension is .hdf5
+        input_files = sorted(glob(hdf_subvol_files_location + '/*.hdf5'))
+        if not input_files:
+            print("*** Did not find any file ending with .hdf5 extension  ***")
+            return
+        costs = file_costs(input_files)
     if rank == 0:
         print("Number of input/HDF5 files is %d, and Number of processes is %d" % ((len(input_files)), size))
     
@@ -143,45 +163,45 @@ def segment_subvols_pixels():
     if rank == 0:
         print("Number of input/HDF5 files is %d, and Number of processes is %d" % ((len(input_files)), size))
     
-    # Figure out how many sub-volume files each rank should handle.
-    iterations = int(len(input_files) / size) + (len(input_files) % size > 0)
-    # Divide pixel classification of sub-volume files among processes/ranks. 
-    for idx in range(iterations):
-        if (rank + (size * idx)) >= len(input_files):
-            print("\nBREAKING out, this rank is done with its processing, my rank is %d, number of files is %d, size is %d and idx is %d" %
-                  (rank, len(input_files), size, idx))
-            break
+    # Divide pixel classification of sub-volume files among processes/ranks, a rank gets the next 
+    # sub-volume when it is done with the previous one.
+    scheduler = TaskScheduler(comm, costs, task_schedule)
+    for idx in scheduler:
         start_loop_time = time.time()
-        filename = input_files[(rank + size * idx)]
-        dsname, ext = os.path.splitext(os.path.basename(filename))
-        hdf_filename = h5py.File(filename, 'r')
-        subvol_ds = hdf_filename[dsname]
-        # Retrieve the indices into whole volume for this sub-volume.
-        orig_idx_ds = hdf_filename['orig_indices']
-        orig_idx_data = orig_idx_ds[...]
-        # Retrive overlap size to the right side of the sub-volume. 
-        rightoverlap_ds = hdf_filename['right_overlap']
-        rightoverlap_data = rightoverlap_ds[...]
-        # Retrive overlap size to the left side of the sub-volume.
-        leftoverlap_ds = hdf_filename['left_overlap']
-        leftoverlap_data = leftoverlap_ds[...]
-        
-        start_dstime = time.time()
-        subvol_data = subvol_ds[...]
+        if virtual:
+            dsname, orig_idx_data, rightoverlap_data, leftoverlap_data = input_files[idx]
+            start_dstime = time.time()
+            # One hyperslab read of the sub-volume and its overlap.
+            subvol_data = read_sub_volume(vol_dataset, orig_idx_data, rightoverlap_data, leftoverlap_data)
+        else:
+            filename = input_files[idx]
+            dsname, ext = os.path.splitext(os.path.basename(filename))
+            hdf_filename = h5py.File(filename, 'r')
+            subvol_ds = hdf_filename[dsname]
+            # Retrieve the indices into whole volume for this sub-volume.
+            orig_idx_ds = hdf_filename['orig_indices']
+            orig_idx_data = orig_idx_ds[...]
+            # Retrive overlap size to the right side of the sub-volume. 
+            rightoverlap_ds = hdf_filename['right_overlap']
+            rightoverlap_data = rightoverlap_ds[...]
+            # Retrive overlap size to the left side of the sub-volume.
+            leftoverlap_ds = hdf_filename['left_overlap']
+            leftoverlap_data = leftoverlap_ds[...]
+            
+            start_dstime = time.time()
+            subvol_data = subvol_ds[...]
+            hdf_filename.close()
         print("Read time for datasetfrom disk is %d sec and rank is %d" % ((time.time() - start_dstime), rank))
         ilastik_time = time.time()
         probability_maps = classify_pixel(subvol_data, classifier, threads, ram)
         print("probability_map shape and data type are", probability_maps.shape, probability_maps.dtype)
         print("time for ilastik classification is %d sec and rank is %d" % ((time.time() - ilastik_time), rank))
         
-        mask_time = time.time()
-        subvol_pixel_masks = create_subvol_mask(probability_maps)
-        print("time to create pixel masks is %d sec and rank is %d" % ((time.time() - mask_time), rank))
-        
         segment_time = time.time()
         # output type - binary or pixel intensity?
         seg_output = seg_pixel_value()
-        create_segmented_subvol(subvol_data, subvol_pixel_masks, dsname, orig_idx_data, rightoverlap_data, leftoverlap_data, seg_output)
+        # Classify, mask and write the sub-volume slab by slab.
+        create_segmented_subvol(subvol_data, probability_maps, dsname, orig_idx_data, rightoverlap_data, leftoverlap_data, seg_output)
         save_prob_map_idx = []
         # Save cell probability map in a file if user has asked for it.
         savemap, label_index = save_prob_map('CELL')
@@ -200,7 +220,12 @@ def segment_subvols_pixels():
         if save_prob_map_idx:
             save_ilastik_prob_map(probability_maps, orig_idx_data, rightoverlap_data, leftoverlap_data, idx, save_prob_map_idx)
         print("time to time to segement pixels is %d sec and rank is %d" % ((time.time() - segment_time), rank))
+        # Release this sub-volume before the next one is classified.
+        del subvol_data, probability_maps
     
+    scheduler.report('segment_subvols_pixels')
+    if virtual:
+        vol_file.close()
     end_time = int(time.time())
     exec_time = end_time - start_time
     print("*** My Rank is %d, exec time is %d sec - Done with classifying pixels in sub-volume files ***" % (rank, exec_time))
@@ -85,6 +85,33 @@ post_seg_volume_location = tiff_files_location + '_post_segmentation'
 # Dataset name for Ilastik probability map for classified classes.
 ilastik_ds_name = 'exported_data'
 
+# Dataset name for the index of the Ilastik class of each pixel in segmented sub-volume and volume files.
+# Its "class_names" attribute has the class names in index order.
+class_labels_ds_name = 'class_labels'
+
+# Dataset name for the image intensity in segmented files when the output is not binary.
+intensity_ds_name = 'intensity'
+
+# Whether segment_subvols_pixels.py reads the sub-volumes from the volume file of tiff_to_hdf5_mpi.py 
+# ('yes') instead of the sub-volume files of make_subvolume_mpi.py, which then does not have to be run.
+virtual_subvolumes = 'no'
+
+# Size in MB of the slabs (groups of x slices) of a sub-volume classified and written at a time.
+seg_slab_mb = 64
+
+# Smallest and largest number of voxels in a chunk of the volume datasets, see plan_tiling() in subvolumes.py.
+min_chunk_voxels = 256 * 1024
+max_chunk_voxels = 1024 * 1024
+
+# Size in MB of the slabs read from the volume and written to a sub-volume file at a time by 
+# make_subvolume_mpi.py. 'rows' for subvol_copy_mode copies one x slice at a time instead.
+subvol_copy_mb = 512
+subvol_copy_mode = 'slabs'
+
+# How the sub-volumes of a stage are given to the python processes: 'dynamic' - on demand, largest first 
+# (see task_scheduler.py), 'static' - process r gets sub-volumes r, r + size, r + 2 * size and so on.
+task_schedule = 'dynamic'
+
 no_of_threads = multiprocessing.cpu_count()
 ram_size = int(virtual_memory().total/(1024**3)) * 1000
 
@@ -96,6 +123,14 @@ MINSZ_CELL = 100
 # small size objects to be removed from vessel segmentation
 MINSZ_VESSEL = 500
 
+# Backend of the ball erosion and dilation in post processing: 'auto', 'boxes', 'edt' or 'ndimage'. 
+# All give the same output, see ball_morphology.py.
+morphology_backend = 'auto'
+
+# Number of pixels read around a tile when skeletonizing vessels in vessel_graph_mpi.py, should be 
+# larger than the vessel radius.
+vessel_skeleton_halo = pixeloverlap
+
 import h5py
 import pdb
 
@@ -139,6 +174,16 @@ def save_prob_map(label):
             
     return (save_to_file, index)
 
+def slab_rows(shape, bytes_per_pixel, slab_mb=None):
+    '''
+    Returns the number of x slices of an array of "shape" which fit into a slab of slab_mb MB, 
+    seg_slab_mb MB by default.
+    '''
+    if slab_mb is None:
+        slab_mb = seg_slab_mb
+    slice_bytes = int(shape[1]) * int(shape[2]) * bytes_per_pixel
+    return max(int(slab_mb * 1024**2 / max(slice_bytes, 1)), 1)
+
 def seg_pixel_value():
     '''
     Retuns whether to save segmented pixels in binary or pixel intensity.
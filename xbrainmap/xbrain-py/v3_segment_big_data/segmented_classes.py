@@ -0,0 +1,129 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+This module reads segmented classes from the compact class label datasets of segmented files.
+
+Segmented sub-volume and volume files hold one uint8 dataset with the class index of each pixel 
+(plus the image intensity if the output is not binary) instead of one full size dataset per class. 
+The image of a class is only created when it is read.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from segmentation_param import *
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['segmented_class_names',
+           'read_segmented_class',
+           'read_intensity']
+
+def segmented_class_names(seg_file):
+    """
+    Returns the list of class names of an open segmented hdf5 file, in class index order.
+    """
+    
+    names = seg_file[class_labels_ds_name].attrs['class_names']
+    return [name.decode() if isinstance(name, bytes) else str(name) for name in names]
+
+def read_segmented_class(seg_file, class_name, selection=Ellipsis, binary=False):
+    """
+    Reads the segmented image of one class from an open segmented hdf5 file.
+    
+    Inputs:
+    seg_file - segmented sub-volume or volume hdf5 file.
+    class_name - Ilastik class name.
+    selection - part of the volume to read, e.g. np.s_[0:10, :, :], whole volume by default.
+    binary - return a bool mask of the class pixels instead of the segmented image.
+    
+    Output:
+    The class mask (uint8 zero or one) if the file has binary output, the image intensity at 
+    the class pixels and zero elsewhere otherwise, or a bool mask if "binary" is True.
+    """
+    
+    # Files written before the compact class label dataset have a dataset per class.
+    if class_labels_ds_name not in seg_file:
+        subvoldata = seg_file[class_name][selection]
+        if binary:
+            return subvoldata > 0
+        return subvoldata
+    
+    class_idx = segmented_class_names(seg_file).index(class_name)
+    class_mask = seg_file[class_labels_ds_name][selection] == class_idx
+    if binary:
+        return class_mask
+    if intensity_ds_name not in seg_file:
+        return class_mask.view('uint8')
+    subvoldata = seg_file[intensity_ds_name][selection]
+    subvoldata[~class_mask] = 0
+    return subvoldata
+
+def read_intensity(seg_file, class_name, selection=Ellipsis):
+    """
+    Reads the image intensity from an open segmented hdf5 file.
+    
+    Inputs:
+    seg_file - segmented sub-volume or volume hdf5 file.
+    class_name - Ilastik class name, only used by files written before the compact class label dataset,
+                 which only have the intensity at the pixels of each class.
+    selection - part of the volume to read, whole volume by default.
+    
+    Output:
+    The image intensity, or None if the file has binary output.
+    """
+    
+    if class_labels_ds_name not in seg_file:
+        if seg_pixel_value():
+            return None
+        return seg_file[class_name][selection]
+    if intensity_ds_name not in seg_file:
+        return None
+    return seg_file[intensity_ds_name][selection]
@@ -0,0 +1,219 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+Module for the sub-volumes of the volume image: their shape and the chunk shape of the volume datasets,
+their tile table (see tiling.py) and reading them from the volume file. The tile table is saved in the
+volume file by tiff_to_hdf5_mpi.py.
+
+The sub-volume files of make_subvolume_mpi.py hold a copy of each overlapping sub-volume. Virtual 
+sub-volumes have the same indices and overlaps but are read from the volume file when they are needed,
+so the volume does not have to be copied.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from segmentation_param import *
+from tiling import tile_table, tile_overlaps, tile_orig_indices, write_tile_table, read_tile_table
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['plan_tiling',
+           'volume_chunks',
+           'bytes_touched',
+           'tiling_report',
+           'compute_sub_volumes',
+           'save_sub_volumes',
+           'load_sub_volumes',
+           'virtual_sub_volumes',
+           'read_sub_volume']
+
+def plan_tiling(sub_vol_shape=None, halo=None, max_splits=64):
+    """
+    Picks the sub-volume (tile) shape and the chunk shape of the volume datasets together. 
+    
+    The tile shape is a multiple of the chunk shape and tiles start at multiples of the tile shape, so 
+    tiles written into a volume dataset cover whole chunks (no read-modify-write of chunks shared by 
+    tiles). Among the chunk shapes with min_chunk_voxels to max_chunk_voxels voxels, the one reading the
+    fewest voxels for a tile with its halo of overlap pixels is chosen. Tiles may be a few pixels larger 
+    than sub_vol_shape so that they are a multiple of the chunk shape.
+    
+    Parameters
+    ----------
+    sub_vol_shape : tuple, optional
+        requested sub-volume shape, il_sub_vol_x, il_sub_vol_y and il_sub_vol_z by default.
+    halo : int, optional
+        overlap pixels read around a tile, pixeloverlap by default.
+    max_splits : int, optional
+        largest number of chunks along an axis of a tile.
+    
+    Returns
+    -------
+    tile shape and chunk shape tuples.
+    """
+    if sub_vol_shape is None:
+        sub_vol_shape = (il_sub_vol_x, il_sub_vol_y, il_sub_vol_z)
+    if halo is None:
+        halo = pixeloverlap
+    axes = []
+    for length in sub_vol_shape:
+        splits = np.arange(1, min(int(length), max_splits) + 1)
+        chunk = -(-int(length) // splits)
+        # Chunks touched along the axis by an interior tile with its halo.
+        touched = chunk * (splits + 2 * (-(-int(halo) // chunk)))
+        axes.append((splits, chunk, touched))
+    grid = np.ix_(*[np.arange(len(axis[0])) for axis in axes])
+    chunk_voxels = axes[0][1][grid[0]] * axes[1][1][grid[1]] * axes[2][1][grid[2]]
+    touched = axes[0][2][grid[0]] * axes[1][2][grid[1]] * axes[2][2][grid[2]]
+    valid = (chunk_voxels >= min_chunk_voxels) & (chunk_voxels <= max_chunk_voxels)
+    if not np.any(valid):
+        # Small sub-volumes: the largest chunks up to max_chunk_voxels.
+        valid = chunk_voxels == chunk_voxels[chunk_voxels <= max_chunk_voxels].max()
+    # Fewest voxels touched, then the largest chunks.
+    candidates = np.flatnonzero(valid.ravel())
+    best = candidates[np.lexsort((-chunk_voxels.ravel()[candidates], touched.ravel()[candidates]))[0]]
+    index = np.unravel_index(best, chunk_voxels.shape)
+    chunk_shape = tuple(int(axis[1][i]) for axis, i in zip(axes, index))
+    tile_shape = tuple(int(axis[1][i] * axis[0][i]) for axis, i in zip(axes, index))
+    return tile_shape, chunk_shape
+
+def volume_chunks(vol_shape):
+    """
+    Returns the chunk shape of plan_tiling() for a volume dataset of shape vol_shape.
+    """
+    return tuple(max(min(int(c), int(n)), 1) for c, n in zip(plan_tiling()[1], vol_shape))
+
+def bytes_touched(first, last, chunk_shape, itemsize):
+    """
+    Returns the number of bytes of the chunks holding the box from index "first" to index "last" (last 
+    not included) of a chunked dataset.
+    """
+    chunks = 1
+    for f, l, c in zip(first, last, chunk_shape):
+        chunks *= -(-int(l) // int(c)) - int(f) // int(c)
+    return chunks * int(np.prod(chunk_shape)) * itemsize
+
+def tiling_report(vol_shape, itemsize):
+    """
+    Returns a text with the tile and chunk shapes of plan_tiling() and the bytes read for an interior 
+    tile with its overlap, and the bytes it needs.
+    """
+    tile_shape, chunk_shape = plan_tiling()
+    chunk_shape = volume_chunks(vol_shape)
+    first = [min(t, max(int(n) - t, 0)) for t, n in zip(tile_shape, vol_shape)]
+    box_first = [max(f - pixeloverlap, 0) for f in first]
+    box_last = [min(f + t + pixeloverlap, int(n)) for f, t, n in zip(first, tile_shape, vol_shape)]
+    needed = int(np.prod([l - f for f, l in zip(box_first, box_last)])) * itemsize
+    touched = bytes_touched(box_first, box_last, chunk_shape, itemsize)
+    return ("Tile shape is %s, chunk shape is %s (%.2f MB), a tile with its overlap reads %.1f MB of chunks "
+            "for %.1f MB of data" % (tile_shape, chunk_shape, np.prod(chunk_shape) * itemsize / 1024**2, 
+                                     touched / 1024**2, needed / 1024**2))
+
+def compute_sub_volumes(dataset_shape, size=1):
+    """
+    This function divides a given volume image into sub-volumes and returns their tile table (see 
+    tiling.py), one row per sub-volume with its indices, its overlap and the rank processing it. The 
+    sub-volume size is specified in the seg_user_param.py file and adjusted by plan_tiling(), the 
+    overlap is pixeloverlap pixels unless the sub-volume is too close to the volume border.
+    
+    Parameters
+    ----------
+    dataset_shape : dataset shape
+    size : number of python processes
+    
+    Returns
+    -------
+    tile_dtype array
+    
+    """
+    return tile_table(dataset_shape, plan_tiling()[0], pixeloverlap, size, halo_mode='whole')
+
+def save_sub_volumes(vol_file, dataset_shape, write=True):
+    """
+    Saves the tile table of compute_sub_volumes() into the volume file, so the stages after 
+    tiff_to_hdf5_mpi.py read the same sub-volumes. With Parallel HDF all processes must call it.
+    """
+    return write_tile_table(vol_file, compute_sub_volumes(dataset_shape), dataset_shape, plan_tiling()[0], 
+                            pixeloverlap, 'whole', write=write)
+
+def load_sub_volumes(vol_file, dataset_shape, size=1):
+    """
+    Returns the tile table saved in the volume file by save_sub_volumes(). The table is computed if the 
+    file does not have it or it is not the table of the current seg_user_param.py options.
+    """
+    table = read_tile_table(vol_file, dataset_shape, plan_tiling()[0], pixeloverlap, 'whole', size)
+    if table is None:
+        table = compute_sub_volumes(dataset_shape, size)
+    return table
+
+def virtual_sub_volumes(table, ds_prefix):
+    """
+    Returns the sub-volumes of a tile table of load_sub_volumes() as the sub-volume files of 
+    make_subvolume_mpi.py would have them, without reading the volume.
+    
+    Returns
+    -------
+    list of (dataset name, orig_indices, right_overlap, left_overlap) of each sub-volume. The dataset 
+    name is ds_prefix followed by the sub-volume number as in the sub-volume file names.
+    """
+    sub_volumes = []
+    for tile in table:
+        leftoverlap, rightoverlap = tile_overlaps(tile)
+        sub_volumes.append((ds_prefix + str(tile['index']).zfill(5), tile_orig_indices(tile), rightoverlap, 
+                            leftoverlap))
+    return sub_volumes
+
+def read_sub_volume(vol_dataset, orig_indices, rightoverlap, leftoverlap):
+    """
+    Reads a sub-volume with its overlap from the volume dataset with one hyperslab read.
+    """
+    first = [int(orig_indices[2 * axis]) - int(leftoverlap[axis]) for axis in range(3)]
+    last = [int(orig_indices[2 * axis + 1]) + int(rightoverlap[axis]) for axis in range(3)]
+    return vol_dataset[first[0]:last[0], first[1]:last[1], first[2]:last[2]]
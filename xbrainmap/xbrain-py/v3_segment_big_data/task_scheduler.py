@@ -0,0 +1,195 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+Module for handing out the sub-volumes (tasks) of a stage to the python processes (ranks) on demand.
+
+The time to process a sub-volume varies (sub-volumes at the volume border are smaller and dense tissue
+takes longer to classify), so giving each rank the same number of sub-volumes up front leaves ranks 
+waiting for the slowest one. With the dynamic schedule a rank takes the next sub-volume when it is done
+with the previous one, largest sub-volumes first so the last ones handed out are the smallest. The 
+next sub-volume is the value of a counter on rank 0 incremented with one atomic MPI one-sided 
+operation, so no rank has to be set aside to hand out the sub-volumes.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os.path
+import time
+import numpy as np
+from mpi4py import MPI
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['TaskScheduler',
+           'file_costs']
+
+def file_costs(files):
+    """
+    Returns the size in bytes of each file, the cost of processing a sub-volume file.
+    """
+    return np.array([os.path.getsize(filename) for filename in files], dtype='float64')
+
+class TaskScheduler(object):
+    """
+    Hands out tasks 0 to len(costs) - 1 to the ranks of a communicator. Iterating over it gives the 
+    tasks of this rank:
+    
+        scheduler = TaskScheduler(comm, costs)
+        for task in scheduler:
+            ...
+        scheduler.report('segment_subvols_pixels')
+    
+    It must be created and reported by all ranks of the communicator.
+    
+    Parameters
+    ----------
+    comm : MPI communicator
+    costs : array
+        cost (e.g. voxels or bytes) of each task, larger tasks are handed out first.
+    schedule : str, optional
+        'dynamic' - tasks are handed out on demand, largest first.
+        'static' - rank r processes tasks r, r + size, r + 2 * size and so on.
+    """
+    
+    def __init__(self, comm, costs, schedule='dynamic'):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.schedule = schedule
+        costs = np.asarray(costs, dtype='float64')
+        if schedule == 'dynamic':
+            # Largest first, tasks of the same cost in their order.
+            self.order = np.argsort(-costs, kind='mergesort')
+        elif schedule == 'static':
+            self.order = np.arange(len(costs))
+        else:
+            raise ValueError("schedule must be 'dynamic' or 'static', not %r" % (schedule,))
+        self.tasks = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.span = None
+        self._local_next = self.rank
+        self._task_start = None
+        # The counter of the tasks handed out lives in the window of rank 0.
+        self._window = None
+        if schedule == 'dynamic' and self.size > 1:
+            self._counter = np.zeros(1, dtype='int64')
+            self._window = MPI.Win.Create(self._counter, self._counter.itemsize, comm=comm)
+            comm.Barrier()
+        self._start = time.time()
+    
+    def _next_position(self):
+        if self._window is None:
+            # Static schedule, or dynamic schedule with one rank.
+            position = self._local_next
+            self._local_next += self.size if self.schedule == 'static' else 1
+            return position
+        one = np.ones(1, dtype='int64')
+        position = np.zeros(1, dtype='int64')
+        self._window.Lock(0, MPI.LOCK_SHARED)
+        self._window.Fetch_and_op(one, position, 0, 0, MPI.SUM)
+        self._window.Unlock(0)
+        return int(position[0])
+    
+    def next_task(self):
+        """
+        Returns the next task of this rank, or None when all tasks have been handed out.
+        """
+        now = time.time()
+        if self._task_start is not None:
+            self.busy_time += now - self._task_start
+            self._task_start = None
+        if self.span is not None:
+            return None
+        position = self._next_position()
+        self.wait_time += time.time() - now
+        if position >= len(self.order):
+            self.span = time.time() - self._start
+            return None
+        self.tasks += 1
+        self._task_start = time.time()
+        return int(self.order[position])
+    
+    def __iter__(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            yield task
+    
+    def report(self, name='tasks'):
+        """
+        Prints on rank 0 the number of tasks, the busy time and the idle time of every rank. Idle time is
+        the time a rank waited for tasks and, after its last task, for the slowest rank. Must be called by
+        all ranks after their tasks are done, it releases the counter.
+        
+        Returns
+        -------
+        On rank 0 a list of (tasks, busy time, idle time) of every rank, None on the other ranks.
+        """
+        if self.span is None:
+            self.span = time.time() - self._start
+        stats = self.comm.gather((self.tasks, self.busy_time, self.wait_time, self.span), root=0)
+        if self._window is not None:
+            self._window.Free()
+            self._window = None
+        if self.rank != 0:
+            return None
+        # Spans are measured from the creation of the scheduler on each rank, clocks of the servers 
+        # do not have to agree.
+        last = max(span for tasks, busy, wait, span in stats)
+        stats = [(tasks, busy, wait + last - span) for tasks, busy, wait, span in stats]
+        for rank, (tasks, busy, idle) in enumerate(stats):
+            print("%s: rank %d processed %d sub-volumes, busy %.1f Sec, idle %.1f Sec" % 
+                  (name, rank, tasks, busy, idle))
+        print("%s: %s schedule, %d sub-volumes in %.1f Sec, ranks were idle %.1f%% of the time" % 
+              (name, self.schedule, len(self.order), last, 
+               100.0 * sum(idle for tasks, busy, idle in stats) / max(last * len(stats), 1e-6)))
+        return stats
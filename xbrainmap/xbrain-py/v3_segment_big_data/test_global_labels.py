@@ -0,0 +1,181 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+Tests that the labels of global_labels.py, computed one sub-volume at a time, are the labels of the 
+whole volume. Run with "python -m pytest" from this directory.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import itertools
+import numpy as np
+import h5py
+import pytest
+from scipy import ndimage as ndi
+from global_labels import label_tile, touching_pairs, component_map, relabel_volume
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+class SingleProcessComm(object):
+    """
+    The calls of an MPI communicator made by relabel_volume() for a single python process.
+    """
+    
+    def Get_rank(self):
+        return 0
+    
+    def Get_size(self):
+        return 1
+    
+    def allgather(self, value):
+        return [value]
+    
+    def gather(self, value, root=0):
+        return [value]
+    
+    def Bcast(self, value, root=0):
+        pass
+    
+    def Barrier(self):
+        pass
+
+def make_mask(shape, seed=0):
+    """
+    Returns a bool volume of blobs of various sizes, many of them crossing the sub-volume faces.
+    """
+    
+    rng = np.random.RandomState(seed)
+    return ndi.gaussian_filter(rng.rand(*shape), 1.5) > 0.52
+
+def tile_indices(shape, tile_shape):
+    """
+    Returns the orig_indices of the sub-volumes of at most tile_shape voxels covering the volume.
+    """
+    
+    ranges = [[(first, min(first + step, n)) for first in range(0, n, step)] for n, step in zip(shape, tile_shape)]
+    return [[x[0], x[1], y[0], y[1], z[0], z[1]] for x, y, z in itertools.product(*ranges)]
+
+def tiled_labels(tmpdir, mask, tile_shape, connectivity, min_size=0):
+    """
+    Labels "mask" one sub-volume at a time with label_tile() and relabel_volume(). Returns the labels
+    of the volume, the number of objects and the volume label of the labels of each sub-volume.
+    """
+    
+    label_file = h5py.File(str(tmpdir.join('labels.hdf5')), 'w')
+    dataset = label_file.create_dataset('labels', mask.shape, dtype='uint32')
+    tiles = []
+    for file_idx, orig in enumerate(tile_indices(mask.shape, tile_shape)):
+        region = np.s_[orig[0]:orig[1], orig[2]:orig[3], orig[4]:orig[5]]
+        labels, count, sizes = label_tile(mask[region], connectivity)
+        dataset[region] = labels
+        tiles.append((file_idx, orig, count, sizes))
+    # The sub-volumes do not have to be given in file order.
+    count, tile_labels = relabel_volume(SingleProcessComm(), dataset, tiles[::-1], connectivity, min_size)
+    labels = dataset[...]
+    label_file.close()
+    return labels, count, tile_labels[::-1]
+
+def assert_same_objects(labels, expected):
+    """
+    Checks that two label volumes have the same objects, up to the order of their labels.
+    """
+    
+    np.testing.assert_array_equal(labels > 0, expected > 0)
+    pairs = np.unique(np.stack((labels.ravel(), expected.ravel()), axis=1), axis=0)
+    assert len(pairs) == len(np.unique(labels)) == len(np.unique(expected))
+
+# Sub-volume shapes which divide the 36 x 30 x 24 volume and which do not.
+@pytest.mark.parametrize('tile_shape', [(12, 10, 8), (17, 13, 11), (36, 7, 24)])
+@pytest.mark.parametrize('connectivity', [1, 2, 3])
+def test_relabel_volume_matches_whole_volume(tmpdir, tile_shape, connectivity):
+    mask = make_mask((36, 30, 24))
+    expected, expected_count = ndi.label(mask, ndi.generate_binary_structure(3, connectivity))
+    labels, count, tile_labels = tiled_labels(tmpdir, mask, tile_shape, connectivity)
+    
+    assert count == expected_count
+    np.testing.assert_array_equal(np.unique(labels), np.arange(count + 1))
+    assert_same_objects(labels, expected)
+
+@pytest.mark.parametrize('tile_shape', [(12, 10, 8), (17, 13, 11)])
+@pytest.mark.parametrize('min_size', [1, 10, 60, 100000])
+def test_min_size_uses_whole_volume_size(tmpdir, tile_shape, min_size):
+    mask = make_mask((36, 30, 24), seed=2)
+    whole, whole_count = ndi.label(mask, ndi.generate_binary_structure(3, 3))
+    sizes = np.bincount(whole.ravel(), minlength=whole_count + 1)
+    keep = sizes >= min_size
+    keep[0] = False
+    expected = whole * keep[whole]
+    labels, count, tile_labels = tiled_labels(tmpdir, mask, tile_shape, 3, min_size)
+    
+    assert count == np.count_nonzero(keep)
+    np.testing.assert_array_equal(np.unique(labels), np.arange(count + 1))
+    assert_same_objects(labels, expected)
+
+def test_tile_labels(tmpdir):
+    mask = make_mask((36, 30, 24), seed=1)
+    labels, count, tile_labels = tiled_labels(tmpdir, mask, (17, 13, 11), 3)
+    for orig, tile_map in zip(tile_indices(mask.shape, (17, 13, 11)), tile_labels):
+        region = np.s_[orig[0]:orig[1], orig[2]:orig[3], orig[4]:orig[5]]
+        tile, tile_count, sizes = label_tile(mask[region], 3)
+        assert len(tile_map) == tile_count
+        np.testing.assert_array_equal(np.r_[0, tile_map][tile], labels[region])
+
+def test_touching_pairs():
+    labels = np.zeros((3, 3, 3), dtype='int64')
+    labels[0, 0, 0] = 5
+    labels[1, 1, 1] = 2
+    labels[2, 2, 0] = 7
+    np.testing.assert_array_equal(touching_pairs(labels, 3), [[2, 5], [2, 7]])
+    assert len(touching_pairs(labels, 1)) == 0
+
+def test_component_map():
+    pairs = np.array([[1, 3], [3, 4]])
+    np.testing.assert_array_equal(component_map(5, pairs), [0, 1, 2, 1, 1, 3])
@@ -0,0 +1,119 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+Tests that the object statistics of object_statistics.py, computed one sub-volume at a time, are the
+statistics of the objects of the whole volume. Run with "python -m pytest" from this directory.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import h5py
+import pytest
+from scipy import ndimage as ndi
+from global_labels import label_tile, relabel_volume
+from object_statistics import tile_statistics, reduce_statistics, write_statistics
+from test_global_labels import SingleProcessComm, make_mask, tile_indices
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+def tiled_statistics(tmpdir, mask, tile_shape, intensity=None, min_size=0):
+    """
+    Labels "mask" and computes the statistics of its objects one sub-volume at a time, the way the 
+    post-processing stages do. Returns the labels of the volume and the statistics table.
+    """
+    
+    label_file = h5py.File(str(tmpdir.join('labels.hdf5')), 'w')
+    dataset = label_file.create_dataset('labels', mask.shape, dtype='uint32')
+    tiles = []
+    tile_stats = []
+    for file_idx, orig in enumerate(tile_indices(mask.shape, tile_shape)):
+        region = np.s_[orig[0]:orig[1], orig[2]:orig[3], orig[4]:orig[5]]
+        labels, count, sizes = label_tile(mask[region])
+        dataset[region] = labels
+        tiles.append((file_idx, orig, count, sizes))
+        tile_stats.append(tile_statistics(labels, count, orig[0::2], 
+                                          None if intensity is None else intensity[region]))
+    comm = SingleProcessComm()
+    count, tile_labels = relabel_volume(comm, dataset, tiles, min_size=min_size)
+    table = reduce_statistics(comm, tile_stats, tile_labels, count)
+    labels = dataset[...]
+    label_file.close()
+    return labels, table
+
+# Sub-volume shapes which divide the 36 x 30 x 24 volume and which do not.
+@pytest.mark.parametrize('tile_shape', [(12, 10, 8), (17, 13, 11), (36, 30, 24)])
+@pytest.mark.parametrize('min_size', [0, 20])
+def test_statistics_match_whole_volume(tmpdir, tile_shape, min_size):
+    mask = make_mask((36, 30, 24), seed=3)
+    intensity = np.random.RandomState(4).rand(*mask.shape).astype('float32')
+    labels, table = tiled_statistics(tmpdir, mask, tile_shape, intensity, min_size)
+    
+    index = np.arange(1, labels.max() + 1)
+    np.testing.assert_array_equal(table['label'], index)
+    np.testing.assert_array_equal(table['voxel_count'], ndi.sum(np.ones(mask.shape), labels, index))
+    np.testing.assert_allclose(table['centroid'], ndi.center_of_mass(np.ones(mask.shape), labels, index))
+    boxes = ndi.find_objects(labels)
+    np.testing.assert_array_equal(table['bbox_min'], [[s.start for s in box] for box in boxes])
+    np.testing.assert_array_equal(table['bbox_max'], [[s.stop for s in box] for box in boxes])
+    np.testing.assert_allclose(table['mean_intensity'], ndi.mean(intensity, labels, index), rtol=1e-6)
+    assert np.all(table['voxel_count'] >= min_size)
+
+def test_statistics_without_intensity(tmpdir):
+    labels, table = tiled_statistics(tmpdir, make_mask((20, 18, 16), seed=5), (7, 9, 5))
+    assert len(table['label']) == labels.max() > 0
+    assert np.all(np.isnan(table['mean_intensity']))
+
+def test_statistics_without_objects(tmpdir):
+    labels, table = tiled_statistics(tmpdir, np.zeros((10, 9, 8), dtype=bool), (4, 4, 4))
+    assert len(table['label']) == 0
+    assert table['centroid'].shape == (0, 3)
+    write_statistics(str(tmpdir.join('stats.hdf5')), table)
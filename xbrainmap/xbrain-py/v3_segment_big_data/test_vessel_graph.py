@@ -0,0 +1,140 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+Tests that the vessel graph of vessel_graph.py, extracted one tile at a time, is the graph of the whole
+volume. Run with "python -m pytest" from this directory, mpi4py is needed by task_scheduler.py.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import h5py
+import pytest
+from scipy import ndimage as ndi
+from test_global_labels import assert_same_objects
+
+MPI = pytest.importorskip('mpi4py.MPI')
+from vessel_graph import extract_vessel_graph, _skeletonize
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+def make_vessels(shape):
+    """
+    Returns a bool volume of three tubes along the x, y and z axis, two of them crossing.
+    """
+    
+    x, y, z = np.indices(shape)
+    vessels = ((y - 35) ** 2 + (z - 30) ** 2) < 16
+    vessels |= ((x - 40) ** 2 + (z - 30) ** 2) < 9
+    vessels |= ((x - 20) ** 2 + (y - 20) ** 2) < 9
+    return vessels
+
+def tiled_graph(tmpdir, vessels, tile_shape, halo, name):
+    """
+    Extracts the vessel graph of "vessels" with tiles of tile_shape. Returns the node and edge tables
+    and the skeleton, radius, nodes and segments volumes.
+    """
+    
+    vessel_file = h5py.File(str(tmpdir.join(name + '_vessels.hdf5')), 'w')
+    vessel_ds = vessel_file.create_dataset('vessels', data=vessels.astype('uint8'))
+    skeleton_file = h5py.File(str(tmpdir.join(name + '_skeleton.hdf5')), 'w')
+    nodes, edges = extract_vessel_graph(MPI.COMM_SELF, vessel_ds, skeleton_file, tile_shape, halo)
+    volumes = dict((ds_name, skeleton_file[ds_name][...]) for ds_name in ('skeleton', 'radius', 'nodes', 'segments'))
+    skeleton_file.close()
+    vessel_file.close()
+    return nodes, edges, volumes
+
+def label_map(labels, reference):
+    """
+    Returns the array mapping the labels of "labels" to the labels of the same objects in "reference".
+    """
+    
+    pairs = np.unique(np.stack((labels.ravel(), reference.ravel()), axis=1), axis=0)
+    mapping = np.zeros(labels.max() + 1, dtype='int64')
+    mapping[pairs[:, 0]] = pairs[:, 1]
+    return mapping
+
+# Tile shapes which divide the 80 x 70 x 60 volume and which do not.
+@pytest.mark.parametrize('tile_shape', [(40, 35, 30), (30, 25, 20), (27, 70, 16)])
+def test_graph_matches_whole_volume(tmpdir, tile_shape):
+    vessels = make_vessels((80, 70, 60))
+    ref_nodes, ref_edges, ref = tiled_graph(tmpdir, vessels, vessels.shape, 0, 'whole')
+    skeleton = _skeletonize(vessels) > 0
+    np.testing.assert_array_equal(ref['skeleton'] > 0, skeleton)
+    np.testing.assert_allclose(ref['radius'][skeleton], ndi.distance_transform_edt(vessels)[skeleton], rtol=1e-6)
+    
+    # The halo is wider than the vessels.
+    nodes, edges, tiled = tiled_graph(tmpdir, vessels, tile_shape, 12, 'tiled')
+    np.testing.assert_array_equal(tiled['skeleton'], ref['skeleton'])
+    np.testing.assert_array_equal(tiled['radius'], ref['radius'])
+    assert_same_objects(tiled['nodes'], ref['nodes'])
+    assert_same_objects(tiled['segments'], ref['segments'])
+    
+    node_map = label_map(tiled['nodes'], ref['nodes'])
+    segment_map = label_map(tiled['segments'], ref['segments'])
+    order = np.argsort(node_map[nodes['label']])
+    for column in ('centroid', 'voxel_count', 'degree'):
+        np.testing.assert_array_equal(nodes[column][order], ref_nodes[column])
+    np.testing.assert_allclose(nodes['radius'][order], ref_nodes['radius'], rtol=1e-6)
+    
+    def edge_rows(edges, node_map, segment_map):
+        rows = np.stack((np.minimum(node_map[edges['node1']], node_map[edges['node2']]),
+                         np.maximum(node_map[edges['node1']], node_map[edges['node2']]),
+                         segment_map[edges['segment']], edges['length']), axis=1)
+        order = np.lexsort(rows.T[::-1])
+        return rows[order], edges['radius'][order]
+    
+    rows, radius = edge_rows(edges, node_map, segment_map)
+    ref_rows, ref_radius = edge_rows(ref_edges, np.arange(len(ref_nodes['label']) + 1), 
+                                     np.arange(len(ref_edges['segment']) + 1))
+    np.testing.assert_array_equal(rows, ref_rows)
+    np.testing.assert_allclose(radius, ref_radius, rtol=1e-6)
+    assert len(ref_rows) == 5
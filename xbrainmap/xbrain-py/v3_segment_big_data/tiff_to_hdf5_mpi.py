@@ -58,6 +58,8 @@ from skimage.io import imread
 from glob import glob
 import os.path
 from segmentation_param import *
+from subvolumes import volume_chunks, tiling_report, save_sub_volumes
+from task_scheduler import TaskScheduler
 from mpi4py import MPI
 import time
 import pdb
@@ -133,26 +135,32 @@ def tiff_to_hdf5_files():
     if rank == 0:
         print("*** Dataset name is %s and file create time is %d***" % (data_set_name, (time.time() - file_time)))
     ds_time = time.time()
-    data_set = hdf_file.create_dataset(data_set_name, (len(files), data_shape[0], data_shape[1]), data_type)
+    # Chunks of the volume match the sub-volumes, see plan_tiling().
+    vol_shape = (len(files), data_shape[0], data_shape[1])
+    chunks = volume_chunks(vol_shape)
+    data_set = hdf_file.create_dataset(data_set_name, vol_shape, data_type, chunks=chunks)
+    # The sub-volumes of the next stages are saved with the volume.
+    save_sub_volumes(hdf_file, vol_shape, write=(rank == 0))
     if rank == 0:
         print("dataset creatation time is %d" % (time.time() - ds_time))
-    iterations = int(len(files) / size) + (len(files) % size > 0)
-    for idx in range(iterations):
-        if rank == 0:
-            if idx == 0:
-                print("***** starting to convert TIFF files ***")
-        if (rank + (size * idx)) >= len(files):
-            print("\nBREAKING out, my rank is %d, number of files is %d, size is %d and idx is %d" %
-                  (rank, len(files), size, idx))
-            break
+        print(tiling_report(vol_shape, np.dtype(data_type).itemsize))
+    # Each rank converts slabs of as many TIFF files as the chunk x size, so every write covers whole chunks 
+    # and no chunk is written by two ranks.
+    slabs = [(first, min(first + chunks[0], len(files))) for first in range(0, len(files), chunks[0])]
+    if rank == 0:
+        print("***** starting to convert TIFF files ***")
+    scheduler = TaskScheduler(comm, [last - first for first, last in slabs], task_schedule)
+    for idx, slab_idx in enumerate(scheduler):
         imread_start = time.time()
-        imarray = imread(files[rank + size * idx], plugin='tifffile')
-        data_set[(rank + size * idx), :, :] = imarray
+        first, last = slabs[slab_idx]
+        imarray = np.stack([imread(files[file_idx], plugin='tifffile') for file_idx in range(first, last)])
+        data_set[first:last, :, :] = imarray
         imread_end = time.time()
         if idx % 50 == 0:
-            print("IM Read done, rank is %d, idx is %d, time for read is %d sec, number of bytes %d, element size %d, file is %s" % 
-                  (rank, idx, (imread_end - imread_start), imarray.nbytes, imarray.itemsize, files[rank + size * idx]))
+            print("IM Read done, rank is %d, idx is %d, time for read is %d sec, number of bytes %d, element size %d, files %s to %s" % 
+                  (rank, idx, (imread_end - imread_start), imarray.nbytes, imarray.itemsize, files[first], files[last - 1]))
     
+    scheduler.report('tiff_to_hdf5_files')
     print("data shape is, rank is", data_set.shape, rank)
     hdf_file.close()
     end_time = int(time.time())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+Module for the tile table of a volume: the sub-volumes (tiles) a volume is divided into, one row per 
+tile with the indices of the tile (core), of the tile and the overlap read around it (halo) and the 
+rank of the python process processing it.
+
+The table is a numpy structured array, so it is computed with a few array operations, and it is saved
+into a HDF5 file so every stage (and a restart) uses the same tiles.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['tile_dtype',
+           'tile_table',
+           'assign_owners',
+           'rank_tiles',
+           'core_slices',
+           'halo_slices',
+           'core_in_halo',
+           'tile_overlaps',
+           'tile_orig_indices',
+           'write_tile_table',
+           'read_tile_table',
+           'load_tile_table']
+
+# Indices are [x, y, z], stops are not included.
+tile_dtype = np.dtype([(str('index'), 'int64'),
+                       (str('core_start'), 'int64', (3,)),
+                       (str('core_stop'), 'int64', (3,)),
+                       (str('halo_start'), 'int64', (3,)),
+                       (str('halo_stop'), 'int64', (3,)),
+                       (str('owner'), 'int32')])
+
+def tile_table(vol_shape, tile_shape, halo=0, size=1, halo_mode='clip'):
+    """
+    Divides a volume into tiles of tile_shape pixels. The last tile along an axis is smaller if the volume
+    size is not a multiple of the tile size. Tiles are numbered in x, then y, then z order and are given 
+    to the ranks in turn (see assign_owners()).
+    
+    Parameters
+    ----------
+    vol_shape : tuple
+        shape of the volume.
+    tile_shape : tuple
+        shape of the tiles.
+    halo : int, optional
+        number of pixels of overlap read around a tile.
+    size : int, optional
+        number of python processes (ranks) processing the tiles.
+    halo_mode : str, optional
+        'clip' - the halo is clipped to the volume. 
+        'whole' - the halo on a side is halo pixels, or 0 if the tile is within halo pixels of the volume
+        border (the overlap of the sub-volume files of make_subvolume_mpi.py).
+    
+    Returns
+    -------
+    tile_dtype array with one row per tile.
+    """
+    vol_shape = np.asarray(vol_shape, dtype='int64')
+    tile_shape = np.asarray(tile_shape, dtype='int64')
+    counts = -(-vol_shape // tile_shape)
+    table = np.zeros(int(np.prod(counts)), dtype=tile_dtype)
+    table['index'] = np.arange(len(table))
+    table['core_start'] = np.indices(counts).reshape(3, -1).T * tile_shape
+    table['core_stop'] = np.minimum(table['core_start'] + tile_shape, vol_shape)
+    if halo_mode == 'clip':
+        table['halo_start'] = np.maximum(table['core_start'] - halo, 0)
+        table['halo_stop'] = np.minimum(table['core_stop'] + halo, vol_shape)
+    elif halo_mode == 'whole':
+        table['halo_start'] = table['core_start'] - np.where(table['core_start'] > halo, halo, 0)
+        table['halo_stop'] = table['core_stop'] + np.where(table['core_stop'] + halo < vol_shape, halo, 0)
+    else:
+        raise ValueError("halo_mode must be 'clip' or 'whole', not %r" % (halo_mode,))
+    return assign_owners(table, size)
+
+def assign_owners(table, size):
+    """
+    Gives the tiles to "size" ranks in turn: rank r owns tiles r, r + size, r + 2 * size and so on. 
+    The table is changed in place and returned.
+    """
+    table['owner'] = table['index'] % size
+    return table
+
+def rank_tiles(table, rank):
+    """
+    Returns the rows of the tiles owned by "rank".
+    """
+    return table[table['owner'] == rank]
+
+def core_slices(tile):
+    """
+    Returns the slices of a tile (without its halo) in the volume.
+    """
+    return tuple(slice(int(f), int(l)) for f, l in zip(tile['core_start'], tile['core_stop']))
+
+def halo_slices(tile):
+    """
+    Returns the slices of a tile with its halo in the volume.
+    """
+    return tuple(slice(int(f), int(l)) for f, l in zip(tile['halo_start'], tile['halo_stop']))
+
+def core_in_halo(tile):
+    """
+    Returns the slices of a tile in the array of the tile with its halo.
+    """
+    return tuple(slice(int(f - g), int(l - g)) 
+                 for f, l, g in zip(tile['core_start'], tile['core_stop'], tile['halo_start']))
+
+def tile_overlaps(tile):
+    """
+    Returns the number of halo pixels to the left side and to the right side of a tile, as uint8 x, y and
+    z arrays like the "left_overlap" and "right_overlap" datasets of the sub-volume files.
+    """
+    return ((tile['core_start'] - tile['halo_start']).astype('uint8'),
+            (tile['halo_stop'] - tile['core_stop']).astype('uint8'))
+
+def tile_orig_indices(tile):
+    """
+    Returns the [x first, x last + 1, y first, y last + 1, z first, z last + 1] indices of a tile, 
+    like the "orig_indices" dataset of the sub-volume files.
+    """
+    return np.stack((tile['core_start'], tile['core_stop']), axis=-1).reshape(-1).astype('uint64')
+
+def write_tile_table(h5file, table, vol_shape, tile_shape, halo=0, halo_mode='clip', name='tile_table', 
+                     write=True):
+    """
+    Saves a table of tile_table() into a dataset of an open HDF5 file, with the arguments of tile_table()
+    in its attributes. A dataset of the same name is replaced. With Parallel HDF all processes must call 
+    it and only one should write (write=True).
+    """
+    if h5file.get(name, getclass=True):
+        h5file.__delitem__(name)
+    tile_ds = h5file.create_dataset(name, (len(table),), dtype=tile_dtype)
+    tile_ds.attrs['vol_shape'] = np.asarray(vol_shape, dtype='int64')
+    tile_ds.attrs['tile_shape'] = np.asarray(tile_shape, dtype='int64')
+    tile_ds.attrs['halo'] = int(halo)
+    tile_ds.attrs['halo_mode'] = np.bytes_(halo_mode)
+    if write and len(table):
+        tile_ds[...] = table
+    return tile_ds
+
+def read_tile_table(h5file, vol_shape, tile_shape, halo=0, halo_mode='clip', size=1, name='tile_table'):
+    """
+    Returns the table saved by write_tile_table() with its tiles given to "size" ranks, or None if the 
+    file does not have it or it was saved for other tile_table() arguments.
+    """
+    if not h5file.get(name, getclass=True):
+        return None
+    tile_ds = h5file[name]
+    attrs = tile_ds.attrs
+    if (tile_ds.dtype != tile_dtype or 'vol_shape' not in attrs or
+            not np.array_equal(attrs['vol_shape'], np.asarray(vol_shape, dtype='int64')) or
+            not np.array_equal(attrs['tile_shape'], np.asarray(tile_shape, dtype='int64')) or
+            int(attrs['halo']) != int(halo) or np.bytes_(attrs['halo_mode']) != np.bytes_(halo_mode)):
+        return None
+    return assign_owners(tile_ds[...], size)
+
+def load_tile_table(h5file, vol_shape, tile_shape, halo=0, halo_mode='clip', size=1, name='tile_table', 
+                    write=True):
+    """
+    Returns the table saved by write_tile_table() in an open HDF5 file. If the file does not have it or 
+    it was saved for other tile_table() arguments, the table is computed and saved. With Parallel HDF 
+    all processes must call it and only one should write (write=True).
+    """
+    table = read_tile_table(h5file, vol_shape, tile_shape, halo, halo_mode, size, name)
+    if table is None:
+        table = tile_table(vol_shape, tile_shape, halo, size, halo_mode)
+        write_tile_table(h5file, table, vol_shape, tile_shape, halo, halo_mode, name, write)
+    return table
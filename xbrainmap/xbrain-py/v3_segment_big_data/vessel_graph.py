@@ -0,0 +1,280 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+This module has the functions to extract the graph of the vessel centerlines from a vessel volume, 
+one tile at a time (see vessel_graph_mpi.py).
+
+The vessel mask of each tile and a halo around it is skeletonized, and the radius of the vessels at 
+the skeleton voxels is the distance to the nearest background voxel. Skeleton voxels with two skeleton
+neighbors are segment voxels, the others (ends and branch points) are node voxels. Connected node 
+voxels make a node and connected segment voxels make a segment, labeled across tiles with 
+global_labels.py. An edge joins the nodes touching a segment.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from scipy import ndimage as ndi
+from global_labels import forward_offsets, label_tile, relabel_volume
+from object_statistics import tile_statistics, reduce_statistics
+from task_scheduler import TaskScheduler
+
+try:
+    from skimage.morphology import skeletonize_3d as _skeletonize
+except ImportError:
+    # skeletonize() handles 3D volumes in newer versions of skimage.
+    from skimage.morphology import skeletonize as _skeletonize
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['volume_tiles',
+           'halo_box',
+           'skeletonize_tile',
+           'skeleton_parts',
+           'touching_label_pairs',
+           'graph_tables',
+           'extract_vessel_graph']
+
+def volume_tiles(shape, tile_shape):
+    """
+    Returns the [x first, x last + 1, y first, y last + 1, z first, z last + 1] indices ("orig_indices") 
+    of the tiles of at most tile_shape pixels covering a volume of shape "shape".
+    """
+    
+    ranges = [[(first, min(first + int(step), int(n))) for first in range(0, int(n), int(step))] 
+              for n, step in zip(shape, tile_shape)]
+    return [[x[0], x[1], y[0], y[1], z[0], z[1]] for x in ranges[0] for y in ranges[1] for z in ranges[2]]
+
+def halo_box(tile, halo, shape):
+    """
+    Returns the first and last + 1 index of a tile grown by "halo" pixels on every side and clipped to
+    the volume, and the slices of the tile in the grown box.
+    """
+    
+    first = [max(int(f) - halo, 0) for f in tile[0::2]]
+    last = [min(int(l) + halo, int(n)) for l, n in zip(tile[1::2], shape)]
+    core = tuple(slice(int(f) - g, int(l) - g) for f, l, g in zip(tile[0::2], tile[1::2], first))
+    return first, last, core
+
+def skeletonize_tile(mask, core):
+    """
+    Skeletonizes the vessel mask of a tile with its halo.
+    
+    Inputs:
+    mask - vessel mask of the tile and its halo.
+    core - slices of the tile in the mask.
+    
+    Output:
+    The uint8 skeleton of the tile, and the float32 vessel radius in pixels at the skeleton voxels 
+    (0 elsewhere). Near the tile faces the skeleton matches the skeleton of the volume when the halo is
+    wider than the vessels.
+    """
+    
+    skeleton = _skeletonize(mask)[core] > 0
+    radius = np.zeros(skeleton.shape, dtype='float32')
+    radius[skeleton] = ndi.distance_transform_edt(mask)[core][skeleton]
+    return skeleton.view('uint8'), radius
+
+def skeleton_parts(skeleton, core):
+    """
+    Splits the skeleton of a tile into node voxels and segment voxels.
+    
+    Inputs:
+    skeleton - skeleton of the tile with a one pixel halo.
+    core - slices of the tile in "skeleton".
+    
+    Output:
+    bool masks of the node voxels and of the segment voxels of the tile.
+    """
+    
+    skeleton = skeleton > 0
+    neighbors = ndi.convolve(skeleton.view('uint8'), np.ones((3, 3, 3), dtype='uint8'), mode='constant')[core]
+    skeleton = skeleton[core]
+    # The count includes the voxel itself.
+    segments = skeleton & (neighbors == 3)
+    return skeleton & ~segments, segments
+
+def touching_label_pairs(first, second, connectivity=3):
+    """
+    Returns the unique (first label, second label) pairs of neighbor voxels with a non zero label in
+    "first" and in "second".
+    """
+    
+    pairs = [np.zeros((0, 2), dtype='int64')]
+    for offset in forward_offsets(connectivity):
+        low = tuple(slice(max(-o, 0), n - max(o, 0)) for o, n in zip(offset, first.shape))
+        high = tuple(slice(max(o, 0), n - max(-o, 0)) for o, n in zip(offset, first.shape))
+        for a, b in ((first[low], second[high]), (first[high], second[low])):
+            touching = (a > 0) & (b > 0)
+            if np.any(touching):
+                pairs.append(np.stack((a[touching], b[touching]), axis=1).astype('int64'))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+def graph_tables(node_table, segment_table, pairs):
+    """
+    Builds the node and edge tables of the vessel graph.
+    
+    Inputs:
+    node_table, segment_table - tables of object_statistics.combine_statistics() of the nodes and of 
+                                the segments, the mean intensity is the mean vessel radius.
+    pairs - unique (node label, segment label) pairs of touching nodes and segments.
+    
+    Output:
+    dict of node columns: label, centroid, voxel_count, radius and degree.
+    dict of edge columns: node1, node2, segment, length (number of segment voxels + 1) and radius.
+    A segment touching one node is a loop (node1 == node2), segments touching more than two nodes 
+    give an edge from their first node to every other node and segments without nodes (closed loops)
+    have no edge.
+    """
+    
+    pairs = pairs[np.lexsort((pairs[:, 0], pairs[:, 1]))]
+    starts = np.flatnonzero(np.r_[True, pairs[1:, 1] != pairs[:-1, 1]]) if len(pairs) else np.zeros(0, dtype='int64')
+    first_nodes = pairs[starts, 0]
+    counts = np.diff(np.r_[starts, len(pairs)])
+    # Every node after the first node of a segment is joined to the first node.
+    others = np.ones(len(pairs), dtype=bool)
+    others[starts] = False
+    loops = starts[counts == 1]
+    node1 = np.concatenate((np.repeat(first_nodes, counts - 1), pairs[loops, 0]))
+    node2 = np.concatenate((pairs[others, 0], pairs[loops, 0]))
+    segment = np.concatenate((pairs[others, 1], pairs[loops, 1]))
+    order = np.argsort(segment, kind='mergesort')
+    node1, node2, segment = node1[order], node2[order], segment[order]
+    
+    edges = {'node1': node1.astype('uint32'),
+             'node2': node2.astype('uint32'),
+             'segment': segment.astype('uint32'),
+             'length': segment_table['voxel_count'][segment - 1] + 1,
+             'radius': segment_table['mean_intensity'][segment - 1]}
+    nodes = {'label': node_table['label'],
+             'centroid': node_table['centroid'],
+             'voxel_count': node_table['voxel_count'],
+             'radius': node_table['mean_intensity'],
+             'degree': (np.bincount(node1, minlength=len(node_table['label']) + 1) + 
+                        np.bincount(node2, minlength=len(node_table['label']) + 1))[1:]}
+    return nodes, edges
+
+def extract_vessel_graph(comm, vessel_ds, skeleton_file, tile_shape, halo, chunks=None, schedule='dynamic'):
+    """
+    Extracts the vessel graph of a volume. Must be called by all python processes, the tiles are handed 
+    out to them on demand (see task_scheduler.py) when they are skeletonized.
+    
+    Inputs:
+    comm - MPI communicator.
+    vessel_ds - vessel volume dataset, vessel voxels are non zero.
+    skeleton_file - open hdf5 file (opened by all python processes) for the "skeleton", "radius", 
+                    "nodes" and "segments" volume datasets.
+    tile_shape - shape of the tiles.
+    halo - number of pixels read around a tile when skeletonizing, should be larger than the vessel radius.
+    chunks - chunk shape of the volume datasets, whole x slices of a tile by default.
+    schedule - 'dynamic' or 'static' schedule of the TaskScheduler.
+    
+    Output:
+    The node and edge tables of graph_tables() on rank 0, None and None on the other ranks.
+    """
+    
+    rank = comm.Get_rank()
+    shape = tuple(int(n) for n in vessel_ds.shape)
+    tiles = volume_tiles(shape, tile_shape)
+    if chunks is None:
+        chunks = tuple(min(int(c), n) for c, n in zip((1,) + tuple(tile_shape[1:]), shape))
+    datasets = {}
+    for ds_name, dtype in (('skeleton', 'uint8'), ('radius', 'float32'), ('nodes', 'uint32'), ('segments', 'uint32')):
+        datasets[ds_name] = skeleton_file.create_dataset(ds_name, shape, dtype=dtype, chunks=chunks)
+    
+    def region(tile):
+        return np.s_[tile[0]:tile[1], tile[2]:tile[3], tile[4]:tile[5]]
+    
+    def grown(tile, pixels):
+        first, last, core = halo_box(tile, pixels, shape)
+        return np.s_[first[0]:last[0], first[1]:last[1], first[2]:last[2]], core
+    
+    # Tiles skeletonized by this process, it processes the same tiles in the next steps.
+    my_tiles = []
+    scheduler = TaskScheduler(comm, [np.prod(np.diff(tile)[0::2]) for tile in tiles], schedule)
+    for tile_idx in scheduler:
+        box, core = grown(tiles[tile_idx], halo)
+        skeleton, radius = skeletonize_tile(vessel_ds[box] > 0, core)
+        datasets['skeleton'][region(tiles[tile_idx])] = skeleton
+        datasets['radius'][region(tiles[tile_idx])] = radius
+        my_tiles.append(tile_idx)
+    scheduler.report('extract_vessel_graph')
+    # Neighbor tiles are read to find the skeleton neighbors of the voxels on the tile faces.
+    skeleton_file.flush()
+    comm.Barrier()
+    
+    parts = {'nodes': ([], []), 'segments': ([], [])}
+    for tile_idx in my_tiles:
+        tile = tiles[tile_idx]
+        box, core = grown(tile, 1)
+        nodes, segments = skeleton_parts(datasets['skeleton'][box], core)
+        radius = datasets['radius'][region(tile)]
+        for ds_name, mask in (('nodes', nodes), ('segments', segments)):
+            labels, count, sizes = label_tile(mask)
+            datasets[ds_name][region(tile)] = labels
+            parts[ds_name][0].append((tile_idx, tile, count, sizes))
+            parts[ds_name][1].append(tile_statistics(labels, count, tile[0::2], radius))
+    tables = {}
+    for ds_name in ('nodes', 'segments'):
+        count, tile_labels = relabel_volume(comm, datasets[ds_name], parts[ds_name][0])
+        tables[ds_name] = reduce_statistics(comm, parts[ds_name][1], tile_labels, count)
+        if rank == 0:
+            print("Number of vessel graph %s is %d" % (ds_name, count))
+    skeleton_file.flush()
+    comm.Barrier()
+    
+    pairs = [np.zeros((0, 2), dtype='int64')]
+    for tile_idx in my_tiles:
+        box, core = grown(tiles[tile_idx], 1)
+        pairs.append(touching_label_pairs(datasets['nodes'][box], datasets['segments'][box]))
+    pairs = comm.gather(np.unique(np.concatenate(pairs), axis=0), root=0)
+    if rank != 0:
+        return None, None
+    return graph_tables(tables['nodes'], tables['segments'], np.unique(np.concatenate(pairs), axis=0))
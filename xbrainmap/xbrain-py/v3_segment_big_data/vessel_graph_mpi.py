@@ -0,0 +1,125 @@
+#!/usr/bin/env python 
+
+# #########################################################################
+# Copyright (c) 2015, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2015. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+'''
+This module extracts the graph of the vessel centerlines from the volume file of vessel_post_proc.py.
+
+It creates two files in the post segmentation directory: "skeleton_vessel_*.h5" with the skeleton, 
+the vessel radius at the skeleton voxels and the labeled nodes and segments of the skeleton, and 
+"graph_vessel_*.h5" with a "nodes" group (label, centroid, voxel_count, radius, degree) and an "edges" 
+group (node1, node2, segment, length, radius) of datasets. See vessel_graph.py.
+
+Run it in MPI mode for a big dataset: mpirun -np 8 python vessel_graph_mpi.py
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os.path
+import time
+import h5py
+from mpi4py import MPI
+from segmentation_param import *
+from vessel_graph import extract_vessel_graph
+from subvolumes import plan_tiling, volume_chunks
+
+__author__ = "Mehdi Tondravi"
+__copyright__ = "Copyright (c) 2017, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['vessel_graph_mpi']
+
+def vessel_graph_mpi():
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = MPI.COMM_WORLD.Get_size()
+    start_time = int(time.time())
+    
+    # Get the "Vessel" label index
+    vessel_label_defined, vessel_label_idx = save_prob_map('Vessel')
+    if vessel_label_defined == False:
+        print("Vessel class is not labeled in the Ilastik training data file, no processing will take place")
+        return
+    ds_name = get_ilastik_labels()[vessel_label_idx]
+    par, name = os.path.split(post_seg_volume_location)
+    seg_volume_file = post_seg_volume_location + '/volume_vessel_' + name + '.h5'
+    skeleton_volume_file = post_seg_volume_location + '/skeleton_vessel_' + name + '.h5'
+    graph_file = post_seg_volume_location + '/graph_vessel_' + name + '.h5'
+    if not os.path.exists(seg_volume_file):
+        print("*** Did not find the vessel volume file %s, run vessel_post_proc.py first ***" % seg_volume_file)
+        return
+    
+    # Need Parallel HDF for faster processing. However the below test lets processing to continue even if
+    # Parallel HDF is not available.
+    if size == 1:
+        vol_img_file = h5py.File(seg_volume_file, 'r')
+        skeleton_file = h5py.File(skeleton_volume_file, 'w')
+    else:
+        vol_img_file = h5py.File(seg_volume_file, 'r', driver='mpio', comm=comm)
+        skeleton_file = h5py.File(skeleton_volume_file, 'w', driver='mpio', comm=comm)
+    vessel_ds = vol_img_file[ds_name]
+    if rank == 0:
+        print("Vessel volume file is %s, volume shape is %s and number of python processes is %d" % 
+              (seg_volume_file, vessel_ds.shape, size))
+    
+    nodes, edges = extract_vessel_graph(comm, vessel_ds, skeleton_file, plan_tiling()[0], vessel_skeleton_halo,
+                                        volume_chunks(vessel_ds.shape), task_schedule)
+    skeleton_file.close()
+    vol_img_file.close()
+    if rank == 0:
+        out_file = h5py.File(graph_file, 'w')
+        for group_name, table in (('nodes', nodes), ('edges', edges)):
+            group = out_file.create_group(group_name)
+            for column, data in table.items():
+                group.create_dataset(column, data=data)
+        out_file.attrs['volume_file'] = seg_volume_file
+        out_file.close()
+        print("Vessel graph with %d nodes and %d edges is saved in file %s" % 
+              (len(nodes['label']), len(edges['segment']), graph_file))
+    print("Time to execute vessel_graph_mpi() is %d seconds and rank is %d" % ((time.time() - start_time), rank))
+
+if __name__ == '__main__':
+    vessel_graph_mpi()
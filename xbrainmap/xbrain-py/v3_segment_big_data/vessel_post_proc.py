@@ -1,18 +1,24 @@
 #!/usr/bin/env python
 '''
-This module applies: binary_fill_holes(),morphology.erosion, morphology.dilation, morphology.label() 
-and remove_small_objects() to the segmented sub-volumes files. Then combines the sub-volumes datasets 
-into a new volume file.
+This module applies: binary_fill_holes(), ball_erosion() and ball_dilation() to the segmented 
+sub-volumes files and labels them. Then combines the sub-volumes datasets into a new 
+volume file, with labels unique in the volume and without the objects small in the
+volume (see global_labels.py).
 '''
 import os.path
 import numpy as np
 import h5py
 from scipy import ndimage as ndi
-from skimage import morphology
 from glob import glob
 from mpi4py import MPI
 import time
 from segmentation_param import *
+from subvolumes import volume_chunks
+from task_scheduler import TaskScheduler, file_costs
+from segmented_classes import read_segmented_class, read_intensity
+from global_labels import label_tile, relabel_volume
+from object_statistics import tile_statistics, reduce_statistics, write_statistics
+from ball_morphology import ball_erosion, ball_dilation
 import pdb
 
 # cell segmentation post processing
@@ -49,6 +55,7 @@ def vessel_seg_post_proc():
     # Create an hdf file to contain the post segmentation cell volume image.
     par, name = os.path.split(post_seg_volume_location)
     seg_volume_file = post_seg_volume_location + '/volume_vessel_' + name + '.h5'
+    stats_file = post_seg_volume_location + '/objects_vessel_' + name + '.h5'
     if rank == 0:
         print("Post segmentation directory is %s, number of file is %d and number of python processes is %d" % 
               (post_seg_volume_location, len(input_files), size))
@@ -70,15 +77,15 @@ def vessel_seg_post_proc():
     if rank == 0:
         print("Dataset name to apply post processing is %s" % ds_name)
     vol_seg_dataset = vol_img_file.create_dataset(ds_name, volume_ds_shape, dtype='uint32',
-                                                  chunks=(1, il_sub_vol_y, il_sub_vol_z))
-    iterations = int(len(input_files) / size) + (len(input_files) % size > 0)
-    for idx in range(iterations):
-        if (rank + (size * idx)) >= len(input_files):
-            print("\nBREAKING out, my rank is %d, number of files is %d, size is %d and idx is %d" % 
-                  (rank, len(input_files), size, idx))
-            break
-        print("*** Working on file %s and rank is %d ***" % (input_files[rank + size * idx], rank))
-        subvol_file = h5py.File(input_files[rank + size * idx], 'r')
+                                                  chunks=volume_chunks(volume_ds_shape))
+    # Sub-volumes written by this process, with their number of labels, and the statistics of their labels.
+    tiles = []
+    tile_stats = []
+    # Sub-volume files are handed out to the ranks on demand, largest first.
+    scheduler = TaskScheduler(comm, file_costs(input_files), task_schedule)
+    for idx in scheduler:
+        print("*** Working on file %s and rank is %d ***" % (input_files[idx], rank))
+        subvol_file = h5py.File(input_files[idx], 'r')
         # Retrieve indices into the whole volume.
         orig_idx_ds = subvol_file['orig_indices']
         orig_idx = orig_idx_ds[...]
@@ -89,24 +96,37 @@ def vessel_seg_post_proc():
         left_overlapds = subvol_file['left_overlap']
         leftoverlap = left_overlapds[...]
         
-        myds = subvol_file[ds_name]
-        subvoldata = myds[...]
+        # Only the pixels of this class are needed.
+        subvoldata = read_segmented_class(subvol_file, ds_name, binary=True)
         x_dim = subvoldata.shape[0]
         y_dim = subvoldata.shape[1]
         z_dim = subvoldata.shape[2]
-        subvoldata = subvoldata > 0
         subvoldata = ndi.binary_fill_holes(subvoldata)
-        subvoldata = morphology.erosion(subvoldata, morphology.ball(2))
-        subvoldata = morphology.dilation(subvoldata, morphology.ball(2))
+        subvoldata = ball_erosion(subvoldata, 2, morphology_backend)
+        subvoldata = ball_dilation(subvoldata, 2, morphology_backend)
         subvoldata = ndi.binary_fill_holes(subvoldata)
-        subvoldata = morphology.remove_small_objects(subvoldata, MINSZ_VESSEL, connectivity=2)
-        subvoldata = morphology.label(subvoldata.astype('uint32'))
-        
-        vol_seg_dataset[orig_idx[0]:orig_idx[1], orig_idx[2]:orig_idx[3], orig_idx[4]:orig_idx[5]] = \
-            subvoldata[leftoverlap[0] : x_dim - rightoverlap[0],
-                       leftoverlap[1] : y_dim - rightoverlap[1],
-                       leftoverlap[2] : z_dim - rightoverlap[2]]
+        # Label only the part of the sub-volume owned by it, labels are made unique by relabel_volume().
+        subvoldata, num_labels, label_sizes = label_tile(subvoldata[leftoverlap[0] : x_dim - rightoverlap[0],
+                                                       leftoverlap[1] : y_dim - rightoverlap[1],
+                                                       leftoverlap[2] : z_dim - rightoverlap[2]])
+        vol_seg_dataset[orig_idx[0]:orig_idx[1], orig_idx[2]:orig_idx[3], orig_idx[4]:orig_idx[5]] = subvoldata
+        tiles.append((idx, orig_idx, num_labels, label_sizes))
+        intensity = read_intensity(subvol_file, ds_name, np.s_[leftoverlap[0] : x_dim - rightoverlap[0],
+                                                              leftoverlap[1] : y_dim - rightoverlap[1],
+                                                              leftoverlap[2] : z_dim - rightoverlap[2]])
+        tile_stats.append(tile_statistics(subvoldata, num_labels, orig_idx[0::2], intensity))
         subvol_file.close()
+    scheduler.report('vessel_post_proc')
+    # Objects split between sub-volumes get one label of the volume, objects smaller than MINSZ_VESSEL voxels in
+    # the volume are removed.
+    num_objects, tile_labels = relabel_volume(comm, vol_seg_dataset, tiles, min_size=MINSZ_VESSEL)
+    if rank == 0:
+        print("Number of objects in the volume is %d" % num_objects)
+    # Table of object statistics next to the volume file.
+    table = reduce_statistics(comm, tile_stats, tile_labels, num_objects)
+    if rank == 0:
+        write_statistics(stats_file, table, {'volume_file': seg_volume_file, 'dataset': ds_name})
+        print("Object statistics are saved in file %s" % stats_file)
     vol_img_file.close()
     print("Time to execute vessel_seg_post_proc() is %d seconds and rank is %d" % ((time.time() - start_time), rank))
 